@@ -0,0 +1,98 @@
+# Compares the NumPy analytics pass with the same aggregates computed in a
+# plain Python loop, at growing numbers of daily rollup rows (habit-days).
+#
+#   python benchmarks/bench_analytics.py --rows 1000000 10000000
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from common import load_app
+
+def build_rollups(module, rows, habits):
+    module.ensure_db_initialized(module.app.config['DATABASE'])
+    conn = module.open_connection()
+    conn.executemany('INSERT INTO habits (description, amount) VALUES (?, ?)',
+                     [(f'Habit {i}', 1.0) for i in range(habits)])
+
+    # Every habit completed on every day, ending today
+    days = -(-rows // habits)
+    start = date.today() - timedelta(days=days - 1)
+    day_strings = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    random.seed(1)
+    conn.executemany('INSERT INTO daily_rollups (habit_id, day, count, quantity, earned) VALUES (?, ?, ?, ?, ?)',
+                     ((habit_id, day_strings[i // habits], 1, 1, random.choice((0.5, 1.0, 2.5)))
+                      for habit_id, i in ((i % habits + 1, i) for i in range(rows))))
+    # The per-habit totals the ledger summary would hold had these been logged
+    conn.execute("""
+        INSERT INTO ledger_summary (scope, key, total)
+        SELECT 'habit', habit_id, SUM(earned) FROM daily_rollups GROUP BY habit_id
+    """)
+    conn.commit()
+    conn.close()
+
+# The aggregates compute_analytics() produces, one row at a time
+def python_analytics(conn, today):
+    daily = defaultdict(float)
+    weekly = defaultdict(float)
+    monthly = defaultdict(float)
+    per_habit = defaultdict(float)
+    total = 0.0
+    for habit_id, day, earned, count in conn.execute('SELECT habit_id, day, earned, count FROM daily_rollups'):
+        d = date.fromisoformat(day)
+        daily[d] += earned
+        weekly[d - timedelta(days=d.weekday())] += earned
+        monthly[day[:7]] += earned
+        per_habit[habit_id] += earned
+        total += earned
+
+    first = min(daily)
+    series = [daily.get(first + timedelta(days=i), 0.0) for i in range((today - first).days + 1)]
+    rolling_7, rolling_30, window_7, window_30 = [], [], 0.0, 0.0
+    for i, value in enumerate(series):
+        window_7 += value - (series[i - 7] if i >= 7 else 0.0)
+        window_30 += value - (series[i - 30] if i >= 30 else 0.0)
+        rolling_7.append(window_7 / 7)
+        rolling_30.append(window_30 / 30)
+    shares = {habit_id: value / total for habit_id, value in per_habit.items()}
+    return sum(series[-30:]) / 30, rolling_7, rolling_30, weekly, monthly, shares
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000],
+                        help='Daily rollup rows for each run')
+    parser.add_argument('--habits', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'numpy':>10} {'python':>10} {'speedup':>8} {'cached':>10}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            module = load_app(os.path.join(tmp, 'bench.db'))
+            with module.app.app_context():
+                build_rollups(module, rows, args.habits)
+                conn = module.open_connection()
+                today = date.today()
+                vectorized = min(timed(lambda: module.compute_analytics(conn, today)) for _ in range(args.repeat))
+                looped = min(timed(lambda: python_analytics(conn, today)) for _ in range(args.repeat))
+                conn.close()
+
+            # The first request computes, later ones reuse the result until a write
+            client = module.app.test_client()
+            client.get('/api/analytics')
+            cached = min(timed(lambda: client.get('/api/analytics')) for _ in range(args.repeat))
+
+            print(f"{rows:>10} {vectorized:>8.0f}ms {looped:>8.0f}ms {looped / vectorized:>7.1f}x {cached:>8.2f}ms")
+            with module.app.app_context():
+                module.get_pool().close_all()
+
+if __name__ == '__main__':
+    main()
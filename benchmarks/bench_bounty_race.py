@@ -0,0 +1,118 @@
+# Stress test for bounty completion: worker processes fire thousands of
+# completions in parallel, every bounty targeted by several requests at once
+# (half of them sharing an idempotency key, like a retried request). Checks
+# that each bounty was paid out exactly once and reports completion latency.
+# --unguarded runs the old read-then-update completion for comparison.
+#
+#   python benchmarks/bench_bounty_race.py --bounties 1000 --racers 4 --processes 4 --threads 8
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app, summarize
+
+# The completion as it was: a plain read, then an update and payout without
+# checking the bounty was still open
+def complete_unguarded(module, bounty_id):
+    with module.app.app_context():
+        conn = module.get_db_connection()
+        bounty = conn.execute('SELECT id, description, amount FROM bounties WHERE id = ?', (bounty_id,)).fetchone()
+        conn.execute('UPDATE bounties SET completed = 1 WHERE id = ?', (bounty_id,))
+        module.record_transaction(conn, -1, bounty['amount'], 1, module.local_today().isoformat(),
+                                  bounty_description=bounty['description'], bounty_id=bounty['id'])
+        module.commit_changes(conn)
+    return 200
+
+def race(path, jobs, threads, unguarded, start, results):
+    module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0)
+    client = module.app.test_client()
+
+    def fire(job):
+        bounty_id, racer = job
+        started = time.perf_counter()
+        try:
+            if unguarded:
+                status = complete_unguarded(module, bounty_id)
+            else:
+                headers = {'Accept': 'application/json'}
+                if racer % 2:
+                    headers['Idempotency-Key'] = f'race-{bounty_id}'
+                status = client.post(f'/complete_bounty/{bounty_id}', headers=headers).status_code
+        except Exception as e:
+            status = type(e).__name__
+        return status, (time.perf_counter() - started) * 1000
+
+    start.wait()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results.put(list(executor.map(fire, jobs)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bounties', type=int, default=1000)
+    parser.add_argument('--racers', type=int, default=4, help='Concurrent completions of each bounty')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='Threads per process')
+    parser.add_argument('--unguarded', action='store_true', help='Use the old completion logic instead')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0)
+        with module.app.app_context():
+            module.ensure_db_initialized(path)
+            conn = module.open_connection()
+            conn.executemany("INSERT INTO bounties (description, amount, date_created, completed) VALUES (?, ?, '2024-01-01', 0)",
+                             [(f'Bounty {i}', 5.0) for i in range(args.bounties)])
+            conn.commit()
+            conn.close()
+
+        # Every racer for a bounty goes to a different process where possible,
+        # so they really do run at the same time
+        random.seed(1)
+        jobs = [[] for _ in range(args.processes)]
+        for bounty_id in range(1, args.bounties + 1):
+            for racer in range(args.racers):
+                jobs[(bounty_id + racer) % args.processes].append((bounty_id, racer))
+        for chunk in jobs:
+            random.shuffle(chunk)
+
+        start = multiprocessing.Barrier(args.processes)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=race, args=(path, chunk, args.threads, args.unguarded, start, results))
+                   for chunk in jobs]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        outcomes = [outcome for _ in workers for outcome in results.get()]
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+        with module.app.app_context():
+            conn = module.open_connection()
+            payouts = Counter(dict(conn.execute(
+                'SELECT bounty_id, COUNT(*) FROM transactions WHERE habit_id = -1 GROUP BY bounty_id').fetchall()))
+            balance = module.get_balance(conn)
+            drift = module.check_ledger_summary(conn)
+            conn.close()
+
+    latency = summarize([ms for status, ms in outcomes])
+    statuses = Counter(status for status, ms in outcomes)
+    paid_twice = sum(1 for count in payouts.values() if count > 1)
+    print(f"{len(outcomes)} completions of {args.bounties} bounties from {args.processes} processes x "
+          f"{args.threads} threads in {elapsed:.1f}s")
+    print('responses: ' + ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items(), key=str)))
+    print(f"latency: p50 {latency['p50_ms']:.1f}ms, p95 {latency['p95_ms']:.1f}ms, "
+          f"p99 {latency['p99_ms']:.1f}ms, max {max(ms for status, ms in outcomes):.1f}ms")
+    print(f"bounties paid: {len(payouts)} of {args.bounties}, paid more than once: {paid_twice}, "
+          f"balance {balance:.2f} (expected {args.bounties * 5.0:.2f}), ledger drift: {len(drift)}")
+    if len(payouts) != args.bounties or paid_twice or drift:
+        raise SystemExit('Bounties were not paid out exactly once')
+
+if __name__ == '__main__':
+    main()
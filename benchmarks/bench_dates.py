@@ -0,0 +1,87 @@
+# Compares the integer epoch-day indexes on transactions with the TEXT date
+# indexes they replaced: size on disk and the speed of date range scans.
+#
+#   python benchmarks/bench_dates.py --transactions 1000000
+import argparse
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+
+from common import load_app, summarize, time_calls
+
+# (index name, columns) for the old TEXT date indexes and their replacements
+INDEXES = {
+    'text': [('idx_bench_date', 'date'), ('idx_bench_habit_date', 'habit_id, date')],
+    'epoch day': [('idx_transactions_day', 'day'), ('idx_transactions_habit_day', 'habit_id, day')],
+}
+
+def build_ledger(module, transactions, habits, days):
+    module.ensure_db_initialized(module.app.config['DATABASE'])
+    conn = module.open_connection()
+    conn.executemany('INSERT INTO habits (description, amount) VALUES (?, ?)',
+                     [(f'Habit {i}', 1.0) for i in range(habits)])
+
+    random.seed(1)
+    start = date.today() - timedelta(days=days)
+    dates = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    for offset in range(0, transactions, 100000):
+        module.record_transactions(conn, [
+            (random.randint(1, habits), 1.0, 1, dates[(offset + i) * days // transactions], None, None)
+            for i in range(min(100000, transactions - offset))
+        ])
+        conn.commit()
+
+    # Recreate the pre-migration TEXT indexes alongside the new ones
+    for name, columns in INDEXES['text']:
+        conn.execute(f'CREATE INDEX {name} ON transactions ({columns})')
+    conn.execute('ANALYZE')
+    conn.commit()
+    return conn, start
+
+def index_size(conn, name):
+    return conn.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ?', (name,)).fetchone()[0]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--habits', type=int, default=20)
+    parser.add_argument('--days', type=int, default=1825)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        module = load_app(os.path.join(tmp, 'bench.db'), HABIT_TRACKER_INSTRUMENTATION=0)
+        with module.app.app_context():
+            conn, start = build_ledger(module, args.transactions, args.habits, args.days)
+
+            print(f"{'index':<28} {'size':>10}")
+            for kind, indexes in INDEXES.items():
+                for name, columns in indexes:
+                    print(f"{kind + ' (' + columns + ')':<28} {index_size(conn, name) / 1e6:>8.1f}MB")
+            print()
+
+            end = start + timedelta(days=args.days - 1)
+            ranges = {'7 days': end - timedelta(days=6), '30 days': end - timedelta(days=29),
+                      '365 days': end - timedelta(days=364)}
+            print(f"{'range scan':<28} {'text p50':>10} {'day p50':>10}")
+            for label, first in ranges.items():
+                for habit in (False, True):
+                    results = []
+                    for kind, encode in (('text', str), ('epoch day', module.epoch_day)):
+                        name, column = INDEXES[kind][1 if habit else 0][0], 'date' if kind == 'text' else 'day'
+                        clauses, params = module.date_range_filter(first.isoformat(), end.isoformat(),
+                                                                   column=column, encode=encode)
+                        if habit:
+                            clauses.insert(0, 'habit_id = ?')
+                            params.insert(0, 1)
+                        sql = (f'SELECT COUNT(*), SUM(amount * quantity) FROM transactions INDEXED BY {name} '
+                               f'WHERE {" AND ".join(clauses)}')
+                        results.append(summarize(time_calls(lambda: conn.execute(sql, params).fetchone(),
+                                                            args.repeat)))
+                    scope = label + (', one habit' if habit else '')
+                    print(f"{scope:<28} {results[0]['p50_ms']:>8.2f}ms {results[1]['p50_ms']:>8.2f}ms")
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Time to first byte, total time and peak memory of the home page as the
+# habit and bounty lists grow, rendered whole against streamed from cursors.
+# Each case runs in a fresh process so its peak RSS is its own.
+#
+#   python benchmarks/bench_index_stream.py --rows 1000 10000 100000
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from common import load_app, summarize
+
+MODES = {'rendered': 10 ** 9, 'streamed': 0}  # INDEX_STREAM_ROWS for each
+
+def build_lists(path, rows):
+    module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0, HABIT_TRACKER_SCHEDULER=0)
+    with module.app.app_context():
+        module.build()
+        module.ensure_db_initialized(path)
+        conn = module.open_connection()
+        conn.executemany('INSERT INTO habits (description, amount) VALUES (?, 1.5)',
+                         [(f'Habit number {i} with a longer description',) for i in range(rows // 2)])
+        conn.executemany("INSERT INTO bounties (description, amount, date_created, completed) VALUES (?, 5, '2024-01-01', 0)",
+                         [(f'Bounty number {i} with a longer description',) for i in range(rows - rows // 2)])
+        conn.commit()
+        conn.close()
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Request the page `repeat` times, timing the first chunk and the whole body
+def measure(path, stream_rows, repeat, results):
+    module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0, HABIT_TRACKER_SCHEDULER=0,
+                      HABIT_TRACKER_INDEX_CACHE=0, HABIT_TRACKER_INDEX_STREAM_ROWS=stream_rows)
+    client = module.app.test_client()
+    module.app.jinja_env.get_template('index.html')  # Compile it before taking the baseline
+    baseline = peak_rss_mb()
+
+    first_byte, total, size = [], [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get('/', buffered=False)
+        chunks = iter(response.response)
+        size = len(next(chunks))
+        first_byte.append((time.perf_counter() - started) * 1000)
+        size += sum(len(chunk) for chunk in chunks)
+        response.close()
+        total.append((time.perf_counter() - started) * 1000)
+    results.put((summarize(first_byte), summarize(total), size, peak_rss_mb() - baseline))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Habits and active bounties together')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{'rows':>8} {'mode':<9} {'page':>8} {'ttfb p50':>10} {'total p50':>10} {'peak rss +':>11}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_lists(path, rows)
+            for mode, stream_rows in MODES.items():
+                results = context.Queue()
+                worker = context.Process(target=measure, args=(path, stream_rows, args.repeat, results))
+                worker.start()
+                first_byte, total, size, rss = results.get()
+                worker.join()
+                print(f"{rows:>8} {mode:<9} {size / 1e6:>6.1f}MB {first_byte['p50_ms']:>8.1f}ms "
+                      f"{total['p50_ms']:>8.1f}ms {rss:>9.1f}MB")
+
+if __name__ == '__main__':
+    main()
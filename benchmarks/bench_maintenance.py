@@ -0,0 +1,152 @@
+# Request latency while the maintenance jobs run in the background, split by
+# which job (if any) was running when each request started. Several
+# scheduler processes contend for every job the way `flask serve` workers
+# do, each running them all in turn with a pause between runs; the script
+# checks that no job ever ran in two of them at once.
+#
+#   python benchmarks/bench_maintenance.py --transactions 200000 --schedulers 3 --seconds 20
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app, summarize
+
+HEADERS = {'Accept': 'application/json'}
+
+# Run every job in turn until the deadline, pausing `pause` seconds after
+# each one. Returns (job, start, end, status) per run, timed
+# around the job itself so the claim and release aren't counted.
+def maintain(path, seconds, pause, start, results):
+    module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0, HABIT_TRACKER_SCHEDULER=0)
+    spans = []
+
+    def timed(name, job):
+        def run(conn):
+            started = time.time()
+            try:
+                return job(conn)
+            finally:
+                spans.append((name, started, time.time()))
+        return run
+
+    for name, (schedule, job) in module.MAINTENANCE_JOBS.items():
+        module.MAINTENANCE_JOBS[name] = (schedule, timed(name, job))
+
+    runs = []
+    with module.app.app_context():
+        schedules = module.job_schedules('')
+        owner = f'bench:{os.getpid()}'
+        conn = module.open_jobs_db()
+        module.register_jobs(conn, schedules, time.time())
+        conn.close()
+        start.wait()
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            for name in module.MAINTENANCE_JOBS:
+                conn = module.open_jobs_db()
+                try:
+                    for job, status, result in module.run_due_jobs(conn, owner, schedules, name):
+                        runs.append((job, *spans[-1][1:], status))
+                finally:
+                    conn.close()
+                time.sleep(pause)
+    results.put(runs)
+
+# Log completions and load the home page from `threads` threads. Returns
+# (start, milliseconds) per request.
+def load(module, seconds, threads, habits):
+    client = module.app.test_client()
+    deadline = time.perf_counter() + seconds
+
+    def worker(_):
+        timings = []
+        while time.perf_counter() < deadline:
+            started, timer = time.time(), time.perf_counter()
+            if random.random() < 0.5:
+                client.post('/add_transaction', headers=HEADERS,
+                            data={'habit_id': random.randint(1, habits), 'amount': 1, 'quantity': 1})
+            else:
+                client.get('/')
+            timings.append((started, (time.perf_counter() - timer) * 1000))
+        return timings
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return [ms for timings in executor.map(worker, range(threads)) for ms in timings]
+
+def overlaps(runs):
+    by_job = {}
+    for job, started, finished, status in runs:
+        by_job.setdefault(job, []).append((started, finished))
+    count = 0
+    for spans in by_job.values():
+        spans.sort()
+        count += sum(1 for a, b in zip(spans, spans[1:]) if b[0] < a[1])
+    return count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--habits', type=int, default=20)
+    parser.add_argument('--schedulers', type=int, default=3, help='Processes competing to run the jobs')
+    parser.add_argument('--threads', type=int, default=4, help='Request threads')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--pause', type=float, default=0.5, help='Seconds each scheduler waits between jobs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0, HABIT_TRACKER_SCHEDULER=0)
+        with module.app.app_context():
+            module.build()
+            module.ensure_db_initialized(path)
+            conn = module.open_connection()
+            conn.executemany('INSERT INTO habits (description, amount) VALUES (?, 1.0)',
+                             [(f'Habit {i}',) for i in range(args.habits)])
+            random.seed(1)
+            module.record_transactions(conn, [(random.randint(1, args.habits), 1.0, 1,
+                                               f'2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}',
+                                               None, None) for _ in range(args.transactions)])
+            conn.commit()
+            conn.close()
+
+        start = multiprocessing.Barrier(args.schedulers + 1)
+        results = multiprocessing.Queue()
+        schedulers = [multiprocessing.Process(target=maintain, args=(path, args.seconds, args.pause, start, results))
+                      for _ in range(args.schedulers)]
+        for scheduler in schedulers:
+            scheduler.start()
+        start.wait()
+        requests = load(module, args.seconds, args.threads, args.habits)
+        runs = [run for _ in schedulers for run in results.get()]
+        for scheduler in schedulers:
+            scheduler.join()
+
+    # The job each request overlapped, if any
+    latency = {}
+    for started, ms in requests:
+        running = [job for job, first, last, status in runs if first <= started <= last]
+        latency.setdefault(running[0] if running else 'none', []).append(ms)
+
+    print(f"{'running job':<20} {'runs':>6} {'job p50':>9} {'job max':>9} {'requests':>9} {'req p50':>9} "
+          f"{'req p99':>9}")
+    for name in ['none', *module.MAINTENANCE_JOBS]:
+        durations = [(last - first) * 1000 for job, first, last, status in runs if job == name]
+        jobs = f"{len(durations):>6} {summarize(durations)['p50_ms']:>7.1f}ms {max(durations):>7.1f}ms" \
+            if durations else f"{'-':>6} {'-':>9} {'-':>9}"
+        timings = latency.get(name)
+        served = f"{len(timings):>9} {summarize(timings)['p50_ms']:>7.1f}ms {summarize(timings)['p99_ms']:>7.1f}ms" \
+            if timings else f"{0:>9} {'-':>9} {'-':>9}"
+        print(f'{name:<20} {jobs} {served}')
+    failed = sum(1 for job, first, last, status in runs if status != 'ok')
+    overlapping = overlaps(runs)
+    print(f'\n{len(runs)} job runs from {args.schedulers} processes, {failed} failed, '
+          f'{overlapping} overlapping runs of one job')
+    if overlapping:
+        raise SystemExit('A job ran in two processes at once')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Compares /api/search's FTS5 lookups with the LIKE '%...%' scans they
+# replace, over a ledger of bounties and their payouts. Every match is
+# ranked, so a search costs more the more entries it matches.
+#
+#   python benchmarks/bench_search.py --bounties 200000
+import argparse
+import os
+import random
+import tempfile
+
+from common import load_app, summarize, time_calls
+
+WORDS = ('clean', 'garage', 'kitchen', 'read', 'novel', 'french', 'spanish', 'guitar', 'practice', 'run',
+         'marathon', 'meditate', 'journal', 'laundry', 'groceries', 'paint', 'fence', 'taxes', 'study', 'yoga')
+
+def build_ledger(module, bounties, vocabulary):
+    module.ensure_db_initialized(module.app.config['DATABASE'])
+    conn = module.open_connection()
+    random.seed(1)
+    # A few common words and a long tail of rarer ones, like real descriptions
+    rare = [''.join(random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(7)) for _ in range(vocabulary)]
+    descriptions = [' '.join(random.choice(WORDS if random.random() < 0.5 else rare) for _ in range(4))
+                    for _ in range(bounties)]
+    conn.executemany('INSERT INTO bounties (description, amount, date_created, completed) VALUES (?, 5, ?, 1)',
+                     ((description, '2024-01-01') for description in descriptions))
+    # Half of them paid out, which copies the description onto the transaction
+    module.record_transactions(conn, [(-1, 5.0, 1, '2024-01-01', description, bounty_id)
+                                      for bounty_id, description in enumerate(descriptions, 1) if bounty_id % 2])
+    conn.commit()
+    return conn, rare
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bounties', type=int, default=200000)
+    parser.add_argument('--vocabulary', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        module = load_app(os.path.join(tmp, 'bench.db'), HABIT_TRACKER_INSTRUMENTATION=0)
+        with module.app.app_context():
+            conn, rare = build_ledger(module, args.bounties, args.vocabulary)
+            entries = conn.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]
+            print(f'{entries} searchable entries\n')
+
+            queries = {'common word': 'garage', 'common prefix': 'gar', 'two words': 'clean gar',
+                       'rare word': rare[0], 'no match': 'zzzzqx'}
+            print(f"{'query':<16} {'matches':>8} {'fts p50':>10} {'next page':>10} {'like p50':>10}")
+            for label, text in queries.items():
+                matches = conn.execute('SELECT COUNT(*) FROM search_index WHERE search_index MATCH ?',
+                                       (module.build_search_query(text),)).fetchone()[0]
+                results, cursor = module.search(conn, text, limit=20)
+                fts = summarize(time_calls(lambda: module.search(conn, text, limit=20), args.repeat))
+                after = module.parse_search_cursor(cursor)
+                paged = summarize(time_calls(lambda: module.search(conn, text, after=after, limit=20),
+                                             args.repeat))
+                # Without the index, ranking or paging the matches means finding all
+                # of them with a scan of every description
+                like = ' AND '.join(['description LIKE ?'] * len(text.split()))
+                params = [f'%{word}%' for word in text.split()]
+                scan = summarize(time_calls(lambda: conn.execute(f'''
+                    SELECT id FROM bounties WHERE {like} UNION ALL
+                    SELECT id FROM transactions WHERE {like.replace('description', 'bounty_description')}
+                ''', params * 2).fetchall(), args.repeat))
+                print(f"{label:<16} {matches:>8} {fts['p50_ms']:>8.2f}ms {paged['p50_ms']:>8.2f}ms "
+                      f"{scan['p50_ms']:>8.2f}ms")
+            conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Write throughput as writers are added: every writer committing to one
+# shared database, against each writer committing to a shard of its own as in
+# multi-tenant mode. Writers are separate processes, like `flask serve` workers.
+#
+#   python benchmarks/bench_shards.py --writers 1 2 4 8 --seconds 3
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from common import load_app
+
+# Commit one completion at a time for `seconds`, as the add_transaction route
+# does, and report how many went through
+def write(path, seconds, start, results):
+    module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0)
+    with module.app.app_context():
+        conn = module.open_connection()
+        today = module.local_today().isoformat()
+        start.wait()
+        commits = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            conn.execute('BEGIN IMMEDIATE')
+            module.record_transaction(conn, 1, 1.0, 1, today)
+            module.commit_changes(conn)
+            commits += 1
+        conn.close()
+    results.put(commits)
+
+def prepare(path):
+    module = load_app(path, HABIT_TRACKER_INSTRUMENTATION=0)
+    with module.app.app_context():
+        module.ensure_db_initialized(path)
+        conn = module.open_connection()
+        conn.execute("INSERT INTO habits (description, amount) VALUES ('Bench habit', 1.0)")
+        conn.commit()
+        conn.close()
+
+def run(paths, seconds):
+    start = multiprocessing.Barrier(len(paths))
+    results = multiprocessing.Queue()
+    writers = [multiprocessing.Process(target=write, args=(path, seconds, start, results)) for path in paths]
+    for writer in writers:
+        writer.start()
+    commits = sum(results.get() for _ in writers)
+    for writer in writers:
+        writer.join()
+    return commits / seconds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    print(f"{'writers':>8} {'one database':>14} {'one shard each':>16} {'speedup':>8}")
+    for writers in args.writers:
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = os.path.join(tmp, 'shared.db')
+            shards = [os.path.join(tmp, f'user-{i}.db') for i in range(writers)]
+            for path in [shared] + shards:
+                prepare(path)
+            single = run([shared] * writers, args.seconds)
+            sharded = run(shards, args.seconds)
+            print(f'{writers:>8} {single:>12.0f}/s {sharded:>14.0f}/s {sharded / single:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Measures what a freshly spawned worker pays before it can answer: importing
+# the app, create_app(), and the first request (which runs the lazy schema
+# check). Each sample runs in a new interpreter so nothing is cached.
+#
+#   python benchmarks/bench_startup.py --runs 20
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import APP_PATH
+
+def child(db_path):
+    started = time.perf_counter()
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('habit_app', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+    
+    app = module.create_app({'DATABASE': db_path})
+    created = time.perf_counter()
+    
+    client = app.test_client()
+    client.get('/readyz')
+    first = time.perf_counter()
+    client.get('/readyz')
+    second = time.perf_counter()
+    
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': (first - created) * 1000,
+        'second_request_ms': (second - first) * 1000,
+    }))
+
+def sample(db_path):
+    output = subprocess.run([sys.executable, __file__, '--child', db_path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        child(args.child)
+        return
+    
+    print(f"{'database':>10} {'import':>9} {'create_app':>11} {'1st request':>12} {'2nd request':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ('new', 'existing'):
+            samples = []
+            for run in range(args.runs):
+                db_path = os.path.join(tmp, f'{label}-{run}.db' if label == 'new' else 'existing.db')
+                samples.append(sample(db_path))
+            medians = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+            print(f"{label:>10} {medians['import_ms']:>7.1f}ms {medians['create_app_ms']:>9.2f}ms "
+                  f"{medians['first_request_ms']:>10.2f}ms {medians['second_request_ms']:>10.2f}ms")
+
+if __name__ == '__main__':
+    main()
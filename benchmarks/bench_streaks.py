@@ -0,0 +1,53 @@
+# Shows that viewing streaks costs the same however long a habit's history is.
+#
+#   python benchmarks/bench_streaks.py --history 1000 10000 100000
+import argparse
+import os
+import tempfile
+from datetime import date, timedelta
+
+from common import load_app, summarize, time_calls
+
+def build_history(module, habits, rows_per_habit):
+    module.ensure_db_initialized(module.app.config['DATABASE'])
+    conn = module.open_connection()
+    conn.executemany('INSERT INTO habits (description, amount) VALUES (?, ?)',
+                     [(f'Habit {i}', 1.0) for i in range(habits)])
+    
+    # A few completions a day, ending yesterday so today's insert extends the streak
+    start = date.today() - timedelta(days=rows_per_habit // 3 + 1)
+    habit_ids = [row['id'] for row in conn.execute('SELECT id FROM habits')]
+    rows = [(habit_id, 1.0, 1, (start + timedelta(days=i // 3)).isoformat(), None, None)
+            for habit_id in habit_ids for i in range(rows_per_habit)]
+    module.record_transactions(conn, rows)
+    conn.commit()
+    conn.close()
+    return habit_ids
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--history', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Transactions per habit for each run')
+    parser.add_argument('--habits', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    
+    print(f"{'rows/habit':>10} {'view p50':>10} {'view p95':>10} {'log p50':>10} {'log p95':>10}")
+    for rows_per_habit in args.history:
+        with tempfile.TemporaryDirectory() as tmp:
+            module = load_app(os.path.join(tmp, 'bench.db'))
+            with module.app.app_context():
+                habit_ids = build_history(module, args.habits, rows_per_habit)
+            client = module.app.test_client()
+            
+            view = summarize(time_calls(lambda: client.get('/api/streaks'), args.repeat))
+            log = summarize(time_calls(lambda: client.post('/add_transaction', data={
+                'habit_id': habit_ids[0], 'amount': 1, 'quantity': 1}), args.repeat))
+            
+            print(f"{rows_per_habit:>10} {view['p50_ms']:>9.2f}ms {view['p95_ms']:>9.2f}ms "
+                  f"{log['p50_ms']:>9.2f}ms {log['p95_ms']:>9.2f}ms")
+            with module.app.app_context():
+                module.get_pool().close_all()
+
+if __name__ == '__main__':
+    main()
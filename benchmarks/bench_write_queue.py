@@ -0,0 +1,84 @@
+# Compares sustained /add_transaction throughput with one commit per request
+# against the group-commit writer (HABIT_TRACKER_WRITE_BEHIND=1).
+#
+#   python benchmarks/bench_write_queue.py --clients 16 --requests 200
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import load_app, summarize
+
+def run(write_behind, clients, requests_per_client, synchronous):
+    with tempfile.TemporaryDirectory() as tmp:
+        module = load_app(os.path.join(tmp, 'bench.db'),
+                          HABIT_TRACKER_WRITE_BEHIND=int(write_behind),
+                          HABIT_TRACKER_INDEX_CACHE=0)
+        
+        with module.app.app_context():
+            module.ensure_db_initialized(module.app.config['DATABASE'])
+            conn = module.open_connection()
+            conn.execute("INSERT INTO habits (description, amount) VALUES ('Bench', 1.0)")
+            conn.commit()
+            conn.close()
+        
+        # Per-request connections use the same durability as the group writer
+        # when comparing like for like
+        if synchronous:
+            original_open = module.open_connection
+            def open_connection(path=None):
+                conn = original_open(path)
+                conn.execute(f'PRAGMA synchronous = {synchronous}')
+                return conn
+            module.open_connection = open_connection
+        
+        timings = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(clients + 1)
+        
+        def client():
+            test_client = module.app.test_client()
+            local = []
+            start_barrier.wait()
+            for _ in range(requests_per_client):
+                started = time.perf_counter()
+                test_client.post('/add_transaction', data={'habit_id': 1, 'amount': 1, 'quantity': 1})
+                local.append((time.perf_counter() - started) * 1000)
+            with lock:
+                timings.extend(local)
+        
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        start_barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        with module.app.app_context():
+            if write_behind:
+                module.get_group_commit_writer().close()
+            module.get_pool().close_all()
+        
+        result = summarize(timings)
+        result['inserts_per_second'] = len(timings) / elapsed
+        return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per client')
+    parser.add_argument('--synchronous', choices=['NORMAL', 'FULL'], default='FULL',
+                        help='synchronous pragma for per-request commits (the group writer always uses FULL)')
+    args = parser.parse_args()
+    
+    print(f"{'mode':>14} {'inserts/s':>10} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for label, write_behind in (('per-request', False), ('group commit', True)):
+        result = run(write_behind, args.clients, args.requests, args.synchronous)
+        print(f"{label:>14} {result['inserts_per_second']:>10.0f} {result['p50_ms']:>7.2f}ms "
+              f"{result['p95_ms']:>7.2f}ms {result['p99_ms']:>7.2f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Shared helpers for the benchmark scripts
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, 'habit-app.py')
+
+_loaded = 0
+
+# Import a fresh copy of habit-app.py pointed at `db_path` and create its app
+# as module.app. The module name has a dash in it, so it can't be imported
+# with a plain import statement.
+def load_app(db_path, **env):
+    global _loaded
+    os.environ['HABIT_TRACKER_DB'] = db_path
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    
+    _loaded += 1
+    spec = importlib.util.spec_from_file_location(f'habit_app_bench_{_loaded}', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    module.app = module.create_app()
+    return module
+
+# Run fn `repeat` times and return the timings in milliseconds
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(timings):
+    return {
+        'count': len(timings),
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+    }
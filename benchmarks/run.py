@@ -0,0 +1,309 @@
+# Load test for the app's routes against a synthetic database.
+#
+# Generates a database of the requested size, then drives each route either
+# in-process through Flask's test client or over HTTP against a real local
+# server, and reports latency percentiles and throughput per route. Results
+# can be saved as JSON and compared against a stored baseline:
+#
+#   python benchmarks/run.py --transactions 1000000 --output baseline.json
+#   python benchmarks/run.py --transactions 1000000 --baseline baseline.json --mode server
+#
+# Routes left out, and why:
+#   /events         streams until the client goes away, so it has no request
+#                   latency to measure
+#   /assets/<file>  prebuilt static files, sent with far-future caching
+#   /login, /register, /logout
+#                   multi-tenant sign-in, which this single-database run
+#                   doesn't enable; bench_shards.py covers that mode
+#   /toggle_theme   answers without doing anything
+# There are no /delete_* routes: open bounties are deleted through
+# /api/sync, which has a scenario for it.
+import argparse
+import uuid
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from common import load_app, summarize
+
+# Fill a fresh database with habits, a ledger spread over `days` days and a
+# board of active bounties. Goes through record_transactions() so the summary,
+# rollups and streaks are populated exactly as the app would populate them.
+def generate_database(module, habits, bounties, transactions, days, seed=0, chunk_size=50000):
+    rng = random.Random(seed)
+    module.ensure_db_initialized(module.app.config['DATABASE'])
+    conn = module.open_connection()
+    conn.executemany('INSERT INTO habits (description, amount) VALUES (?, ?)',
+                     [(f'Habit {i}', round(rng.uniform(0.5, 10), 2)) for i in range(habits)])
+    amounts = {row['id']: row['amount'] for row in conn.execute('SELECT id, amount FROM habits')}
+    habit_ids = list(amounts)
+    
+    first_day = date.today() - timedelta(days=days)
+    day_names = [(first_day + timedelta(days=i)).isoformat() for i in range(days + 1)]
+    
+    remaining = transactions
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        # Days are drawn in increasing order so ids follow dates as they do in real use
+        offset = (transactions - remaining) * days // max(transactions, 1)
+        rows = []
+        for i in range(size):
+            habit_id = rng.choice(habit_ids)
+            day = day_names[min(days, offset + i * days // max(transactions, 1))]
+            rows.append((habit_id, amounts[habit_id], rng.randint(1, 5), day, None, None))
+        module.record_transactions(conn, rows)
+        conn.commit()
+        remaining -= size
+    
+    add_bounties(conn, bounties, rng)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+def add_bounties(conn, count, rng=random):
+    today = date.today().isoformat()
+    conn.executemany('INSERT INTO bounties (description, amount, date_created, completed) VALUES (?, ?, ?, 0)',
+                     [(f'Bounty {rng.randrange(10 ** 9)}', round(rng.uniform(5, 50), 2), today)
+                      for _ in range(count)])
+
+# A request body other than form data: (content type, bytes)
+def json_body(value):
+    return 'application/json', json.dumps(value).encode()
+
+# Each scenario is (name, method, path, data), where data is form fields or
+# a (content type, bytes) body; path and data may be callables taking the
+# request number so repeated requests can vary
+def build_scenarios(module, requests, bulk_rows=100):
+    conn = module.open_connection()
+    habit_ids = [row['id'] for row in conn.execute('SELECT id FROM habits')]
+    latest_id = conn.execute('SELECT MAX(id) FROM transactions').fetchone()[0] or 0
+    version = conn.execute('SELECT version FROM sync_sequence').fetchone()[0]
+    
+    # One fresh bounty per completion request, so every request pays out, and
+    # another per sync delete
+    first_bounty = (conn.execute('SELECT MAX(id) FROM bounties').fetchone()[0] or 0) + 1
+    add_bounties(conn, requests * 2)
+    conn.commit()
+    conn.close()
+    
+    # Sync keys are kept, so a reused --db needs new ones each run
+    run = uuid.uuid4().hex[:8]
+    today = date.today().isoformat()
+    month_ago = (date.today() - timedelta(days=30)).isoformat()
+    
+    def bulk(n):
+        lines = (json.dumps({'habit_id': habit_ids[(n + i) % len(habit_ids)], 'quantity': 1, 'date': today})
+                 for i in range(bulk_rows))
+        return 'application/x-ndjson', '\n'.join(lines).encode()
+    
+    return [
+        ('GET /', 'GET', '/', None),
+        ('GET /readyz', 'GET', '/readyz', None),
+        ('GET /api/transactions', 'GET',
+         lambda n: f'/api/transactions?before={max(1, latest_id - n * 50)}&limit=50', None),
+        ('GET /api/transactions?habit_id', 'GET',
+         lambda n: f'/api/transactions?habit_id={habit_ids[n % len(habit_ids)]}&limit=50', None),
+        ('GET /api/stats/daily', 'GET', f'/api/stats/daily?start={month_ago}', None),
+        ('GET /api/streaks', 'GET', '/api/streaks', None),
+        ('GET /api/search', 'GET', lambda n: f'/api/search?q=Bounty+{n % 100}', None),
+        ('GET /export/transactions.csv (1 day)', 'GET', f'/export/transactions.csv?start={today}', None),
+        ('GET /export/transactions.ndjson (1 day)', 'GET', f'/export/transactions.ndjson?start={today}', None),
+        ('GET /api/analytics', 'GET', '/api/analytics', None),
+        ('GET /analytics', 'GET', '/analytics', None),
+        ('GET /api/sync', 'GET', lambda n: f'/api/sync?since={n * 100 % max(version, 1)}', None),
+        ('GET /metrics', 'GET', '/metrics', None),
+        ('GET /api/jobs', 'GET', '/api/jobs', None),
+        ('POST /add_habit', 'POST', '/add_habit',
+         lambda n: {'description': f'Bench habit {n}', 'amount': '1.50'}),
+        ('POST /add_transaction', 'POST', '/add_transaction',
+         lambda n: {'habit_id': habit_ids[n % len(habit_ids)], 'amount': '1.00', 'quantity': '1'}),
+        ('POST /add_bounty', 'POST', '/add_bounty',
+         lambda n: {'description': f'Bench bounty {n}', 'amount': '5.00'}),
+        ('POST /complete_bounty', 'POST', lambda n: f'/complete_bounty/{first_bounty + n}', None),
+        ('POST /api/sync (add_transaction)', 'POST', '/api/sync', lambda n: json_body({'operations': [
+            {'key': f'bench-{run}-{n}', 'op': 'add_transaction', 'habit_id': habit_ids[n % len(habit_ids)]}]})),
+        ('POST /api/sync (delete_bounty)', 'POST', '/api/sync', lambda n: json_body({'operations': [
+            {'key': f'bench-{run}-delete-{n}', 'op': 'delete_bounty', 'bounty_id': first_bounty + requests + n}]})),
+        (f'POST /api/transactions/bulk ({bulk_rows} rows)', 'POST', '/api/transactions/bulk', bulk),
+    ]
+
+def _resolve(value, n):
+    return value(n) if callable(value) else value
+
+# Sent with every request, so /metrics and /api/jobs answer when an operator
+# token is configured
+def _operator_headers(app):
+    token = app.config['OPERATOR_TOKEN']
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+# In-process driver using Flask's test client
+class ClientDriver:
+    def __init__(self, module):
+        self.app = module.app
+        self.headers = _operator_headers(module.app)
+        self._local = threading.local()
+    
+    def request(self, method, path, data):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        if isinstance(data, tuple):
+            content_type, data = data
+            response = client.open(path, method=method, data=data, content_type=content_type,
+                                   headers=self.headers)
+        else:
+            response = client.open(path, method=method, data=data, headers=self.headers)
+        response.close()
+        return response.status_code
+
+# HTTP driver against a threaded werkzeug server on a free local port
+class ServerDriver:
+    def __init__(self, module):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+        
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+        
+        self.server = make_server('127.0.0.1', 0, module.app, threaded=True, request_handler=QuietHandler)
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.headers = _operator_headers(module.app)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        # Follow-up redirects are a separate GET in a browser, so don't follow them here
+        self.opener = urllib.request.build_opener(_NoRedirect)
+    
+    def request(self, method, path, data):
+        headers = dict(self.headers)
+        if isinstance(data, tuple):
+            headers['Content-Type'], body = data
+        else:
+            body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base + path, data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    
+    def close(self):
+        self.server.shutdown()
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def run_scenario(driver, method, path, data, requests, concurrency):
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    timings, failures = [], 0
+    
+    def worker():
+        nonlocal failures
+        local, local_failures = [], 0
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            started = time.perf_counter()
+            status = driver.request(method, _resolve(path, n), _resolve(data, n))
+            local.append((time.perf_counter() - started) * 1000)
+            if status >= 400:
+                local_failures += 1
+        with lock:
+            timings.extend(local)
+            failures += local_failures
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+    
+    result = summarize(timings)
+    result['throughput_rps'] = len(timings) / elapsed
+    result['errors'] = failures
+    return result
+
+def compare(results, baseline):
+    print()
+    print(f"{'route':<40} {'p50 change':>11} {'p95 change':>11} {'rps change':>11}")
+    for name, result in results.items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        changes = [(result[key] - before[key]) / before[key] * 100 if before[key] else 0
+                   for key in ('p50_ms', 'p95_ms', 'throughput_rps')]
+        print(f'{name:<40} {changes[0]:>+10.1f}% {changes[1]:>+10.1f}% {changes[2]:>+10.1f}%')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--habits', type=int, default=50)
+    parser.add_argument('--bounties', type=int, default=200, help='Active bounties on the board')
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=3 * 365, help='Days of history to spread the ledger over')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mode', choices=['client', 'server'], default='client',
+                        help='Flask test client in-process, or HTTP against a local server')
+    parser.add_argument('--route', action='append', help='Only run routes whose name contains this')
+    parser.add_argument('--db', help='Reuse (or create) this database instead of a temporary one')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --output')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, 'bench.db')
+        fresh = not os.path.exists(db_path)
+        module = load_app(db_path)
+        with module.app.app_context():
+            module.build()
+            if fresh:
+                started = time.perf_counter()
+                generate_database(module, args.habits, args.bounties, args.transactions, args.days, args.seed)
+                print(f'Generated {args.transactions} transactions in {time.perf_counter() - started:.1f}s')
+            scenarios = build_scenarios(module, args.requests)
+        
+        driver = ServerDriver(module) if args.mode == 'server' else ClientDriver(module)
+        results = {}
+        print(f"{'route':<40} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'errors':>6}")
+        try:
+            for name, method, path, data in scenarios:
+                if args.route and not any(part in name for part in args.route):
+                    continue
+                result = run_scenario(driver, method, path, data, args.requests, args.concurrency)
+                results[name] = result
+                print(f"{name:<40} {result['p50_ms']:>6.2f}ms {result['p95_ms']:>6.2f}ms "
+                      f"{result['p99_ms']:>6.2f}ms {result['throughput_rps']:>8.0f} {result['errors']:>6}")
+        finally:
+            if args.mode == 'server':
+                driver.close()
+            with module.app.app_context():
+                module.get_pool().close_all()
+    
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'routes': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
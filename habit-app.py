@@ -1,17 +1,709 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import (Flask, Blueprint, current_app, render_template, request, redirect, url_for,
+                   flash, jsonify, g, Response, stream_with_context, session, get_flashed_messages,
+                   make_response, send_from_directory, before_render_template, template_rendered,
+                   stream_template)
+from markupsafe import Markup
+from werkzeug.security import safe_join, generate_password_hash, check_password_hash
 import sqlite3
-from datetime import datetime
+import click
+import collections
+import csv
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import math
+import mimetypes
+import queue
+import random
+import re
+import secrets
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+import zoneinfo
+import concurrent.futures
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 import os
 
-app = Flask(__name__)
-app.secret_key = "habit_tracker_secret_key"  # Required for flash messages
+try:
+    import brotli
+except ImportError:  # brotli is optional; assets are still precompressed with gzip
+    brotli = None
+
+# Default settings, overridable through the environment. create_app()
+# copies them into each app's config.
+DEFAULT_SECRET_KEY = 'habit_tracker_secret_key'
+DEFAULT_CONFIG = dict(
+    SECRET_KEY=os.environ.get('HABIT_TRACKER_SECRET_KEY', DEFAULT_SECRET_KEY),  # Required for flash messages
+    # Keep the session cookie away from scripts and off cross-site POSTs, so
+    # another site can't write as the signed-in account. Set
+    # HABIT_TRACKER_SECURE_COOKIE=1 when the app is served over HTTPS.
+    SESSION_COOKIE_HTTPONLY=True,
+    SESSION_COOKIE_SAMESITE='Lax',
+    SESSION_COOKIE_SECURE=os.environ.get('HABIT_TRACKER_SECURE_COOKIE', '0') != '0',
+)
+
+# All routes, hooks and commands live on this blueprint; create_app()
+# registers it on a new app
+bp = Blueprint('habit_tracker', __name__, cli_group=None)
+
+# Date functions. Each completion is stored with the day it counts towards,
+# as an epoch day in TIMEZONE (an IANA name such as 'Europe/London'; the
+# server's local zone when unset), and the UTC time it was recorded.
+DEFAULT_CONFIG.update(
+    TIMEZONE=os.environ.get('HABIT_TRACKER_TIMEZONE', ''),
+)
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def get_timezone():
+    name = current_app.config['TIMEZONE']
+    return zoneinfo.ZoneInfo(name) if name else None
+
+# Today's date in the configured timezone
+def local_today():
+    return datetime.now(timezone.utc).astimezone(get_timezone()).date()
+
+# Days since 1970-01-01 for a date or a 'YYYY-MM-DD' string
+def epoch_day(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal() - EPOCH_ORDINAL
+
+# WHERE clauses and parameters for an inclusive start/end date range on
+# `column`, shared by the history, export and stats queries. start and end
+# are 'YYYY-MM-DD' strings; `encode` turns them into the column's values
+# (epoch days by default, for the transactions.day column).
+def date_range_filter(start=None, end=None, column='t.day', encode=epoch_day):
+    clauses, params = [], []
+    if start:
+        clauses.append(f'{column} >= ?')
+        params.append(encode(start))
+    if end:
+        clauses.append(f'{column} <= ?')
+        params.append(encode(end))
+    return clauses, params
+
+# Database settings, overridable through the environment
+DEFAULT_CONFIG.update(
+    DATABASE=os.environ.get('HABIT_TRACKER_DB', 'habit_tracker.db'),
+    DB_POOL_SIZE=int(os.environ.get('HABIT_TRACKER_DB_POOL_SIZE', 8)),
+    DB_BUSY_TIMEOUT_MS=int(os.environ.get('HABIT_TRACKER_DB_BUSY_TIMEOUT_MS', 5000)),
+    DB_BUSY_RETRIES=int(os.environ.get('HABIT_TRACKER_DB_BUSY_RETRIES', 3)),
+    DB_CACHE_SIZE_KB=int(os.environ.get('HABIT_TRACKER_DB_CACHE_SIZE_KB', 16384)),
+    DB_MMAP_SIZE=int(os.environ.get('HABIT_TRACKER_DB_MMAP_SIZE', 256 * 1024 * 1024)),
+)
 
 # Database functions
-def get_db_connection():
-    conn = sqlite3.connect('habit_tracker.db')
+def open_connection(path=None):
+    path = path or current_database()
+    busy_timeout = current_app.config['DB_BUSY_TIMEOUT_MS']
+    
+    factory = InstrumentedConnection if current_app.config['INSTRUMENTATION'] else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=busy_timeout / 1000, check_same_thread=False,
+                           factory=factory)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    if factory is InstrumentedConnection:
+        conn.slow_query_ms = current_app.config['SLOW_QUERY_MS']
+        conn.logger = current_app.logger
+    
+    # Takes effect only on a brand new file, so space freed by compaction can
+    # be returned with PRAGMA incremental_vacuum instead of a full VACUUM
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    # WAL lets readers carry on while a write is in progress, and with it
+    # synchronous=NORMAL is still safe against corruption
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {busy_timeout:d}')
+    conn.execute(f"PRAGMA cache_size = {-current_app.config['DB_CACHE_SIZE_KB']:d}")
+    conn.execute(f"PRAGMA mmap_size = {current_app.config['DB_MMAP_SIZE']:d}")
+    return conn
+
+# Keeps up to `size` idle connections around for reuse between requests
+class ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.closed = False
+        self._idle = queue.LifoQueue(maxsize=size)
+    
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return open_connection(self.path)
+    
+    def release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        if self.closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    # Close for good: connections still checked out are closed as they come back
+    def close(self):
+        self.closed = True
+        self.close_all()
+
+_pool_lock = threading.Lock()
+
+# The pool is created on first use, which is also when this process first
+# makes sure the schema is current
+def get_pool():
+    if current_app.config['MULTI_TENANT']:
+        return get_shard().extensions['habit_db_pool']
+    pool = current_app.extensions.get('habit_db_pool')
+    if pool is None or pool.path != current_app.config['DATABASE']:
+        with _pool_lock:
+            pool = current_app.extensions.get('habit_db_pool')
+            if pool is None or pool.path != current_app.config['DATABASE']:
+                if pool is not None:
+                    # Connections still checked out are closed as they come back
+                    pool.close()
+                ensure_db_initialized(current_app.config['DATABASE'])
+                pool = ConnectionPool(current_app.config['DATABASE'], current_app.config['DB_POOL_SIZE'])
+                current_app.extensions['habit_db_pool'] = pool
+    return pool
+
+# One pooled connection per app context, returned to the pool on teardown
+def get_db_connection():
+    if 'db' not in g:
+        started = time.perf_counter()
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+        metrics.observe_phase('connect', time.perf_counter() - started)
+    return g.db
+
+def release_db_connection(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool').release(conn)
+
+# Multi-tenant settings. With MULTI_TENANT on, people sign in, and each
+# account reads and writes its own database file (shard) in SHARD_DIR instead
+# of DATABASE, so writers for different accounts never wait on each other's
+# lock. ACCOUNTS_DB holds the accounts and which shard each one uses.
+# OPERATOR_TOKEN guards /metrics and /api/jobs, which cover every account;
+# in multi-tenant mode they're unavailable until it is set.
+DEFAULT_CONFIG.update(
+    OPERATOR_TOKEN=os.environ.get('HABIT_TRACKER_OPERATOR_TOKEN', ''),
+    MULTI_TENANT=os.environ.get('HABIT_TRACKER_MULTI_TENANT', '0') != '0',
+    ACCOUNTS_DB=os.environ.get('HABIT_TRACKER_ACCOUNTS_DB', 'accounts.db'),
+    SHARD_DIR=os.environ.get('HABIT_TRACKER_SHARD_DIR', 'shards'),
+    SHARD_CACHE_SIZE=int(os.environ.get('HABIT_TRACKER_SHARD_CACHE_SIZE', 64)),
+    SHARD_POOL_SIZE=int(os.environ.get('HABIT_TRACKER_SHARD_POOL_SIZE', 2)),
+    SHARD_IDLE_SECONDS=float(os.environ.get('HABIT_TRACKER_SHARD_IDLE_SECONDS', 300)),
+)
+
+# Shard functions
+
+# The database this context uses: DATABASE, or in multi-tenant mode the
+# signed-in account's shard
+def current_database():
+    if not current_app.config['MULTI_TENANT']:
+        return current_app.config['DATABASE']
+    database = g.get('habit_database')
+    if database is None:
+        raise RuntimeError('No account is signed in, so there is no shard to use')
+    return database
+
+# Point this context at a shard (a no-op for None, as in single-user mode)
+def use_database(path):
+    if path is not None:
+        g.habit_database = path
+
+def shard_path(shard):
+    return os.path.join(current_app.config['SHARD_DIR'], shard)
+
+# One shard's open state: its connection pool, its cached pages and, once
+# used, its live update broadcaster and group commit writer, under the keys
+# app.extensions holds them in for single-user mode. `references` counts the
+# app contexts using it, from get_shard() until their teardown.
+class Shard:
+    def __init__(self, path, pool_size):
+        self.path = path
+        self.last_used = time.monotonic()
+        self.references = 0
+        self.extensions = {
+            'habit_db_pool': ConnectionPool(path, pool_size),
+            'habit_index_cache': [None, None],
+            'habit_analytics_cache': [None, None],
+        }
+    
+    # Closing a shard that a request still holds would leave it waiting on a
+    # stopped writer, and one with open /events streams would cut them off
+    def in_use(self):
+        broadcaster = self.extensions.get('habit_events')
+        return self.references > 0 or (broadcaster is not None and broadcaster.has_subscribers())
+    
+    def close(self):
+        self.extensions['habit_db_pool'].close()
+        for name in ('habit_events', 'habit_group_commit'):
+            if name in self.extensions:
+                self.extensions[name].close()
+        forget_database(self.path)
+
+# The shards this process has open, least recently used first. Opening one
+# past `capacity` closes the least recently used; any that sat unused for
+# `idle_seconds` are closed on the next lookup. Shards in use are skipped.
+# get() takes a reference to the shard it returns; hand it back with
+# release().
+class ShardCache:
+    def __init__(self, capacity, idle_seconds, pool_size):
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.pool_size = pool_size
+        self._shards = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._shards)
+    
+    def get(self, path):
+        now = time.monotonic()
+        with self._lock:
+            shard = self._shards.get(path)
+            if shard is None:
+                shard = self._shards[path] = Shard(path, self.pool_size)
+            else:
+                self._shards.move_to_end(path)
+            shard.last_used = now
+            shard.references += 1
+            
+            evicted = []
+            for candidate in list(self._shards.values())[:-1]:
+                if len(self._shards) <= self.capacity and now - candidate.last_used < self.idle_seconds:
+                    break
+                if not candidate.in_use():
+                    evicted.append(self._shards.pop(candidate.path))
+        # Closing can wait on a writer thread, so it happens outside the lock
+        for candidate in evicted:
+            candidate.close()
+        return shard
+    
+    def release(self, shard):
+        with self._lock:
+            shard.references -= 1
+            shard.last_used = time.monotonic()
+    
+    def close_all(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for shard in shards:
+            shard.close()
+
+_shard_cache_lock = threading.Lock()
+
+def get_shard_cache():
+    cache = current_app.extensions.get('habit_shards')
+    if cache is None:
+        with _shard_cache_lock:
+            cache = current_app.extensions.get('habit_shards')
+            if cache is None:
+                cache = ShardCache(current_app.config['SHARD_CACHE_SIZE'],
+                                   current_app.config['SHARD_IDLE_SECONDS'],
+                                   current_app.config['SHARD_POOL_SIZE'])
+                current_app.extensions['habit_shards'] = cache
+    return cache
+
+# The signed-in account's shard, looked up once per app context and kept
+# open until its teardown. Its schema is brought up to date the first time
+# this process uses it.
+def get_shard():
+    if 'habit_shard' not in g:
+        path = current_database()
+        ensure_db_initialized(path)
+        g.habit_shard = get_shard_cache().get(path)
+    return g.habit_shard
+
+def release_shard(exception=None):
+    shard = g.pop('habit_shard', None)
+    if shard is not None:
+        get_shard_cache().release(shard)
+
+# Where the state tied to one database lives: the app's extensions, or in
+# multi-tenant mode the current shard's
+def database_extensions():
+    if current_app.config['MULTI_TENANT']:
+        return get_shard().extensions
+    return current_app.extensions
+
+# The database's data version is its sync sequence, which every change to
+# the synced tables moves on, whichever process made it: a worker, a second
+# server or a `flask` command. Rebuilds of the derived tables move it on
+# with touch_data_version(). In multi-tenant mode each shard has its own, so
+# one account's writes leave every other account's cached pages alone.
+def data_version(conn):
+    return conn.execute('SELECT version FROM sync_sequence').fetchone()[0]
+
+# Mark the data as changed when a write didn't go through the synced tables.
+# Does nothing before the sync sequence exists, i.e. during early migrations.
+def touch_data_version(conn):
+    if table_exists(conn, 'sync_sequence'):
+        conn.execute('UPDATE sync_sequence SET version = version + 1')
+
+# Account functions
+USERNAME_PATTERN = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+MIN_PASSWORD_LENGTH = 8
+
+def open_accounts_db():
+    conn = open_connection(current_app.config['ACCOUNTS_DB'])
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                    password_hash TEXT NOT NULL,
+                    shard TEXT,
+                    created_at INTEGER NOT NULL
+                )''')
+    # The maintenance jobs run over every shard, so their schedule lives here
+    conn.execute(SCHEDULED_JOBS_SQL)
     return conn
 
+# Add an account and create its shard. Raises ValueError with a message for
+# the client if the username or password won't do. Returns the shard name.
+def create_account(conn, username, password):
+    if not USERNAME_PATTERN.fullmatch(username or ''):
+        raise ValueError('Usernames are 1-64 letters, digits, dots, dashes or underscores')
+    if len(password or '') < MIN_PASSWORD_LENGTH:
+        raise ValueError(f'Passwords need at least {MIN_PASSWORD_LENGTH} characters')
+    try:
+        cursor = conn.execute(
+            "INSERT INTO users (username, password_hash, created_at) VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))",
+            (username, generate_password_hash(password)))
+    except sqlite3.IntegrityError:
+        raise ValueError(f'The username {username} is taken')
+    shard = f'user-{cursor.lastrowid}.db'
+    conn.execute('UPDATE users SET shard = ? WHERE id = ?', (shard, cursor.lastrowid))
+    conn.commit()
+    
+    os.makedirs(current_app.config['SHARD_DIR'], exist_ok=True)
+    ensure_db_initialized(shard_path(shard))
+    return shard
+
+# The account's shard name if the password is right, otherwise None
+def authenticate(conn, username, password):
+    row = conn.execute('SELECT password_hash, shard FROM users WHERE username = ?', (username or '',)).fetchone()
+    if row is None or not check_password_hash(row['password_hash'], password or ''):
+        return None
+    return row['shard']
+
+# Endpoints that work without signing in
+PUBLIC_ENDPOINTS = {f'{bp.name}.{name}' for name in ('login', 'register', 'logout', 'asset', 'readyz',
+                                                     'toggle_theme')} | {'static'}
+
+# Endpoints for whoever runs the app rather than its users: they report on
+# every shard, so with OPERATOR_TOKEN set (and always in multi-tenant mode)
+# they need it as a bearer token
+OPERATOR_ENDPOINTS = {f'{bp.name}.{name}' for name in ('metrics_endpoint', 'jobs_api')}
+
+def check_operator_token():
+    token = current_app.config['OPERATOR_TOKEN']
+    if not token and not current_app.config['MULTI_TENANT']:
+        return None
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    if not token or scheme.lower() != 'bearer' or not secrets.compare_digest(given.encode(), token.encode()):
+        return jsonify({"status": "error", "error": "Operator token required"}), 403
+    return None
+
+# In multi-tenant mode, point each request at the signed-in account's shard.
+# The shard comes from the signed session cookie, so this needs no lookup.
+# Operator endpoints are checked for the token instead.
+@bp.before_app_request
+def select_shard():
+    if request.endpoint in OPERATOR_ENDPOINTS:
+        return check_operator_token()
+    if not current_app.config['MULTI_TENANT'] or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    shard = session.get('shard')
+    if shard is None:
+        if wants_json() or request.path.startswith('/api/') or request.endpoint == f'{bp.name}.events':
+            return jsonify({"status": "error", "error": "Sign in first"}), 401
+        return redirect(url_for('.login'))
+    use_database(shard_path(shard))
+    return None
+
+# Instrumentation settings. SLOW_QUERY_MS = 0 turns the slow query log off.
+DEFAULT_CONFIG.update(
+    INSTRUMENTATION=os.environ.get('HABIT_TRACKER_INSTRUMENTATION', '1') != '0',
+    SLOW_QUERY_MS=float(os.environ.get('HABIT_TRACKER_SLOW_QUERY_MS', 100)),
+)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# In-process counters behind /metrics: a latency histogram per route, time
+# spent per request phase (connect, render, commit) and per SQL statement.
+# Each worker process keeps its own.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.phases = {}
+        self.statements = {}
+        self.slow_queries = 0
+    
+    def observe_route(self, route, method, status, seconds):
+        with self._lock:
+            entry = self.routes.get((route, method, status))
+            if entry is None:
+                entry = self.routes[(route, method, status)] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            buckets = entry[0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            entry[1] += seconds
+            entry[2] += 1
+    
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            total, count = self.phases.get(phase, (0.0, 0))
+            self.phases[phase] = (total + seconds, count + 1)
+    
+    def observe_statement(self, sql, seconds, rows=0, calls=1):
+        with self._lock:
+            total, count, row_count = self.statements.get(sql, (0.0, 0, 0))
+            self.statements[sql] = (total + seconds, count + calls, row_count + rows)
+    
+    def count_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+    
+    def render(self):
+        with self._lock:
+            routes = {key: (list(buckets), total, count) for key, (buckets, total, count) in self.routes.items()}
+            phases = dict(self.phases)
+            statements = dict(self.statements)
+            slow_queries = self.slow_queries
+        
+        lines = [
+            '# HELP habit_tracker_request_duration_seconds Request latency by route.',
+            '# TYPE habit_tracker_request_duration_seconds histogram',
+        ]
+        for (route, method, status), (buckets, total, count) in sorted(routes.items()):
+            labels = f'route="{_label(route)}",method="{method}",status="{status}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'habit_tracker_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'habit_tracker_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'habit_tracker_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'habit_tracker_request_duration_seconds_count{{{labels}}} {count}')
+        
+        lines += [
+            '# HELP habit_tracker_phase_duration_seconds Time spent per request phase.',
+            '# TYPE habit_tracker_phase_duration_seconds summary',
+        ]
+        for phase, (total, count) in sorted(phases.items()):
+            lines.append(f'habit_tracker_phase_duration_seconds_sum{{phase="{phase}"}} {total:.6f}')
+            lines.append(f'habit_tracker_phase_duration_seconds_count{{phase="{phase}"}} {count}')
+        
+        lines += [
+            '# HELP habit_tracker_sql_duration_seconds Time spent executing and fetching each SQL statement.',
+            '# TYPE habit_tracker_sql_duration_seconds summary',
+        ]
+        for sql, (total, count, rows) in sorted(statements.items()):
+            lines.append(f'habit_tracker_sql_duration_seconds_sum{{statement="{_label(sql)}"}} {total:.6f}')
+            lines.append(f'habit_tracker_sql_duration_seconds_count{{statement="{_label(sql)}"}} {count}')
+        lines += [
+            '# HELP habit_tracker_sql_rows_total Rows returned by each SQL statement.',
+            '# TYPE habit_tracker_sql_rows_total counter',
+        ]
+        for sql, (total, count, rows) in sorted(statements.items()):
+            lines.append(f'habit_tracker_sql_rows_total{{statement="{_label(sql)}"}} {rows}')
+        
+        lines += [
+            '# HELP habit_tracker_slow_queries_total Statements slower than SLOW_QUERY_MS.',
+            '# TYPE habit_tracker_slow_queries_total counter',
+            f'habit_tracker_slow_queries_total {slow_queries}',
+            '# HELP habit_tracker_commits_total Writes committed by this process.',
+            '# TYPE habit_tracker_commits_total counter',
+            f'habit_tracker_commits_total {_local_writes}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+metrics = Metrics()
+
+# Collapse whitespace so the same statement always gets the same label
+def _statement_key(sql):
+    return ' '.join(sql.split())[:300]
+
+# Log a statement slower than SLOW_QUERY_MS along with its query plan
+def _log_slow_query(conn, sql, params, seconds):
+    metrics.count_slow_query()
+    plan = ''
+    if sql.lstrip()[:6].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+        try:
+            plan = '\n'.join('    ' + row[3] for row in
+                             sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params))
+        except sqlite3.Error as e:
+            plan = f'    (no plan: {e})'
+    conn.logger.warning('Slow query (%.1f ms): %s\n%s', seconds * 1000, _statement_key(sql), plan)
+
+# Connection that times every statement and commit and counts fetched rows
+class InstrumentedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor(InstrumentedCursor)
+        return cursor.execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        cursor = self.cursor(InstrumentedCursor)
+        return cursor.executemany(sql, seq_of_parameters)
+    
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        metrics.observe_phase('commit', time.perf_counter() - started)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _key = None
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._record(sql, time.perf_counter() - started, parameters=parameters)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._record(sql, time.perf_counter() - started)
+        return self
+    
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._rows(1)
+        return row
+    
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._rows(len(rows), time.perf_counter() - started)
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._rows(len(rows), time.perf_counter() - started)
+        return rows
+    
+    def __next__(self):
+        row = super().__next__()
+        self._rows(1)
+        return row
+    
+    def _record(self, sql, seconds, parameters=None):
+        self._key = _statement_key(sql)
+        metrics.observe_statement(self._key, seconds)
+        slow_query_ms = self.connection.slow_query_ms
+        if slow_query_ms and seconds * 1000 > slow_query_ms and parameters is not None:
+            _log_slow_query(self.connection, sql, parameters, seconds)
+    
+    def _rows(self, count, seconds=0.0):
+        if self._key is not None:
+            metrics.observe_statement(self._key, seconds, rows=count, calls=0)
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe_route(request.endpoint or 'unmatched', request.method, response.status_code,
+                              time.perf_counter() - started)
+    return response
+
+@before_render_template.connect
+def _start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect
+def _record_render_time(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        metrics.observe_phase('render', time.perf_counter() - started)
+
+# Part of every cache key and ETag, so pages cached before a restart (which
+# may have run different code and assets) never match new ones
+_data_epoch = secrets.token_hex(4)
+
+# Writes committed by this process, for /metrics
+_local_writes = 0
+_local_writes_lock = threading.Lock()
+
+def commit_changes(conn):
+    global _local_writes
+    conn.commit()
+    with _local_writes_lock:
+        _local_writes += 1
+
+def is_busy_error(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    return (code & 0xff) == 5 if code is not None else 'database is locked' in str(error)  # SQLITE_BUSY
+
+# Threads of this process queue here for each database's write lock, in
+# turn, instead of polling SQLite's busy handler, whose growing sleeps make
+# for a long latency tail under contention
+_write_locks = collections.defaultdict(threading.Lock)
+
+# Run fn(conn) in a BEGIN IMMEDIATE transaction and commit what it wrote.
+# Taking the write lock up front means the transaction can't fail halfway
+# for want of it, so a lock that stays busy past the busy timeout (held by
+# another process) is safe to retry from the start: up to DB_BUSY_RETRIES
+# more times, with jittered backoff so the waiting writers don't all come
+# back at once.
+def run_write_transaction(conn, fn):
+    with _write_locks[current_database()]:
+        return _run_write_transaction(conn, fn)
+
+def _run_write_transaction(conn, fn):
+    retries = current_app.config['DB_BUSY_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not is_busy_error(e):
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+            continue
+        try:
+            changes = conn.total_changes
+            result = fn(conn)
+            if conn.total_changes != changes:
+                commit_changes(conn)
+            else:
+                conn.commit()
+            return result
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
 # Check if column exists in table
 def column_exists(conn, table_name, column_name):
     cursor = conn.cursor()
@@ -19,12 +711,16 @@ def column_exists(conn, table_name, column_name):
     columns = cursor.fetchall()
     return any(column['name'] == column_name for column in columns)
 
-# Initialize the database
-def init_db():
-    # Check if the database file exists
-    db_exists = os.path.exists('habit_tracker.db')
-    
-    conn = get_db_connection()
+def table_exists(conn, table_name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                       (table_name,)).fetchone()
+    return row is not None
+
+# Schema migrations. PRAGMA user_version records how many of MIGRATIONS
+# have been applied, so each one runs exactly once per database.
+
+# 1: the original tables, bounty_id on payouts and the ledger summary
+def _migrate_base_schema(conn):
     c = conn.cursor()
     
     # Create tables if they don't exist
@@ -53,396 +749,3586 @@ def init_db():
                     completed INTEGER DEFAULT 0
                 )''')
     
+    # Bounty payouts remember which bounty they came from
+    if not column_exists(conn, 'transactions', 'bounty_id'):
+        c.execute('ALTER TABLE transactions ADD COLUMN bounty_id INTEGER DEFAULT NULL')
+    
+    # Running totals so the balance doesn't need to re-sum the whole ledger.
+    # scope is 'total' (key 0), 'habit' (key = habit_id, -1 for all bounties)
+    # or 'bounty' (key = bounty_id)
+    c.execute('''CREATE TABLE IF NOT EXISTS ledger_summary (
+                    scope TEXT NOT NULL,
+                    key INTEGER NOT NULL,
+                    total REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (scope, key)
+                )''')
+    
+    # Populate the summary the first time it is created on an existing ledger
+    if not c.execute("SELECT 1 FROM ledger_summary WHERE scope = 'total'").fetchone():
+        rebuild_ledger_summary(conn)
+
+# 2: indexes for the per-habit and per-date ledger lookups and the bounty board
+def _migrate_hot_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_habit_date ON transactions (habit_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bounties_completed_id ON bounties (completed, id)')
+    conn.execute('ANALYZE')
+
+# 3: per-habit history in id order, for keyset pagination
+def _migrate_history_index(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_habit_id ON transactions (habit_id, id)')
+    conn.execute('ANALYZE')
+
+# 4: per-habit daily rollups, backfilled from the existing ledger
+def _migrate_daily_rollups(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_rollups (
+                    habit_id INTEGER NOT NULL,
+                    day TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    quantity INTEGER NOT NULL DEFAULT 0,
+                    earned REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (habit_id, day)
+                )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_daily_rollups_day ON daily_rollups (day)')
+    rebuild_daily_rollups(conn)
+
+# 5: current/longest streak per habit, computed from the rollups
+def _migrate_habit_streaks(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS habit_streaks (
+                    habit_id INTEGER PRIMARY KEY,
+                    current_streak INTEGER NOT NULL DEFAULT 0,
+                    longest_streak INTEGER NOT NULL DEFAULT 0,
+                    last_day TEXT
+                )''')
+    rebuild_streaks(conn)
+
+# 6: monthly totals of compacted transactions, and how far compaction has got
+def _migrate_ledger_compaction(conn):
+    # bounty_id is 0 for habit completions so it can be part of the key
+    conn.execute('''CREATE TABLE IF NOT EXISTS monthly_summaries (
+                    habit_id INTEGER NOT NULL,
+                    bounty_id INTEGER NOT NULL DEFAULT 0,
+                    month TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    quantity INTEGER NOT NULL DEFAULT 0,
+                    earned REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (habit_id, bounty_id, month)
+                )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS ledger_compaction (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    horizon TEXT NOT NULL,
+                    compacted_at TEXT
+                )''')
+
+# 7: integer epoch days for date filters and UTC recording times, replacing
+# the wider indexes on the TEXT date. `date` stays as the display value.
+def _migrate_epoch_days(conn):
+    if not column_exists(conn, 'transactions', 'day'):
+        conn.execute('ALTER TABLE transactions ADD COLUMN day INTEGER')
+    if not column_exists(conn, 'transactions', 'recorded_at'):
+        conn.execute('ALTER TABLE transactions ADD COLUMN recorded_at INTEGER')
+    if not column_exists(conn, 'bounties', 'created_at'):
+        conn.execute('ALTER TABLE bounties ADD COLUMN created_at INTEGER')
+    
+    # Existing rows keep a NULL recorded_at; when they were logged is unknown
+    conn.execute(f"UPDATE transactions SET day = {EPOCH_DAY_SQL.format('date')} WHERE day IS NULL")
+    
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_habit_day ON transactions (habit_id, day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_day ON transactions (day)')
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_habit_date')
+    conn.execute('DROP INDEX IF EXISTS idx_transactions_date')
+    conn.execute('ANALYZE')
+
+# 8: row versions, tombstones and idempotency keys for delta sync
+def _migrate_change_tracking(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_sequence (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_tombstones (
+                    entity TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    row_version INTEGER NOT NULL,
+                    PRIMARY KEY (entity, row_id)
+                )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sync_tombstones_version ON sync_tombstones (row_version)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_keys (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at INTEGER NOT NULL
+                )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sync_keys_created_at ON sync_keys (created_at)')
+    
+    # Number the existing rows one table after another, so every version is
+    # unique, then let triggers take each change's version from the sequence
+    version = 0
+    for entity, (table, fields) in SYNC_ENTITIES.items():
+        if not column_exists(conn, table, 'row_version'):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN row_version INTEGER')
+        conn.execute(f'UPDATE {table} SET row_version = id + ?', (version,))
+        version = conn.execute(f'SELECT COALESCE(MAX(row_version), ?) FROM {table}', (version,)).fetchone()[0]
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_row_version ON {table} (row_version)')
+        
+        take_version = f'''
+            UPDATE sync_sequence SET version = version + 1;
+            UPDATE {table} SET row_version = (SELECT version FROM sync_sequence) WHERE id = NEW.id;
+        '''
+        # Inserts that come with a version from reserve_row_versions() skip this
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} '
+                     f'WHEN NEW.row_version IS NULL BEGIN {take_version} END')
+        # The WHEN skips the trigger's own row_version update
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} '
+                     f'WHEN NEW.row_version IS OLD.row_version BEGIN {take_version} END')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} BEGIN
+            UPDATE sync_sequence SET version = version + 1;
+            INSERT OR REPLACE INTO sync_tombstones (entity, row_id, row_version)
+            VALUES ('{entity}', OLD.id, (SELECT version FROM sync_sequence));
+        END''')
+    conn.execute('INSERT OR REPLACE INTO sync_sequence (id, version) VALUES (1, ?)', (version,))
+
+# 9: full-text index over habit, bounty and payout descriptions, kept current
+# by triggers and backfilled from the existing rows
+def _migrate_search_index(conn):
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                    description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                )''')
+    for entity, (table, column, tag) in SEARCH_SOURCES.items():
+        key = f'{{}}.id * {SEARCH_STRIDE} + {tag}'
+        conn.execute(f'''INSERT INTO search_index (rowid, description)
+                        SELECT {key.format(table)}, {column} FROM {table} WHERE {column} IS NOT NULL''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table}
+            WHEN NEW.{column} IS NOT NULL BEGIN
+            INSERT INTO search_index (rowid, description) VALUES ({key.format('NEW')}, NEW.{column});
+        END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table}
+            WHEN OLD.{column} IS NOT NULL BEGIN
+            DELETE FROM search_index WHERE rowid = {key.format('OLD')};
+        END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {column} ON {table} BEGIN
+            DELETE FROM search_index WHERE rowid = {key.format('OLD')};
+            INSERT INTO search_index (rowid, description)
+            SELECT {key.format('NEW')}, NEW.{column} WHERE NEW.{column} IS NOT NULL;
+        END''')
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
+# 10: schedules and outcomes of the maintenance jobs
+def _migrate_scheduled_jobs(conn):
+    conn.execute(SCHEDULED_JOBS_SQL)
+
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_hot_indexes,
+    _migrate_history_index,
+    _migrate_daily_rollups,
+    _migrate_habit_streaks,
+    _migrate_ledger_compaction,
+    _migrate_epoch_days,
+    _migrate_change_tracking,
+    _migrate_search_index,
+    _migrate_scheduled_jobs,
+]
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+# Databases this process has already brought up to date
+_initialized_databases = set()
+_init_lock = threading.Lock()
+
+# Run init_db() the first time this process uses `path`. Later calls only do
+# a set lookup.
+def ensure_db_initialized(path):
+    if path in _initialized_databases:
+        return
+    with _init_lock:
+        if path not in _initialized_databases:
+            init_db(path)
+            _initialized_databases.add(path)
+
+# Drop what this process keeps per database once it stops using one (an
+# evicted shard), so neither record grows with every account served. Using
+# it again just checks its schema once more. A write lock that's held is
+# left for its holder.
+def forget_database(path):
+    with _init_lock:
+        _initialized_databases.discard(path)
+    lock = _write_locks.get(path)
+    if lock is not None and not lock.locked():
+        _write_locks.pop(path, None)
+
+# Bring the database up to the latest schema. Does nothing beyond reading
+# user_version when the schema is already current.
+def init_db(path=None):
+    conn = open_connection(path)
+    try:
+        if get_schema_version(conn) >= len(MIGRATIONS):
+            return
+        
+        # Take the write lock before re-reading the version so two processes
+        # starting together can't both apply the same migration
+        conn.execute('BEGIN IMMEDIATE')
+        version = get_schema_version(conn)
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number:d}')
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Ledger functions
+
+# SQL for the epoch day of a 'YYYY-MM-DD' expression
+EPOCH_DAY_SQL = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+
+# day and recorded_at are derived here, so callers only ever pass the date
+# (plus the row_version record_transactions() reserved)
+INSERT_TRANSACTION_SQL = f'''
+    INSERT INTO transactions
+    (habit_id, amount, quantity, date, bounty_description, bounty_id, day, recorded_at, row_version)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, {EPOCH_DAY_SQL.format('?4')}, CAST(strftime('%s', 'now') AS INTEGER), ?7)
+'''
+
+UPSERT_SUMMARY_SQL = '''
+    INSERT INTO ledger_summary (scope, key, total) VALUES (?, ?, ?)
+    ON CONFLICT (scope, key) DO UPDATE SET total = total + excluded.total
+'''
+
+# Insert a transaction and update the running totals. Doesn't commit, so the
+# caller's insert and the summary update land in the same SQLite transaction.
+def record_transaction(conn, habit_id, amount, quantity, day, bounty_description=None, bounty_id=None):
+    row = (habit_id, amount, quantity, day, bounty_description, bounty_id)
+    return record_transactions(conn, [row])[0]
+
+# Take the next `count` sync versions from the sequence in one statement,
+# instead of an insert trigger taking them one row at a time. This also
+# takes the write lock, so the versions are used in the order they're taken.
+def reserve_row_versions(conn, count):
+    last = conn.execute('UPDATE sync_sequence SET version = version + ? RETURNING version',
+                        (count,)).fetchall()[0][0]
+    return range(last - count + 1, last + 1)
+
+# Batched version of record_transaction for rows shaped like
+# (habit_id, amount, quantity, date, bounty_description, bounty_id).
+# Returns the new ids: the inserts hold the write lock, so each row took
+# the next id in turn and they end at the current maximum.
+def record_transactions(conn, rows):
+    if not rows:
+        return []
+    versions = reserve_row_versions(conn, len(rows))
+    conn.executemany(INSERT_TRANSACTION_SQL, [row + (version,) for row, version in zip(rows, versions)])
+    last_id = conn.execute('SELECT MAX(id) FROM transactions').fetchone()[0]
+    apply_transaction_effects(conn, rows)
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO daily_rollups (habit_id, day, count, quantity, earned) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (habit_id, day) DO UPDATE SET
+        count = count + excluded.count,
+        quantity = quantity + excluded.quantity,
+        earned = earned + excluded.earned
+'''
+
+# Fold newly inserted ledger rows into the ledger summary and the daily
+# rollups, one upsert per affected entry rather than one per row
+def apply_transaction_effects(conn, rows):
+    deltas = {}
+    rollups = {}
+    for habit_id, amount, quantity, day, bounty_description, bounty_id in rows:
+        habit_id = int(habit_id)
+        total = amount * quantity
+        entries = [('total', 0), ('habit', habit_id)]
+        if bounty_id is not None:
+            entries.append(('bounty', bounty_id))
+        for entry in entries:
+            deltas[entry] = deltas.get(entry, 0) + total
+        
+        count, quantity_sum, earned = rollups.get((habit_id, day), (0, 0, 0))
+        rollups[(habit_id, day)] = (count + 1, quantity_sum + quantity, earned + total)
+    
+    conn.executemany(UPSERT_SUMMARY_SQL,
+                     [(scope, key, total) for (scope, key), total in deltas.items()])
+    conn.executemany(UPSERT_ROLLUP_SQL,
+                     [(habit_id, day) + totals for (habit_id, day), totals in rollups.items()])
+    
+    new_days = {}
+    for habit_id, day in rollups:
+        if habit_id != -1:
+            new_days.setdefault(habit_id, []).append(day)
+    update_streaks(conn, new_days)
+
+def get_balance(conn):
+    row = conn.execute("SELECT total FROM ledger_summary WHERE scope = 'total' AND key = 0").fetchone()
+    return row['total'] if row else 0
+
+# Claim an open bounty and pay it out, inside the caller's write transaction.
+# The guarded UPDATE ... RETURNING claims it and reads what to pay in one
+# statement, so of any number of requests racing for a bounty exactly one
+# gets its row back. Returns (bounty, transaction id), or None if there's no
+# such bounty or it was already completed.
+def pay_bounty(conn, bounty_id, today):
+    bounty = conn.execute('''
+        UPDATE bounties SET completed = 1 WHERE id = ? AND completed = 0
+        RETURNING id, description, amount
+    ''', (bounty_id,)).fetchall()
+    if not bounty:
+        return None
+    bounty = bounty[0]
+    transaction_id = record_transaction(conn, -1, bounty['amount'], 1, today,
+                                        bounty_description=bounty['description'], bounty_id=bounty['id'])
+    return bounty, transaction_id
+
+def bounty_exists(conn, bounty_id):
+    return conn.execute('SELECT 1 FROM bounties WHERE id = ?', (bounty_id,)).fetchone() is not None
+
+# Recompute the summary from the raw ledger, as {(scope, key): total}.
+# Transactions folded away by compaction count through their monthly totals.
+def compute_ledger_summary(conn):
+    ledger = 'SELECT habit_id, bounty_id, amount * quantity AS total FROM transactions'
+    if table_exists(conn, 'monthly_summaries'):
+        ledger += '''
+            UNION ALL
+            SELECT habit_id, NULLIF(bounty_id, 0), earned FROM monthly_summaries
+        '''
+    
+    expected = {('total', 0): 0}
+    row = conn.execute(f'SELECT SUM(total) AS total FROM ({ledger})').fetchone()
+    expected[('total', 0)] = row['total'] or 0
+    
+    # Rows from before every transaction had a habit only count towards the total
+    for row in conn.execute(f'''
+        SELECT habit_id, SUM(total) AS total
+        FROM ({ledger}) WHERE habit_id IS NOT NULL GROUP BY habit_id
+    '''):
+        expected[('habit', row['habit_id'])] = row['total'] or 0
+    
+    for row in conn.execute(f'''
+        SELECT bounty_id, SUM(total) AS total
+        FROM ({ledger}) WHERE bounty_id IS NOT NULL GROUP BY bounty_id
+    '''):
+        expected[('bounty', row['bounty_id'])] = row['total'] or 0
+    
+    return expected
+
+# Compare the stored summary against the raw ledger.
+# Returns a list of (scope, key, stored, expected) for every entry that drifted.
+def check_ledger_summary(conn, tolerance=0.005):
+    expected = compute_ledger_summary(conn)
+    stored = {(row['scope'], row['key']): row['total']
+              for row in conn.execute('SELECT scope, key, total FROM ledger_summary')}
+    
+    drift = []
+    for entry in sorted(set(expected) | set(stored), key=lambda e: (e[0], e[1])):
+        stored_total = stored.get(entry, 0)
+        expected_total = expected.get(entry, 0)
+        if abs(stored_total - expected_total) > tolerance:
+            drift.append((entry[0], entry[1], stored_total, expected_total))
+    return drift
+
+# Replace the stored summary with one recomputed from the raw ledger.
+# Doesn't commit.
+def rebuild_ledger_summary(conn):
+    touch_data_version(conn)
+    expected = compute_ledger_summary(conn)
+    conn.execute('DELETE FROM ledger_summary')
+    conn.executemany('INSERT INTO ledger_summary (scope, key, total) VALUES (?, ?, ?)',
+                     [(scope, key, total) for (scope, key), total in expected.items()])
+
+# Daily rollup functions
+
+# Recompute the rollups, or one habit's, from the raw ledger. Days before the
+# compaction horizon are kept as they are, since their raw rows are gone.
+# Doesn't commit.
+def rebuild_daily_rollups(conn, habit_id=None):
+    touch_data_version(conn)
+    horizon = get_compaction_horizon(conn) or ''
+    habit = '' if habit_id is None else 'AND habit_id = ?'
+    params = (horizon,) if habit_id is None else (horizon, habit_id)
+    conn.execute(f'DELETE FROM daily_rollups WHERE day >= ? {habit}', params)
+    conn.execute(f'''
+        INSERT INTO daily_rollups (habit_id, day, count, quantity, earned)
+        SELECT habit_id, date, COUNT(*), SUM(quantity), SUM(amount * quantity)
+        FROM transactions
+        WHERE habit_id IS NOT NULL AND date IS NOT NULL AND date >= ? {habit}
+        GROUP BY habit_id, date
+    ''', params)
+
+# Per-day totals, optionally for one habit (-1 for bounties) and a date range.
+# Without a habit the days are summed across all habits.
+def get_daily_stats(conn, habit_id=None, start=None, end=None):
+    # Rollups are keyed by the zero-padded 'YYYY-MM-DD' date itself, whose
+    # text order is date order, so the range is still an index range scan
+    clauses, params = date_range_filter(start, end, column='day', encode=str)
+    if habit_id is not None:
+        clauses.append('habit_id = ?')
+        params.append(habit_id)
+    
+    sql = '''
+        SELECT day, SUM(count) AS count, SUM(quantity) AS quantity, SUM(earned) AS earned
+        FROM daily_rollups
+    '''
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' GROUP BY day ORDER BY day'
+    return conn.execute(sql, params).fetchall()
+
+# Streak functions
+def _day_number(day):
+    return date.fromisoformat(day).toordinal()
+
+# Update streaks for {habit_id: [days that just got a completion]}. A single
+# completion on or after the habit's last completed day is an O(1) update;
+# backdated or multi-day inserts recompute just that habit from its rollups.
+def update_streaks(conn, new_days):
+    if not new_days:
+        return
+    
+    recompute = []
+    for habit_id, days in new_days.items():
+        streak = conn.execute('''
+            SELECT current_streak, longest_streak, last_day FROM habit_streaks WHERE habit_id = ?
+        ''', (habit_id,)).fetchone()
+        
+        if len(days) > 1 or (streak and streak['last_day'] and days[0] < streak['last_day']):
+            recompute.append(habit_id)
+            continue
+        
+        day = days[0]
+        if not streak or not streak['last_day']:
+            current = 1
+        elif day == streak['last_day']:
+            continue
+        elif _day_number(day) - _day_number(streak['last_day']) == 1:
+            current = streak['current_streak'] + 1
+        else:
+            current = 1
+        longest = max(current, streak['longest_streak'] if streak else 0)
+        
+        conn.execute('''
+            INSERT INTO habit_streaks (habit_id, current_streak, longest_streak, last_day)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (habit_id) DO UPDATE SET
+                current_streak = excluded.current_streak,
+                longest_streak = excluded.longest_streak,
+                last_day = excluded.last_day
+        ''', (habit_id, current, longest, day))
+    
+    if recompute:
+        rebuild_streaks(conn, recompute)
+
+# Recompute streaks from the daily rollups, for the given habits or all of
+# them. Costs O(days with a completion) per habit. Doesn't commit.
+def rebuild_streaks(conn, habit_ids=None):
+    if habit_ids is None:
+        habit_ids = [row['id'] for row in conn.execute('SELECT id FROM habits')]
+    
+    for habit_id in habit_ids:
+        current = longest = 0
+        previous = last_day = None
+        for row in conn.execute('''
+            SELECT day FROM daily_rollups WHERE habit_id = ? ORDER BY day
+        ''', (habit_id,)):
+            number = _day_number(row['day'])
+            current = current + 1 if previous is not None and number - previous == 1 else 1
+            longest = max(longest, current)
+            previous, last_day = number, row['day']
+        
+        conn.execute('''
+            INSERT OR REPLACE INTO habit_streaks (habit_id, current_streak, longest_streak, last_day)
+            VALUES (?, ?, ?, ?)
+        ''', (habit_id, current, longest, last_day))
+
+# Habits with their streaks. A current streak only counts while it is still
+# alive, i.e. the habit was completed today or yesterday.
+def get_habits_with_streaks(conn, today=None):
+    return conn.execute(*habits_with_streaks_query(today)).fetchall()
+
+# The query behind get_habits_with_streaks(), as (sql, params)
+def habits_with_streaks_query(today=None):
+    today = today or local_today()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    return '''
+        SELECT h.id, h.description, h.amount,
+               CASE WHEN s.last_day >= ? THEN s.current_streak ELSE 0 END AS current_streak,
+               COALESCE(s.longest_streak, 0) AS longest_streak,
+               s.last_day
+        FROM habits h
+        LEFT JOIN habit_streaks s ON s.habit_id = h.id
+    ''', (yesterday,)
+
+# Ledger compaction functions. Transactions older than the horizon are folded
+# into per-habit monthly totals; ARCHIVE_DB, if set, is a separate database
+# that keeps the raw rows, attached read-only when history asks for them.
+DEFAULT_CONFIG.update(
+    COMPACTION_HORIZON_DAYS=int(os.environ.get('HABIT_TRACKER_COMPACTION_HORIZON_DAYS', 365)),
+    ARCHIVE_DB=os.environ.get('HABIT_TRACKER_ARCHIVE_DB', ''),
+)
+
+TRANSACTION_COLUMNS = 'id, habit_id, amount, quantity, date, bounty_description, bounty_id, day, recorded_at'
+
+# The first day not yet compacted, or None if nothing has been
+def get_compaction_horizon(conn):
+    if not table_exists(conn, 'ledger_compaction'):
+        return None
+    row = conn.execute('SELECT horizon FROM ledger_compaction WHERE id = 1').fetchone()
+    return row['horizon'] if row else None
+
+# Fold transactions dated before the start of the month `horizon_days` ago
+# into monthly_summaries, moving the raw rows to `archive_path` if given.
+# The ledger summary and the daily rollups are untouched, so the balance,
+# stats and streaks come out exactly as before. Commits, and expects a
+# connection of its own rather than a pooled one.
+# Returns (transactions compacted, new horizon).
+def compact_ledger(conn, horizon_days=None, archive_path=None, today=None):
+    horizon_days = current_app.config['COMPACTION_HORIZON_DAYS'] if horizon_days is None else horizon_days
+    today = today or local_today()
+    horizon = (today - timedelta(days=horizon_days)).replace(day=1).isoformat()
+    
+    if archive_path:
+        conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+        conn.execute('''CREATE TABLE IF NOT EXISTS archive.transactions (
+                        id INTEGER PRIMARY KEY,
+                        habit_id INTEGER,
+                        amount REAL,
+                        quantity INTEGER DEFAULT 1,
+                        date TEXT,
+                        bounty_description TEXT DEFAULT NULL,
+                        bounty_id INTEGER DEFAULT NULL,
+                        day INTEGER,
+                        recorded_at INTEGER
+                    )''')
+        # Archives started before the epoch day columns existed
+        archive_columns = {row['name'] for row in conn.execute('PRAGMA archive.table_info(transactions)')}
+        for column in ('day', 'recorded_at'):
+            if column not in archive_columns:
+                conn.execute(f'ALTER TABLE archive.transactions ADD COLUMN {column} INTEGER')
+        conn.execute(f"UPDATE archive.transactions SET day = {EPOCH_DAY_SQL.format('date')} WHERE day IS NULL")
+        conn.execute('DROP INDEX IF EXISTS archive.idx_transactions_date')
+        conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_transactions_habit_id ON transactions (habit_id, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_transactions_day ON transactions (day)')
+        conn.commit()
+    
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # The newest row always stays, so SQLite never reuses an archived id
+        max_id = conn.execute('SELECT MAX(id) FROM main.transactions').fetchone()[0] or 0
+        version = conn.execute('SELECT version FROM sync_sequence').fetchone()[0]
+        where = 'WHERE day < ? AND habit_id IS NOT NULL AND id < ?'
+        params = (epoch_day(horizon), max_id)
+        
+        if archive_path:
+            # OR IGNORE: the archive commits separately from the main
+            # database, so a rerun after a crash may find rows already there
+            conn.execute(f'''
+                INSERT OR IGNORE INTO archive.transactions ({TRANSACTION_COLUMNS})
+                SELECT {TRANSACTION_COLUMNS} FROM main.transactions {where}
+            ''', params)
+        conn.execute(f'''
+            INSERT INTO monthly_summaries (habit_id, bounty_id, month, count, quantity, earned)
+            SELECT habit_id, COALESCE(bounty_id, 0), substr(date, 1, 7),
+                   COUNT(*), SUM(quantity), SUM(amount * quantity)
+            FROM main.transactions {where}
+            GROUP BY 1, 2, 3
+            ON CONFLICT (habit_id, bounty_id, month) DO UPDATE SET
+                count = count + excluded.count,
+                quantity = quantity + excluded.quantity,
+                earned = earned + excluded.earned
+        ''', params)
+        compacted = conn.execute(f'DELETE FROM main.transactions {where}', params).rowcount
+        # Compacted rows are archived, not deleted, so sync clients keep them
+        conn.execute("DELETE FROM sync_tombstones WHERE entity = 'transaction' AND row_version > ?",
+                     (version,))
+        
+        # Never move the horizon back; rows before it are already folded
+        horizon = max(horizon, get_compaction_horizon(conn) or '')
+        conn.execute('''
+            INSERT INTO ledger_compaction (id, horizon, compacted_at) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET horizon = excluded.horizon, compacted_at = excluded.compacted_at
+        ''', (horizon, datetime.now(timezone.utc).isoformat(timespec='seconds')))
+        commit_changes(conn)
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if archive_path:
+            conn.execute('DETACH DATABASE archive')
+    
+    vacuum_incrementally(conn)
+    return compacted, horizon
+
+# Hand free pages back to the filesystem. Databases created before
+# auto_vacuum was enabled need one full VACUUM to switch over.
+def vacuum_incrementally(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    # The pragma frees a page per step, and only executescript() steps it
+    # to completion
+    conn.executescript('PRAGMA incremental_vacuum;')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+# The archive for this context's database: `archive_path` (ARCHIVE_DB by
+# default), or in multi-tenant mode a file per shard next to it, e.g.
+# archive-user-1.db, so no account reads another's archived rows
+def archive_database(archive_path=None):
+    archive_path = archive_path or current_app.config['ARCHIVE_DB']
+    if not archive_path or not current_app.config['MULTI_TENANT']:
+        return archive_path
+    root, ext = os.path.splitext(archive_path)
+    return f'{root}-{os.path.splitext(os.path.basename(current_database()))[0]}{ext}'
+
+# The table history reads from: the live transactions, plus the archived
+# ones when asked for and the archive exists. The archive is attached
+# read-only, once per pooled connection.
+def transaction_source(conn, include_archive=False):
+    archive_path = archive_database()
+    if not include_archive or not archive_path or not os.path.exists(archive_path):
+        return 'transactions'
+    
+    if not any(row['name'] == 'archive' for row in conn.execute('PRAGMA database_list')):
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(archive_path)) + '?mode=ro'
+        conn.execute('ATTACH DATABASE ? AS archive', (uri,))
+    return f'''(
+        SELECT {TRANSACTION_COLUMNS} FROM main.transactions
+        UNION ALL
+        SELECT {TRANSACTION_COLUMNS} FROM archive.transactions
+    )'''
+
+# Analytics functions
+DEFAULT_CONFIG.update(
+    ANALYTICS_SERIES_DAYS=int(os.environ.get('HABIT_TRACKER_ANALYTICS_SERIES_DAYS', 90)),
+)
+
+# Guards each app's analytics results, kept in
+# database_extensions()['habit_analytics_cache'] as [cache key, result]
+_analytics_cache_lock = threading.Lock()
+
+# Earnings trends computed with NumPy: weekly and monthly totals, 7 and 30
+# day rolling averages, each habit's share of the total and simple
+# projections. SQLite sums the daily rollups into one row per day and the
+# ledger summary already holds each habit's total, so only O(days) values
+# cross into Python and every aggregate after that is a vectorized pass.
+# NumPy is optional and slow to import, so it's only loaded here; raises
+# ImportError without it.
+def compute_analytics(conn, today=None, series_days=None):
+    import numpy as np
+    
+    today = today or local_today()
+    series_days = series_days or current_app.config['ANALYTICS_SERIES_DAYS']
+    
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        'SELECT day, SUM(earned), SUM(count) FROM daily_rollups GROUP BY day').fetchall()
+    if not rows:
+        return None
+    days, earned, counts = zip(*rows)
+    
+    # 'YYYY-MM-DD' strings become day numbers once, up front
+    day_numbers = np.array(days, dtype='datetime64[D]').astype(np.int64)
+    earned = np.array(earned, dtype=np.float64)
+    counts = np.array(counts, dtype=np.int64)
+    
+    # Dense per-day earnings from the first completion through today
+    today_number = int(np.datetime64(today, 'D').astype(np.int64))
+    first_day = int(day_numbers.min())
+    last_day = max(int(day_numbers.max()), today_number)
+    offsets = day_numbers - first_day
+    daily = np.bincount(offsets, weights=earned, minlength=last_day - first_day + 1)
+    daily_counts = np.bincount(offsets, weights=counts, minlength=daily.size)
+    
+    # Rolling averages from one cumulative sum; windows that reach back before
+    # the first completion count the missing days as zero
+    cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+    index = np.arange(1, daily.size + 1)
+    rolling_7 = (cumulative[index] - cumulative[np.maximum(index - 7, 0)]) / 7
+    rolling_30 = (cumulative[index] - cumulative[np.maximum(index - 30, 0)]) / 30
+    
+    # Weeks start on Monday; day 0 (1970-01-01) was a Thursday
+    weeks = (day_numbers + 3) // 7
+    week_numbers, week_index = np.unique(weeks, return_inverse=True)
+    weekly = np.bincount(week_index, weights=earned)
+    week_starts = (week_numbers * 7 - 3).astype('datetime64[D]')
+    
+    months = day_numbers.astype('datetime64[D]').astype('datetime64[M]')
+    month_numbers, month_index = np.unique(months, return_inverse=True)
+    monthly = np.bincount(month_index, weights=earned)
+    
+    habit_rows = cursor.execute(
+        "SELECT s.key, h.description, s.total FROM ledger_summary s "
+        "LEFT JOIN habits h ON h.id = s.key "
+        "WHERE s.scope = 'habit' AND s.total != 0").fetchall()
+    habit_ids, descriptions, per_habit = zip(*habit_rows) if habit_rows else ((), (), ())
+    per_habit = np.array(per_habit, dtype=np.float64)
+    total = float(earned.sum())
+    shares = per_habit / total if total else np.zeros_like(per_habit)
+    
+    # Projections: the last 30 days' pace, plus a least-squares trend over them
+    # (days after today, from future-dated completions, are left out). Days
+    # in the window before the first completion count as zero.
+    end = max(today_number - first_day + 1, 0)
+    recent = daily[max(end - 30, 0):end]
+    pace = float(recent.sum()) / 30
+    slope = float(np.polyfit(np.arange(recent.size), recent, 1)[0]) if recent.size > 1 else 0.0
+    this_month = np.datetime64(today, 'M')
+    month_start = int(this_month.astype('datetime64[D]').astype(np.int64))
+    days_left = int((this_month + 1).astype('datetime64[D]').astype(np.int64)) - today_number - 1
+    month_to_date = float(daily[max(month_start - first_day, 0):end].sum())
+    
+    series = slice(max(daily.size - series_days, 0), daily.size)
+    series_days_list = np.arange(first_day, last_day + 1)[series].astype('datetime64[D]').astype(str)
+    
+    return {
+        "total_earned": total,
+        "completions": int(counts.sum()),
+        "daily": [{"day": str(day), "earned": float(e), "completions": int(c),
+                   "rolling_7": float(r7), "rolling_30": float(r30)}
+                  for day, e, c, r7, r30 in zip(series_days_list, daily[series], daily_counts[series],
+                                                rolling_7[series], rolling_30[series])],
+        "weekly": [{"week_start": str(start), "earned": float(value)}
+                   for start, value in zip(week_starts, weekly)],
+        "monthly": [{"month": str(month), "earned": float(value)}
+                    for month, value in zip(month_numbers, monthly)],
+        "habits": sorted(({"habit_id": habit_id,
+                           "description": 'Bounties' if habit_id == -1 else description,
+                           "earned": float(value), "share": float(share)}
+                          for habit_id, description, value, share in zip(habit_ids, descriptions, per_habit, shares)),
+                         key=lambda h: h["earned"], reverse=True),
+        "projection": {
+            "daily_pace": pace,
+            "trend_per_day": slope,
+            "next_30_days": pace * 30,
+            "month_to_date": month_to_date,
+            "month_end": month_to_date + pace * days_left,
+        },
+    }
+
+# compute_analytics() for the current data, reused until the next write
+def get_analytics(conn):
+    key = index_cache_key()
+    cache = database_extensions()['habit_analytics_cache']
+    with _analytics_cache_lock:
+        cached_key, result = cache
+    if cached_key != key:
+        result = compute_analytics(conn)
+        with _analytics_cache_lock:
+            cache[:] = [key, result]
+    return result
+
+# Transaction history functions
+
+# Transactions joined with their habit, using the bounty's own description
+# for bounty payouts (habit_id = -1)
+TRANSACTION_HISTORY_SQL = '''
+    SELECT 
+        t.id, 
+        t.date, 
+        t.amount, 
+        t.quantity, 
+        (t.amount * t.quantity) as total_amount, 
+        CASE 
+            WHEN t.habit_id = -1 THEN t.bounty_description
+            ELSE h.description 
+        END as description,
+        t.habit_id,
+        t.recorded_at
+    FROM {source} t
+    LEFT JOIN habits h ON t.habit_id = h.id
+'''
+
+TRANSACTION_HISTORY_FIELDS = ('id', 'date', 'habit_id', 'description', 'amount', 'quantity', 'total_amount',
+                              'recorded_at')
+
+DEFAULT_CONFIG.update(
+    EXPORT_BATCH_SIZE=int(os.environ.get('HABIT_TRACKER_EXPORT_BATCH_SIZE', 1000)),
+)
+
+def parse_date_arg(value, name):
+    if not value:
+        return None
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{name} must be formatted YYYY-MM-DD')
+    return value
+
+# Unlike request.args.get(type=int), a bad value is an error rather than
+# quietly the default, so a mangled cursor can't restart from the top
+def parse_int_arg(value, name, default=None):
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if not fits_sqlite_integer(value):
+        raise ValueError(f'{name} is out of range')
+    return value
+
+# Parse the history filters shared by the export and history endpoints:
+# start/end dates, habit_id, and bounties=1 for bounty payouts only.
+# (include_archive=1 is read separately, by wants_archive().)
+# Raises ValueError with a message for the client on bad input.
+def parse_history_filters(args):
+    start = parse_date_arg(args.get('start'), 'start')
+    end = parse_date_arg(args.get('end'), 'end')
+    clauses, params = date_range_filter(start, end)
+    
+    if args.get('bounties') in ('1', 'true'):
+        clauses.append('t.habit_id = -1')
+    elif args.get('habit_id'):
+        try:
+            habit_id = int(args.get('habit_id'))
+        except ValueError:
+            raise ValueError('habit_id must be an integer')
+        clauses.append('t.habit_id = ?')
+        params.append(habit_id)
+    
+    return clauses, params
+
+def wants_archive(args):
+    return args.get('include_archive') in ('1', 'true')
+
+# Yield the matching history in batches of rows, oldest first. The single
+# SELECT reads one consistent WAL snapshot, so concurrent writes are safe.
+def iter_transaction_history(conn, clauses, params, batch_size=None, include_archive=False):
+    batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+    sql = TRANSACTION_HISTORY_SQL.format(source=transaction_source(conn, include_archive))
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY t.id'
+    
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+def export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TRANSACTION_HISTORY_FIELDS)
+    for rows in batches:
+        writer.writerows([row[field] for field in TRANSACTION_HISTORY_FIELDS] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_ndjson(batches):
+    for rows in batches:
+        yield ''.join(json.dumps({field: row[field] for field in TRANSACTION_HISTORY_FIELDS}) + '\n'
+                      for row in rows)
+
+EXPORT_FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
+
+DEFAULT_CONFIG.update(
+    HISTORY_PAGE_SIZE=int(os.environ.get('HABIT_TRACKER_HISTORY_PAGE_SIZE', 20)),
+    HISTORY_MAX_PAGE_SIZE=200,
+)
+
+# One page of history, newest first, starting below the `before` id cursor.
+# Seeking on the id index makes every page cost the same, unlike OFFSET.
+# Returns (rows, next_cursor); next_cursor is None on the last page.
+def get_transaction_page(conn, clauses, params, before=None, limit=None, include_archive=False):
+    limit = limit or current_app.config['HISTORY_PAGE_SIZE']
+    clauses, params = list(clauses), list(params)
+    if before is not None:
+        clauses.append('t.id < ?')
+        params.append(before)
+    
+    sql = TRANSACTION_HISTORY_SQL.format(source=transaction_source(conn, include_archive))
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY t.id DESC LIMIT ?'
+    
+    # Fetch one extra row to find out whether there is another page
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['id']
+    return rows, None
+
+# Bulk import functions
+BULK_FORMATS = ('json', 'ndjson', 'csv')
+MAX_REPORTED_ERRORS = 1000
+
+DEFAULT_CONFIG.update(
+    BULK_CHUNK_SIZE=int(os.environ.get('HABIT_TRACKER_BULK_CHUNK_SIZE', 5000)),
+)
+
+# Yield (row_number, record) pairs from a binary stream without loading it
+# all into memory (except for a plain JSON array, which has to be parsed whole).
+# record is a dict, or an exception if that row couldn't be parsed.
+def iter_bulk_records(stream, fmt):
+    if fmt == 'json':
+        try:
+            records = json.load(stream)
+        except ValueError as e:
+            yield 1, e
+            return
+        if not isinstance(records, list):
+            yield 1, ValueError('expected a JSON array of transactions')
+            return
+        yield from enumerate(records, start=1)
+        return
+    
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        yield from enumerate(csv.DictReader(text), start=1)
+        return
+    
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except ValueError as e:
+            yield row_number, e
+
+# Parse a money amount. float() also accepts 'nan' and 'inf', which would
+# poison every balance they're added to, so those raise ValueError too.
+def parse_amount(value):
+    amount = float(value)
+    if not math.isfinite(amount):
+        raise ValueError(f'amount must be finite: {value!r}')
+    return amount
+
+# Whether an integer fits in a SQLite INTEGER. A bigger one raises
+# OverflowError once it's bound to a statement.
+def fits_sqlite_integer(value):
+    return -2 ** 63 <= value < 2 ** 63
+
+# The checks every way of logging a completion shares: an id and quantity
+# SQLite can store, at least one unit, and a total (amount * quantity) that
+# is still finite, since an overflow to inf would poison the summary and
+# rollups for good. Raises ValueError.
+def check_completion(habit_id, amount, quantity):
+    if not fits_sqlite_integer(habit_id):
+        raise ValueError('habit_id is out of range')
+    if quantity < 1:
+        raise ValueError('quantity must be at least 1')
+    if not fits_sqlite_integer(quantity):
+        raise ValueError('quantity is out of range')
+    if not math.isfinite(amount * quantity):
+        raise ValueError('amount times quantity is too large')
+
+# Turn one imported record into a ledger row, raising ValueError with a
+# message suitable for the per-row error report
+def validate_bulk_record(record, habit_amounts, valid_dates, today):
+    if isinstance(record, Exception):
+        raise ValueError(f'could not parse row: {record}')
+    if not isinstance(record, dict):
+        raise ValueError('expected an object with habit_id, quantity, amount and date')
+    
+    try:
+        habit_id = int(record.get('habit_id'))
+    except (TypeError, ValueError):
+        raise ValueError('habit_id must be an integer')
+    if not fits_sqlite_integer(habit_id):
+        raise ValueError('habit_id is out of range')
+    if habit_id not in habit_amounts:
+        raise ValueError(f'unknown habit_id {habit_id}')
+    
+    quantity = record.get('quantity')
+    try:
+        quantity = 1 if quantity in (None, '') else int(quantity)
+    except (TypeError, ValueError):
+        raise ValueError('quantity must be an integer')
+    
+    amount = record.get('amount')
+    if amount in (None, ''):
+        amount = habit_amounts[habit_id]
+    else:
+        try:
+            amount = parse_amount(amount)
+        except (TypeError, ValueError):
+            raise ValueError('amount must be a number')
+    check_completion(habit_id, amount, quantity)
+    
+    # valid_dates maps each date seen so far to its zero-padded form
+    day = record.get('date')
+    if day in (None, ''):
+        day = today
+    elif not isinstance(day, str):
+        raise ValueError('date must be formatted YYYY-MM-DD')
+    if day not in valid_dates:
+        try:
+            valid_dates[day] = datetime.strptime(day, '%Y-%m-%d').date().isoformat()
+        except (TypeError, ValueError):
+            raise ValueError('date must be formatted YYYY-MM-DD')
+    
+    return (habit_id, amount, quantity, valid_dates[day], None, None)
+
+# Validate and insert imported records in chunked transactions. Bad rows are
+# reported and skipped; they never abort the rest of the import.
+# Returns (inserted, failed, errors) where errors lists the first
+# MAX_REPORTED_ERRORS failures as {'row': n, 'error': message}.
+def ingest_transactions(conn, records, chunk_size=None):
+    chunk_size = chunk_size or current_app.config['BULK_CHUNK_SIZE']
+    habit_amounts = {row['id']: row['amount'] for row in conn.execute('SELECT id, amount FROM habits')}
+    valid_dates = {}
+    today = local_today().isoformat()
+    
+    inserted = failed = 0
+    errors = []
+    chunk = []
+    
+    def flush():
+        record_transactions(conn, chunk)
+        commit_changes(conn)
+        chunk.clear()
+    
+    for row_number, record in records:
+        try:
+            chunk.append(validate_bulk_record(record, habit_amounts, valid_dates, today))
+        except (TypeError, ValueError) as e:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': row_number, 'error': str(e)})
+            continue
+        
+        if len(chunk) >= chunk_size:
+            inserted += len(chunk)
+            flush()
+    
+    if chunk:
+        inserted += len(chunk)
+        flush()
+    
+    return inserted, failed, errors
+
+def detect_bulk_format(content_type=None, filename=None):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        return 'ndjson'
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type == 'application/json':
+        return 'json'
+    
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension == 'jsonl':
+        return 'ndjson'
+    return extension if extension in BULK_FORMATS else None
+
+# Group commit functions
+DEFAULT_CONFIG.update(
+    WRITE_BEHIND=os.environ.get('HABIT_TRACKER_WRITE_BEHIND', '0') != '0',
+    WRITE_BATCH_SIZE=int(os.environ.get('HABIT_TRACKER_WRITE_BATCH_SIZE', 64)),
+    WRITE_MAX_DELAY_MS=float(os.environ.get('HABIT_TRACKER_WRITE_MAX_DELAY_MS', 1)),
+    WRITE_ACK_TIMEOUT=float(os.environ.get('HABIT_TRACKER_WRITE_ACK_TIMEOUT', 10)),
+)
+
+# A single writer thread that drains queued ledger rows and commits them in
+# groups of up to batch_size, waiting at most max_delay_ms for a group to
+# fill. Each submitter gets a Future that resolves once its row is committed,
+# so a group of writers shares one commit (and one fsync) instead of queueing
+# on SQLite's write lock for one each. A row's idempotency key is recorded in
+# the same commit, so a retry after a lost acknowledgement can't add it twice.
+class GroupCommitWriter:
+    def __init__(self, app, path, batch_size, max_delay_ms):
+        self.app = app
+        self.path = path
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='habit-group-commit', daemon=True)
+        self._thread.start()
+    
+    # Queue a row shaped like record_transactions() rows. The future resolves
+    # to (result, replayed): the {'op', 'id'} result stored for `key`, and
+    # whether the key had already been used, in which case nothing was added.
+    def submit(self, row, key):
+        future = Future()
+        self._queue.put((row, key, future))
+        return future
+    
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        with self.app.app_context():
+            ensure_db_initialized(self.path)
+            conn = open_connection(self.path)
+        # The acknowledgement promises durability, so every group is synced
+        conn.execute('PRAGMA synchronous = FULL')
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            self._commit(conn, batch)
+        conn.close()
+    
+    def _commit(self, conn, batch):
+        try:
+            # Keys already used, before or earlier in this group, add nothing
+            fresh, repeats, keys = [], [], set()
+            for item in batch:
+                key = item[1]
+                if key in keys or find_idempotency_key(conn, key) is not None:
+                    repeats.append(item)
+                else:
+                    keys.add(key)
+                    fresh.append(item)
+            ids = record_transactions(conn, [row for row, key, future in fresh])
+            results = [{"op": "add_transaction", "id": transaction_id} for transaction_id in ids]
+            for (row, key, future), result in zip(fresh, results):
+                record_idempotency_key(conn, key, result)
+            with self.app.app_context():
+                prune_idempotency_keys(conn)
+            commit_changes(conn)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if len(batch) > 1:
+                # Rather than fail the whole group for one bad row, commit
+                # its rows one at a time so only the offending request fails
+                for item in batch:
+                    self._commit(conn, [item])
+                return
+            batch[0][2].set_exception(e)
+        else:
+            for (row, key, future), result in zip(fresh, results):
+                future.set_result((result, False))
+            for row, key, future in repeats:
+                future.set_result((find_idempotency_key(conn, key), True))
+
+_writer_lock = threading.Lock()
+
+def get_group_commit_writer():
+    extensions = database_extensions()
+    writer = extensions.get('habit_group_commit')
+    if writer is None:
+        with _writer_lock:
+            writer = extensions.get('habit_group_commit')
+            if writer is None:
+                writer = GroupCommitWriter(current_app._get_current_object(), current_database(),
+                                           current_app.config['WRITE_BATCH_SIZE'],
+                                           current_app.config['WRITE_MAX_DELAY_MS'])
+                extensions['habit_group_commit'] = writer
+    return writer
+
+# Live update functions. Writes publish what changed to an in-process
+# broadcaster, which fans each event out to every open /events stream, so
+# connected pages stay current without polling the database.
+DEFAULT_CONFIG.update(
+    EVENTS_KEEPALIVE=float(os.environ.get('HABIT_TRACKER_EVENTS_KEEPALIVE', 15)),
+    EVENTS_WATCH_INTERVAL=float(os.environ.get('HABIT_TRACKER_EVENTS_WATCH_INTERVAL', 1)),
+    EVENTS_QUEUE_SIZE=100,
+)
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+# One queue per connected client. A client that falls EVENTS_QUEUE_SIZE
+# events behind is dropped and reconnects, rather than holding memory.
+class EventSubscription:
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = False
+
+# `database` is the shard it's for in multi-tenant mode, else None.
+class EventBroadcaster:
+    def __init__(self, app, queue_size, watch_interval, database=None):
+        self.app = app
+        self.queue_size = queue_size
+        self.watch_interval = watch_interval
+        self.database = database
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._closed = False
+        self._seen = self._version()
+    
+    def has_subscribers(self):
+        return bool(self._subscribers)
+    
+    def subscribe(self):
+        subscription = EventSubscription(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='habit-events', daemon=True)
+                self._watcher.start()
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+    
+    def close(self):
+        self._closed = True
+    
+    # Encode the event once and queue it for every subscriber
+    def publish(self, event, data):
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+    
+    def _version(self):
+        with self.app.app_context():
+            use_database(self.database)
+            return data_version(get_db_connection())
+    
+    # Writes made elsewhere (other workers, `flask` commands) only show up as
+    # movement of the data version. When it moves, send the new balance and
+    # a 'refresh' so pages re-read the latest transactions themselves. The
+    # version can't tell this process's own writes apart, so those get a
+    # refresh too, after the events they already sent.
+    # A failed poll (a locked database, say) is logged and tried again next
+    # interval, with the change it missed still unseen, so the watcher never
+    # stops for good.
+    def _watch(self):
+        while not self._closed:
+            time.sleep(self.watch_interval)
+            try:
+                self._poll()
+            except Exception:
+                self.app.logger.exception('Watching for writes from other processes failed')
+    
+    def _poll(self):
+        version = self._version()
+        if version != self._seen and self._subscribers:
+            with self.app.app_context():
+                use_database(self.database)
+                balance = get_balance(get_db_connection())
+            self.publish('refresh', {"balance": balance})
+        self._seen = version
+
+_events_lock = threading.Lock()
+
+def get_event_broadcaster():
+    extensions = database_extensions()
+    broadcaster = extensions.get('habit_events')
+    if broadcaster is None:
+        with _events_lock:
+            broadcaster = extensions.get('habit_events')
+            if broadcaster is None:
+                broadcaster = EventBroadcaster(current_app._get_current_object(),
+                                               current_app.config['EVENTS_QUEUE_SIZE'],
+                                               current_app.config['EVENTS_WATCH_INTERVAL'],
+                                               current_database() if current_app.config['MULTI_TENANT'] else None)
+                extensions['habit_events'] = broadcaster
+    return broadcaster
+
+# Publish the events for writes this request just committed. Events are
+# built with one query each, and only when someone is listening.
+def publish_events(conn, transaction_ids=(), habit=None, bounty=None, refresh=False):
+    broadcaster = database_extensions().get('habit_events')
+    if broadcaster is None or not broadcaster.has_subscribers():
+        return
+    
+    if habit is not None:
+        broadcaster.publish('habit', habit)
+    if bounty is not None:
+        broadcaster.publish('bounty', bounty)
+    for transaction_id in transaction_ids:
+        row = conn.execute(TRANSACTION_HISTORY_SQL.format(source='transactions') + ' WHERE t.id = ?',
+                           (transaction_id,)).fetchone()
+        transaction = {field: row[field] for field in TRANSACTION_HISTORY_FIELDS}
+        if row['habit_id'] != -1:
+            streak = conn.execute('''
+                SELECT current_streak, longest_streak FROM habit_streaks WHERE habit_id = ?
+            ''', (row['habit_id'],)).fetchone()
+            if streak:
+                transaction.update(dict(streak))
+        broadcaster.publish('transaction', transaction)
+    if transaction_ids or refresh:
+        broadcaster.publish('refresh' if refresh else 'balance', {"balance": get_balance(conn)})
+
+# Sync functions. Every insert, update and delete on the synced tables takes
+# the next number from one sequence as its row_version (deletes leave a
+# tombstone with it), so the changes since a client's cursor are an index
+# range scan, however big the tables are.
+DEFAULT_CONFIG.update(
+    SYNC_PAGE_SIZE=int(os.environ.get('HABIT_TRACKER_SYNC_PAGE_SIZE', 500)),
+    SYNC_MAX_BATCH=int(os.environ.get('HABIT_TRACKER_SYNC_MAX_BATCH', 500)),
+    SYNC_KEY_RETENTION_DAYS=int(os.environ.get('HABIT_TRACKER_SYNC_KEY_RETENTION_DAYS', 30)),
+)
+
+# entity -> (table, columns sent to clients)
+SYNC_ENTITIES = {
+    'habit': ('habits', ('id', 'description', 'amount', 'row_version')),
+    'transaction': ('transactions', ('id', 'habit_id', 'amount', 'quantity', 'date', 'bounty_description',
+                                     'bounty_id', 'recorded_at', 'row_version')),
+    'bounty': ('bounties', ('id', 'description', 'amount', 'date_created', 'completed', 'row_version')),
+}
+
+# Up to `limit` changes after version `since`, oldest first, read from one
+# snapshot. Returns (changes by table plus 'deleted', cursor, has_more);
+# the cursor is the `since` for the next call.
+def get_changes(conn, since, limit):
+    conn.execute('BEGIN')
+    try:
+        # Each source contributes at most limit + 1 rows, so the merge is
+        # bounded by the page size rather than by the number of changes
+        candidates = []
+        for entity, (table, fields) in SYNC_ENTITIES.items():
+            for row in conn.execute(f'''
+                SELECT {', '.join(fields)} FROM {table}
+                WHERE row_version > ? ORDER BY row_version LIMIT ?
+            ''', (since, limit + 1)):
+                candidates.append((row['row_version'], table, dict(row)))
+        for row in conn.execute('''
+            SELECT entity, row_id, row_version FROM sync_tombstones
+            WHERE row_version > ? ORDER BY row_version LIMIT ?
+        ''', (since, limit + 1)):
+            candidates.append((row['row_version'], 'deleted',
+                               {"entity": row['entity'], "id": row['row_id'], "row_version": row['row_version']}))
+        balance = get_balance(conn)
+    finally:
+        conn.rollback()
+    
+    candidates.sort(key=lambda candidate: candidate[0])
+    page = candidates[:limit]
+    changes = {table: [] for table, fields in SYNC_ENTITIES.values()}
+    changes['deleted'] = []
+    for version, table, row in page:
+        changes[table].append(row)
+    return changes, (page[-1][0] if page else since), len(candidates) > limit, balance
+
+# Idempotency keys, shared by sync operations and bounty completion. Each
+# applied key keeps its operation's result (with the operation's name as
+# 'op') for SYNC_KEY_RETENTION_DAYS, to answer repeats with.
+def valid_idempotency_key(key):
+    return isinstance(key, str) and 0 < len(key) <= 200
+
+# The stored result for a key, or None if it hasn't been used
+def find_idempotency_key(conn, key):
+    row = conn.execute('SELECT result FROM sync_keys WHERE key = ?', (key,)).fetchone()
+    return json.loads(row['result']) if row else None
+
+def record_idempotency_key(conn, key, result):
+    conn.execute('''
+        INSERT INTO sync_keys (key, result, created_at)
+        VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    ''', (key, json.dumps(result)))
+
+def prune_idempotency_keys(conn):
+    retention = current_app.config['SYNC_KEY_RETENTION_DAYS'] * 86400
+    conn.execute("DELETE FROM sync_keys WHERE created_at < CAST(strftime('%s', 'now') AS INTEGER) - ?",
+                 (retention,))
+
+# The id an earlier operation created, for offline clients that refer to a
+# habit or bounty they haven't synced yet by its operation's key
+def resolve_sync_reference(conn, operation, name, created_by):
+    if operation.get(f'{name}_key') is None:
+        return operation.get(f'{name}_id')
+    result = find_idempotency_key(conn, str(operation[f'{name}_key'])) or {}
+    if result.get('op') != created_by:
+        raise ValueError(f"{name}_key doesn't match an applied {created_by} operation")
+    return result['id']
+
+def parse_sync_amount(operation):
+    try:
+        return parse_amount(operation.get('amount'))
+    except (TypeError, ValueError):
+        raise ValueError('amount must be a number')
+
+def sync_add_habit(conn, operation, today):
+    description = operation.get('description')
+    if not isinstance(description, str) or not description:
+        raise ValueError('description is required')
+    cursor = conn.execute('INSERT INTO habits (description, amount) VALUES (?, ?)',
+                          (description, parse_sync_amount(operation)))
+    return {"id": cursor.lastrowid}
+
+# Validated like a bulk import row, so the client's offline date is kept
+def sync_add_transaction(conn, operation, today):
+    habit_id = resolve_sync_reference(conn, operation, 'habit', 'add_habit')
+    record = dict(operation, habit_id=habit_id)
+    try:
+        habit = conn.execute('SELECT amount FROM habits WHERE id = ?', (int(habit_id),)).fetchone()
+    except (TypeError, ValueError):
+        raise ValueError('habit_id must be an integer')
+    habit_amounts = {int(habit_id): habit['amount']} if habit else {}
+    row = validate_bulk_record(record, habit_amounts, {}, today)
+    return {"id": record_transaction(conn, *row)}
+
+def sync_add_bounty(conn, operation, today):
+    description = operation.get('description')
+    if not isinstance(description, str) or not description:
+        raise ValueError('description is required')
+    cursor = conn.execute('''
+        INSERT INTO bounties (description, amount, date_created, created_at, completed)
+        VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER), 0)
+    ''', (description, parse_sync_amount(operation), today))
+    return {"id": cursor.lastrowid}
+
+def sync_complete_bounty(conn, operation, today):
+    bounty_id = resolve_sync_reference(conn, operation, 'bounty', 'add_bounty')
+    paid = pay_bounty(conn, bounty_id, today)
+    if paid is None:
+        raise ValueError('bounty is already completed' if bounty_exists(conn, bounty_id) else 'bounty not found')
+    bounty, transaction_id = paid
+    return {"id": bounty['id'], "amount": bounty['amount'], "transaction_id": transaction_id}
+
+# Only open bounties can be deleted; completed ones are part of the ledger
+def sync_delete_bounty(conn, operation, today):
+    bounty_id = resolve_sync_reference(conn, operation, 'bounty', 'add_bounty')
+    if not conn.execute('DELETE FROM bounties WHERE id = ? AND completed = 0', (bounty_id,)).rowcount:
+        raise ValueError('no open bounty with that id')
+    return {"id": bounty_id}
+
+SYNC_OPERATIONS = {
+    'add_habit': sync_add_habit,
+    'add_transaction': sync_add_transaction,
+    'add_bounty': sync_add_bounty,
+    'complete_bounty': sync_complete_bounty,
+    'delete_bounty': sync_delete_bounty,
+}
+
+# The types each operation field may have besides null. They're checked
+# before an operation runs, so a list or object where a value belongs (or
+# an integer too big for SQLite) is rejected like any other bad value rather
+# than failing inside SQLite.
+SYNC_FIELD_TYPES = {
+    'op': str,
+    'description': str,
+    'amount': (int, float, str),
+    'quantity': (int, str),
+    'date': str,
+    'habit_id': (int, str),
+    'habit_key': (int, str),
+    'bounty_id': (int, str),
+    'bounty_key': (int, str),
+}
+
+def check_sync_fields(operation):
+    for field, types in SYNC_FIELD_TYPES.items():
+        value = operation.get(field)
+        if value is not None and not isinstance(value, types):
+            raise ValueError(f"{field} can't be a {type(value).__name__}")
+        if isinstance(value, int) and not fits_sqlite_integer(value):
+            raise ValueError(f'{field} is out of range')
+
+# Apply a client's batch of operations in one transaction. Each operation
+# carries a client-generated idempotency key; a key seen before is answered
+# with its original result instead of being applied again, so a retried
+# upload is harmless. A failed operation is rolled back on its own and its
+# key isn't recorded, so it can be fixed and resent. Commits.
+def apply_sync_batch(conn, operations):
+    today = local_today().isoformat()
+    
+    def apply(conn):
+        results = []
+        applied = False
+        for operation in operations:
+            key = operation.get('key') if isinstance(operation, dict) else None
+            if not valid_idempotency_key(key):
+                results.append({"key": key, "status": "error", "error": "key must be a string of 1-200 characters"})
+                continue
+            
+            result = find_idempotency_key(conn, key)
+            if result is not None:
+                results.append({"key": key, "status": "duplicate", **result})
+                continue
+            
+            conn.execute('SAVEPOINT sync_operation')
+            try:
+                check_sync_fields(operation)
+                handler = SYNC_OPERATIONS.get(operation.get('op'))
+                if handler is None:
+                    raise ValueError(f"op must be one of {', '.join(SYNC_OPERATIONS)}")
+                result = dict(handler(conn, operation, today), op=operation['op'])
+            except (OverflowError, ValueError) as e:
+                conn.execute('ROLLBACK TO sync_operation')
+                conn.execute('RELEASE sync_operation')
+                results.append({"key": key, "status": "error", "error": str(e)})
+                continue
+            conn.execute('RELEASE sync_operation')
+            record_idempotency_key(conn, key, result)
+            results.append({"key": key, "status": "applied", **result})
+            applied = True
+        
+        prune_idempotency_keys(conn)
+        return results, applied
+    
+    return run_write_transaction(conn, apply)
+
+# Search functions. search_index is an FTS5 table holding one entry per
+# searchable description. An entry's rowid is its row's id * SEARCH_STRIDE
+# plus its source's tag, so the triggers find it without a lookup and
+# results map straight back to their rows.
+DEFAULT_CONFIG.update(
+    SEARCH_PAGE_SIZE=int(os.environ.get('HABIT_TRACKER_SEARCH_PAGE_SIZE', 20)),
+    SEARCH_MAX_PAGE_SIZE=100,
+)
+
+# entity -> (table, searched column, rowid tag). Tags run below SEARCH_STRIDE.
+SEARCH_STRIDE = 4
+SEARCH_SOURCES = {
+    'habit': ('habits', 'description', 1),
+    'bounty': ('bounties', 'description', 2),
+    'transaction': ('transactions', 'bounty_description', 3),
+}
+
+# entity -> columns returned alongside each match
+SEARCH_FIELDS = {
+    'habit': ('id', 'description', 'amount'),
+    'bounty': ('id', 'description', 'amount', 'date_created', 'completed'),
+    'transaction': ('id', 'bounty_description', 'amount', 'date', 'bounty_id'),
+}
+
+# Turn what the user typed into an FTS5 query: every word must match, as a
+# prefix, so 'med mor' finds 'Morning meditation'. Quoting each word keeps
+# FTS5 syntax characters in the input from being interpreted.
+def build_search_query(text):
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        raise ValueError('Give q some words to search for')
+    return ' '.join(f'"{word}"*' for word in words[:16])
+
+# Keyset cursors are the last result's 'rank,rowid'
+def parse_search_cursor(value):
+    if value is None:
+        return None
+    try:
+        rank, rowid = value.split(',')
+        return float(rank), int(rowid)
+    except ValueError:
+        raise ValueError('after must be a next_cursor from an earlier page')
+
+# One page of matches, best first by BM25 rank (ties by rowid), starting after
+# the `after` cursor. `entities` limits the results to some of SEARCH_SOURCES.
+# Returns (results, next_cursor); next_cursor is None on the last page.
+def search(conn, text, entities=None, after=None, limit=None):
+    limit = limit or current_app.config['SEARCH_PAGE_SIZE']
+    clauses, params = ['search_index MATCH ?'], [build_search_query(text)]
+    if entities:
+        tags = [SEARCH_SOURCES[entity][2] for entity in entities]
+        clauses.append(f"rowid % {SEARCH_STRIDE} IN ({', '.join('?' * len(tags))})")
+        params.extend(tags)
+    if after is not None:
+        clauses.append('(rank > ? OR (rank = ? AND rowid > ?))')
+        params.extend([after[0], after[0], after[1]])
+    matches = conn.execute(f'''
+        SELECT rowid, rank FROM search_index WHERE {' AND '.join(clauses)}
+        ORDER BY rank, rowid LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+    next_cursor = f"{matches[limit - 1]['rank']!r},{matches[limit - 1]['rowid']}" if len(matches) > limit else None
+    matches = matches[:limit]
+    
+    # Look the matched rows up with one query per entity
+    tags = {tag: entity for entity, (table, column, tag) in SEARCH_SOURCES.items()}
+    wanted = {}
+    for match in matches:
+        wanted.setdefault(tags[match['rowid'] % SEARCH_STRIDE], []).append(match['rowid'] // SEARCH_STRIDE)
+    rows = {}
+    for entity, ids in wanted.items():
+        table = SEARCH_SOURCES[entity][0]
+        for row in conn.execute(f"SELECT {', '.join(SEARCH_FIELDS[entity])} FROM {table} "
+                                f"WHERE id IN ({', '.join('?' * len(ids))})", ids):
+            rows[entity, row['id']] = dict(row)
+    
+    results = []
+    for match in matches:
+        entity = tags[match['rowid'] % SEARCH_STRIDE]
+        row = rows.get((entity, match['rowid'] // SEARCH_STRIDE))
+        if row is not None:
+            results.append({"entity": entity, **row})
+    return results, next_cursor
+
+# Maintenance scheduler. Each worker process runs a scheduler thread that
+# wakes every SCHEDULER_TICK seconds and runs whatever maintenance jobs are
+# due, off the request threads. The jobs' schedules and outcomes live in the
+# scheduled_jobs table (in ACCOUNTS_DB in multi-tenant mode), and a job is
+# claimed with a lease there before it runs, so only one of the workers runs
+# each job. A lease left behind by a worker that died mid-job expires after
+# SCHEDULER_LEASE_SECONDS. JOB_SCHEDULES overrides the default schedules,
+# e.g. 'analyze=0 2 * * *; rollups_backfill=off'.
+DEFAULT_CONFIG.update(
+    SCHEDULER=os.environ.get('HABIT_TRACKER_SCHEDULER', '1') != '0',
+    SCHEDULER_TICK=float(os.environ.get('HABIT_TRACKER_SCHEDULER_TICK', 30)),
+    SCHEDULER_LEASE_SECONDS=int(os.environ.get('HABIT_TRACKER_SCHEDULER_LEASE_SECONDS', 3600)),
+    JOB_SCHEDULES=os.environ.get('HABIT_TRACKER_JOB_SCHEDULES', ''),
+)
+
+SCHEDULED_JOBS_SQL = '''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    schedule TEXT NOT NULL,
+    next_run INTEGER,
+    lease_owner TEXT,
+    lease_expires INTEGER,
+    last_started REAL,
+    last_finished REAL,
+    last_duration_ms REAL,
+    last_status TEXT,
+    last_result TEXT,
+    runs INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0
+)'''
+
+# A five-field cron schedule (minute, hour, day of month, month, day of week)
+# with *, ranges, steps and lists, e.g. '*/15 * * * *' or '30 3 * * 1-5'.
+# As in cron, when both day fields are restricted a day matching either one
+# counts, and 0 and 7 are both Sunday.
+class CronSchedule:
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day of month', 1, 31), ('month', 1, 12),
+              ('day of week', 0, 7))
+    
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != len(self.FIELDS):
+            raise ValueError(f'{expression!r} is not a five-field cron schedule')
+        self.expression = ' '.join(parts)
+        fields = [self._parse(part, *field) for part, field in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months = (sorted(values) for values in fields[:4])
+        self.weekdays = {day % 7 for day in fields[4]}
+        self.either_day = parts[2] != '*' and parts[4] != '*'
+    
+    @staticmethod
+    def _parse(part, name, low, high):
+        values = set()
+        for item in part.split(','):
+            span, _, step = item.partition('/')
+            if span == '*':
+                first, last = low, high
+            elif '-' in span:
+                first, _, last = span.partition('-')
+            else:
+                first = last = span
+            try:
+                first, last, step = int(first), int(last), int(step or 1)
+            except ValueError:
+                raise ValueError(f'{item!r} is not a valid {name}')
+            if not low <= first <= last <= high or step < 1:
+                raise ValueError(f'{item!r} is out of range for the {name} ({low}-{high})')
+            values.update(range(first, last + 1, step))
+        return values
+    
+    def _matches_day(self, day):
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        return in_month or in_week if self.either_day else in_month and in_week
+    
+    # The first matching minute after `moment`, an aware datetime, in its zone
+    def next_after(self, moment):
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 8):  # Long enough to reach any 29 February
+            if self._matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=moment.tzinfo)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f'{self.expression!r} never matches a date')
+
+# Maintenance jobs. Each gets a connection to one database and returns a
+# short description of what it did.
+
+# Copy the WAL back into the database without waiting on readers or
+# writers, so the commit that crosses the autocheckpoint threshold inside
+# a request usually finds little left to do
+def checkpoint_wal(conn):
+    busy, frames, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    return f'checkpointed {checkpointed} of {frames} WAL frames'
+
+# Refresh the query planner's statistics. analysis_limit makes ANALYZE
+# sample each index instead of reading all of it.
+def analyze_database(conn):
+    conn.execute('PRAGMA analysis_limit = 1000')
+    conn.execute('ANALYZE')
     conn.commit()
-    conn.close()
+    return 'statistics refreshed'
+
+# Return free pages to the filesystem. The full VACUUM needed to switch an
+# older database to incremental vacuuming is left to compact-ledger.
+def vacuum_free_pages(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 'skipped: auto_vacuum is not incremental'
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.executescript('PRAGMA incremental_vacuum;')
+    return f'freed {free - conn.execute("PRAGMA freelist_count").fetchone()[0]} pages'
+
+# Rebuild the ledger summary if it has drifted from the transactions
+def repair_ledger_summary(conn):
+    drift = check_ledger_summary(conn)
+    if not drift:
+        return 'ledger summary is consistent'
+    run_write_transaction(conn, rebuild_ledger_summary)
+    return f'rebuilt the ledger summary after {len(drift)} entries drifted'
+
+# Recompute the rollups and streaks a habit at a time, each in its own
+# transaction, so a completion never waits for more than one habit's
+# rebuild. Completions logged between turns update the rollups as usual.
+def backfill_rollups(conn):
+    habits = {row['id'] for row in conn.execute('SELECT id FROM habits')}
+    habit_ids = [row[0] for row in conn.execute('''SELECT habit_id FROM daily_rollups
+                                                   UNION SELECT habit_id FROM transactions
+                                                   WHERE habit_id IS NOT NULL''')]
+    for habit_id in sorted(habits.union(habit_ids)):
+        def rebuild(conn):
+            rebuild_daily_rollups(conn, habit_id)
+            if habit_id in habits:
+                rebuild_streaks(conn, [habit_id])
+        run_write_transaction(conn, rebuild)
+    days = conn.execute('SELECT COUNT(*) FROM daily_rollups').fetchone()[0]
+    return f'rebuilt {days} daily rollup rows and the habit streaks'
+
+# name: (default schedule, job), with schedules in TIMEZONE
+MAINTENANCE_JOBS = {
+    'wal_checkpoint': ('*/15 * * * *', checkpoint_wal),
+    'analyze': ('30 3 * * *', analyze_database),
+    'incremental_vacuum': ('0 4 * * *', vacuum_free_pages),
+    'ledger_check': ('15 4 * * 0', repair_ledger_summary),
+    'rollups_backfill': ('45 4 1 * *', backfill_rollups),
+}
+
+# Each job's CronSchedule, or None if it's turned off, after applying
+# JOB_SCHEDULES. Raises ValueError for unknown jobs and bad schedules.
+def job_schedules(overrides):
+    expressions = {name: schedule for name, (schedule, job) in MAINTENANCE_JOBS.items()}
+    for item in filter(None, (item.strip() for item in overrides.split(';'))):
+        name, _, expression = item.partition('=')
+        name = name.strip()
+        if name not in MAINTENANCE_JOBS:
+            raise ValueError(f"Unknown maintenance job {name!r}; jobs are {', '.join(MAINTENANCE_JOBS)}")
+        expressions[name] = expression.strip()
+    return {name: None if expression == 'off' else CronSchedule(expression)
+            for name, expression in expressions.items()}
+
+def next_run_time(schedule, now):
+    if schedule is None:
+        return None
+    return int(schedule.next_after(datetime.fromtimestamp(now, timezone.utc).astimezone(get_timezone())).timestamp())
+
+# The database holding scheduled_jobs
+def open_jobs_db():
+    if current_app.config['MULTI_TENANT']:
+        return open_accounts_db()
+    ensure_db_initialized(current_app.config['DATABASE'])
+    return open_connection(current_app.config['DATABASE'])
+
+# Add any jobs the table doesn't have yet, and reschedule those whose
+# schedule changed
+def register_jobs(conn, schedules, now):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for name, schedule in schedules.items():
+            conn.execute('''INSERT INTO scheduled_jobs (name, schedule, next_run) VALUES (?, ?, ?)
+                            ON CONFLICT (name) DO UPDATE SET schedule = excluded.schedule, next_run = excluded.next_run
+                            WHERE schedule != excluded.schedule''',
+                         (name, schedule.expression if schedule else 'off', next_run_time(schedule, now)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Take the lease on a job that is due, or on `name` whether it is due or
+# not, unless another worker holds it. Returns the job's name, or None.
+def claim_job(conn, owner, lease_seconds, now, name=None):
+    due = 'name = ?' if name else 'next_run <= ?'
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(f'''UPDATE scheduled_jobs SET lease_owner = ?, lease_expires = ?, last_started = ?
+                               WHERE name = (SELECT name FROM scheduled_jobs
+                                             WHERE {due} AND (lease_expires IS NULL OR lease_expires <= ?)
+                                             ORDER BY next_run LIMIT 1)
+                               RETURNING name''',
+                           (owner, int(now) + lease_seconds, now, name or now, now)).fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row['name'] if row else None
+
+# Record how a run went, release the lease and schedule the next run
+def finish_job(conn, name, owner, schedule, started, status, result):
+    finished = time.time()
+    conn.execute('''UPDATE scheduled_jobs SET lease_owner = NULL, lease_expires = NULL, next_run = ?,
+                    last_finished = ?, last_duration_ms = ?, last_status = ?, last_result = ?,
+                    runs = runs + 1, failures = failures + ?
+                    WHERE name = ? AND lease_owner = ?''',
+                 (next_run_time(schedule, finished), finished, (finished - started) * 1000, status, result,
+                  status == 'error', name, owner))
+    conn.commit()
+
+# Run a job against the database, or in multi-tenant mode every account's
+# shard in turn. Returns (status, description); one failing shard doesn't
+# stop the rest.
+def run_job(name):
+    job = MAINTENANCE_JOBS[name][1]
+    if not current_app.config['MULTI_TENANT']:
+        conn = open_connection(current_app.config['DATABASE'])
+        try:
+            return 'ok', job(conn)
+        except Exception as e:
+            current_app.logger.exception('Maintenance job %s failed', name)
+            return 'error', f'{type(e).__name__}: {e}'
+        finally:
+            conn.close()
+    
+    app = current_app._get_current_object()
+    errors = []
+    shards = [shard_path(row['shard']) for row in list_accounts() if row['shard']]
+    shards = [path for path in shards if os.path.exists(path)]
+    for path in shards:
+        with app.app_context():
+            use_database(path)
+            try:
+                ensure_db_initialized(path)
+                conn = open_connection(path)
+                try:
+                    job(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                app.logger.exception('Maintenance job %s failed on %s', name, path)
+                errors.append(f'{os.path.basename(path)}: {type(e).__name__}: {e}')
+    summary = f'ran on {len(shards) - len(errors)} of {len(shards)} shards'
+    return ('error', '; '.join([summary] + errors[:5])) if errors else ('ok', summary)
+
+# Claim and run due jobs until none are left. `name` runs that job now,
+# whatever its schedule. Returns the (name, status, description) of each run.
+def run_due_jobs(conn, owner, schedules, name=None):
+    lease_seconds = current_app.config['SCHEDULER_LEASE_SECONDS']
+    runs = []
+    while True:
+        started = time.time()
+        # Most ticks find nothing due, and a read doesn't need the write lock
+        if name is None and conn.execute('''SELECT 1 FROM scheduled_jobs WHERE next_run <= ?
+                                            AND (lease_expires IS NULL OR lease_expires <= ?) LIMIT 1''',
+                                         (started, started)).fetchone() is None:
+            break
+        claimed = claim_job(conn, owner, lease_seconds, started, name)
+        if claimed is None:
+            break
+        status, result = run_job(claimed)
+        finish_job(conn, claimed, owner, schedules[claimed], started, status, result)
+        runs.append((claimed, status, result))
+        if name:
+            break
+    return runs
+
+# The scheduler thread. Under `flask serve` each worker starts its own on
+# its first request, and the job leases keep them from doubling up.
+class MaintenanceScheduler:
+    def __init__(self, app, schedules, tick):
+        self.app = app
+        self.schedules = schedules
+        self.tick = tick
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+        self._registered = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='habit-scheduler', daemon=True)
+        self._thread.start()
+    
+    # Waits for a job that is running to finish
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    conn = open_jobs_db()
+                    try:
+                        if not self._registered:
+                            register_jobs(conn, self.schedules, time.time())
+                            self._registered = True
+                        run_due_jobs(conn, self.owner, self.schedules)
+                    finally:
+                        conn.close()
+            except Exception:
+                # e.g. the jobs database stayed locked; try again next tick
+                self.app.logger.exception('Maintenance scheduler tick failed')
+            self._stop.wait(self.tick)
+
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    scheduler = current_app.extensions.get('habit_scheduler')
+    if scheduler is None:
+        with _scheduler_lock:
+            scheduler = current_app.extensions.get('habit_scheduler')
+            if scheduler is None:
+                scheduler = MaintenanceScheduler(current_app._get_current_object(),
+                                                 job_schedules(current_app.config['JOB_SCHEDULES']),
+                                                 current_app.config['SCHEDULER_TICK'])
+                current_app.extensions['habit_scheduler'] = scheduler
+    return scheduler
+
+@bp.before_app_request
+def start_scheduler():
+    if current_app.config['SCHEDULER']:
+        get_scheduler()
+
+# A scheduled_jobs row for /api/jobs, with times in ISO 8601 UTC
+def describe_job(row, now):
+    job = dict(row)
+    job['enabled'] = job['schedule'] != 'off'
+    job['running'] = job.pop('lease_expires') is not None and row['lease_expires'] > now
+    for key in ('next_run', 'last_started', 'last_finished'):
+        if job[key] is not None:
+            job[key] = datetime.fromtimestamp(job[key], timezone.utc).isoformat(timespec='seconds')
+    return job
+
+
+DEFAULT_CONFIG.update(
+    INDEX_CACHE=os.environ.get('HABIT_TRACKER_INDEX_CACHE', '1') != '0',
+)
+
+# Once the habit and bounty lists together run past INDEX_STREAM_ROWS, the
+# home page is streamed from cursors instead of rendered (and cached) whole,
+# in chunks of about INDEX_STREAM_CHUNK_KB
+DEFAULT_CONFIG.update(
+    INDEX_STREAM_ROWS=int(os.environ.get('HABIT_TRACKER_INDEX_STREAM_ROWS', 1000)),
+    INDEX_STREAM_CHUNK_KB=int(os.environ.get('HABIT_TRACKER_INDEX_STREAM_CHUNK_KB', 16)),
+    INDEX_STREAM_BATCH_SIZE=500,
+)
+
+ACTIVE_BOUNTIES_SQL = '''
+    SELECT id, description, amount, date_created
+    FROM bounties
+    WHERE completed = 0
+    ORDER BY id DESC
+'''
+
+# Marks where a streamed page sends what it has so far
+STREAM_FLUSH = Markup('<!-- flush -->')
+
+GZIP_ETAG_SUFFIX = '-gzip'
+
+# Stands in for the flash messages in the cached page
+FLASH_PLACEHOLDER = Markup('<!-- flash-messages -->')
+
+# Guards each app's cached index page, kept in
+# database_extensions()['habit_index_cache'] as [cache key, html]
+_index_cache_lock = threading.Lock()
+
+# Cache key and strong ETag for the index page. The date is part of it because
+# streaks that weren't extended yesterday lapse at midnight.
+def index_cache_key():
+    version = data_version(get_db_connection())
+    if current_app.config['MULTI_TENANT']:
+        shard = os.path.basename(current_database())
+        return f'{_data_epoch}-{shard}-{version}-{local_today().isoformat()}'
+    return f'{_data_epoch}-{version}-{local_today().isoformat()}'
+
+def render_flash_messages():
+    return Markup('').join(
+        Markup('<div class="messages {}">\n    {}\n</div>\n').format(category, message)
+        for category, message in get_flashed_messages(with_categories=True))
+
+def render_index_page():
+    conn = get_db_connection()
+    habits = get_habits_with_streaks(conn)
+    
+    # Read the running balance from the ledger summary
+    balance = get_balance(conn)
+    
+    # Get recent transactions with proper bounty descriptions
+    transactions, next_cursor = get_transaction_page(conn, [], [], limit=10)
+    
+    # Get active bounties
+    bounties = conn.execute(ACTIVE_BOUNTIES_SQL).fetchall()
+    
+    return render_template('index.html', habits=habits, balance=balance, 
+                           transactions=transactions, next_cursor=next_cursor,
+                           bounties=bounties, flash_messages=FLASH_PLACEHOLDER)
+
+# Whether the habit and bounty lists together run past INDEX_STREAM_ROWS
+def index_page_is_large(conn):
+    rows = conn.execute('''SELECT (SELECT COUNT(*) FROM habits)
+                                 + (SELECT COUNT(*) FROM bounties WHERE completed = 0)''').fetchone()[0]
+    return rows > current_app.config['INDEX_STREAM_ROWS']
+
+# Rows from a query that only runs once the template reaches it, fetched a
+# batch at a time
+def iter_query(conn, sql, params=()):
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(current_app.config['INDEX_STREAM_BATCH_SIZE'])
+        if not rows:
+            break
+        yield from rows
+
+# Regroup a template's many small output strings into chunks of about
+# `size` characters, cutting one short at each STREAM_FLUSH
+def chunk_stream(parts, size):
+    buffer, buffered = [], 0
+    for part in parts:
+        if part == STREAM_FLUSH:
+            if buffer:
+                yield ''.join(buffer)
+                buffer, buffered = [], 0
+            continue
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+# The page streamed as it renders: the header and balance go out at once,
+# then the habit and bounty lists in chunks as they're read, so neither the
+# rows nor the page are ever held in memory whole. The request keeps its
+# pooled connection until the stream ends.
+def stream_index_page():
+    conn = get_db_connection()
+    transactions, next_cursor = get_transaction_page(conn, [], [], limit=10)
+    parts = stream_template('index.html', habits=iter_query(conn, *habits_with_streaks_query()),
+                            balance=get_balance(conn), transactions=transactions, next_cursor=next_cursor,
+                            bounties=iter_query(conn, ACTIVE_BOUNTIES_SQL),
+                            flash_messages=render_flash_messages(), stream_flush=STREAM_FLUSH)
+    chunks = chunk_stream(parts, current_app.config['INDEX_STREAM_CHUNK_KB'] * 1024)
+    if not request.accept_encodings['gzip']:
+        return Response(chunks, mimetype='text/html')
+    response = Response(gzip_stream(chunks, current_app.config['COMPRESS_LEVEL']), mimetype='text/html')
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@bp.route('/')
+def index():
+    if not current_app.config['INDEX_CACHE']:
+        if index_page_is_large(get_db_connection()):
+            return stream_index_page()
+        return render_index_page().replace(FLASH_PLACEHOLDER, render_flash_messages())
+    
+    # Read the key before rendering, so a write that lands mid-render leaves
+    # the cached copy already stale rather than mislabelled
+    key = index_cache_key()
+    has_flashes = bool(session.get('_flashes'))
+    
+    # The browser's copy (plain or gzipped) is current and there's nothing new to show
+    if not has_flashes:
+        for etag in (key, f'{key}{GZIP_ETAG_SUFFIX}'):
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+    
+    cache = database_extensions()['habit_index_cache']
+    with _index_cache_lock:
+        cached_key, html = cache
+    if cached_key == key:
+        response = make_response(html.replace(FLASH_PLACEHOLDER, render_flash_messages()))
+    elif index_page_is_large(get_db_connection()):
+        # Too big to keep a copy of; the ETag still saves resending it
+        response = stream_index_page()
+    else:
+        html = render_index_page()
+        with _index_cache_lock:
+            cache[:] = [key, html]
+        response = make_response(html.replace(FLASH_PLACEHOLDER, render_flash_messages()))
+    
+    if has_flashes:
+        # Flash messages are one-off, so this copy must not be revalidated
+        response.headers['Cache-Control'] = 'no-store'
+    else:
+        # Streamed pages are gzipped here rather than by compress_response()
+        gzipped = response.headers.get('Content-Encoding') == 'gzip'
+        response.set_etag(f'{key}{GZIP_ETAG_SUFFIX}' if gzipped else key)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# The write routes take a form post and answer with a flash message and a
+# redirect, or take and answer JSON when the client asks for it (as the
+# page's fetch-based forms do)
+def wants_json():
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+def request_values():
+    if request.is_json:
+        values = request.get_json(silent=True)
+        return values if isinstance(values, dict) else {}
+    return request.form
+
+def write_response(message, category='success', status=200, **data):
+    if wants_json():
+        if category == 'error':
+            return jsonify({"status": "error", "error": message}), status
+        return jsonify({"status": category, "message": message, **data}), status
+    flash(message, category)
+    return redirect(url_for('.index'))
+
+@bp.route('/add_habit', methods=['POST'])
+def add_habit():
+    values = request_values()
+    description = values.get('description')
+    
+    try:
+        amount = parse_amount(values.get('amount'))
+    except (TypeError, ValueError):
+        return write_response('Please enter a valid amount', 'error', 400)
+    
+    conn = get_db_connection()
+    cursor = conn.execute('INSERT INTO habits (description, amount) VALUES (?, ?)', 
+                          (description, amount))
+    commit_changes(conn)
+    
+    habit = {"id": cursor.lastrowid, "description": description, "amount": amount}
+    publish_events(conn, habit=habit)
+    return write_response('Habit added successfully!', habit=habit)
+
+# Log a completion. Like bounty completion, it takes an optional
+# Idempotency-Key header (or `key` field); a repeat with the same key gets
+# the first request's response. In write-behind mode every completion gets
+# a key, so when its group takes longer than WRITE_ACK_TIMEOUT to commit,
+# the answer is a 202 carrying the key to retry with.
+@bp.route('/add_transaction', methods=['POST'])
+def add_transaction():
+    values = request_values()
+    key = request.headers.get('Idempotency-Key') or values.get('key')
+    if key is not None and not valid_idempotency_key(key):
+        return write_response('Idempotency keys are strings of 1-200 characters', 'error', 400)
+    try:
+        habit_id = int(values.get('habit_id'))
+        amount = parse_amount(values.get('amount'))
+        quantity = int(values.get('quantity', 1))
+        check_completion(habit_id, amount, quantity)
+    except (TypeError, ValueError):
+        return write_response('Please enter valid values', 'error', 400)
+    
+    today = local_today().isoformat()
+    row = (habit_id, amount, quantity, today, None, None)
+    
+    def add(conn):
+        result = find_idempotency_key(conn, key)
+        if result is not None:
+            return result, True
+        result = {"op": "add_transaction", "id": record_transaction(conn, *row)}
+        record_idempotency_key(conn, key, result)
+        prune_idempotency_keys(conn)
+        return result, False
+    
+    conn = get_db_connection()
+    result = find_idempotency_key(conn, key) if key is not None else None
+    if result is not None:
+        replayed = True
+    elif current_app.config['WRITE_BEHIND']:
+        key = key or secrets.token_urlsafe(16)
+        future = get_group_commit_writer().submit(row, key)
+        # Wait for the writer thread to commit this row along with its group,
+        # without holding a pooled connection meanwhile
+        release_db_connection()
+        try:
+            result, replayed = future.result(current_app.config['WRITE_ACK_TIMEOUT'])
+        except concurrent.futures.TimeoutError:
+            return write_response('Still saving the transaction. Retry with the same idempotency key '
+                                  'to find out whether it was added.', 'pending', 202, key=key)
+        conn = get_db_connection()
+    elif key is not None:
+        result, replayed = run_write_transaction(conn, add)
+    else:
+        result = {"op": "add_transaction", "id": record_transaction(conn, *row)}
+        replayed = False
+        commit_changes(conn)
+    if replayed and result.get('op') != 'add_transaction':
+        return write_response('That idempotency key was already used for another request', 'error', 422)
+    
+    if not replayed:
+        publish_events(conn, transaction_ids=[result['id']])
+    return write_response(f'Transaction added successfully! ({quantity}x)', transaction_id=result['id'],
+                          replayed=replayed)
+
+# Paginated history, e.g. /api/transactions?before=1234&limit=50&habit_id=3
+# Pass the returned next_cursor as `before` to get the following page.
+@bp.route('/api/transactions')
+def transaction_history():
+    try:
+        clauses, params = parse_history_filters(request.args)
+        before = parse_int_arg(request.args.get('before'), 'before')
+        limit = parse_int_arg(request.args.get('limit'), 'limit', current_app.config['HISTORY_PAGE_SIZE'])
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    limit = max(1, min(limit, current_app.config['HISTORY_MAX_PAGE_SIZE']))
+    
+    rows, next_cursor = get_transaction_page(get_db_connection(), clauses, params, before, limit,
+                                             include_archive=wants_archive(request.args))
+    return jsonify({
+        "transactions": [{field: row[field] for field in TRANSACTION_HISTORY_FIELDS} for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+@bp.route('/api/streaks')
+def streaks():
+    return jsonify({"streaks": [dict(row) for row in get_habits_with_streaks(get_db_connection())]})
+
+@bp.route('/api/analytics')
+def analytics_api():
+    try:
+        analytics = get_analytics(get_db_connection())
+    except ImportError:
+        return jsonify({"status": "error", "error": "Analytics need numpy: pip install numpy"}), 501
+    return jsonify(analytics or {"total_earned": 0, "completions": 0})
+
+@bp.route('/analytics')
+def analytics_page():
+    try:
+        analytics = get_analytics(get_db_connection())
+    except ImportError:
+        return "Analytics need numpy: pip install numpy", 501
+    return render_template('analytics.html', analytics=analytics)
+
+# Earnings and completions per day from the rollups, e.g.
+# /api/stats/daily?habit_id=3&start=2024-01-01&end=2024-03-31
+@bp.route('/api/stats/daily')
+def daily_stats():
+    try:
+        start = parse_date_arg(request.args.get('start'), 'start')
+        end = parse_date_arg(request.args.get('end'), 'end')
+        habit_id = parse_int_arg(request.args.get('habit_id'), 'habit_id')
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    
+    days = [dict(row) for row in get_daily_stats(get_db_connection(), habit_id, start, end)]
+    best_day = max(days, key=lambda d: d['earned'], default=None)
+    return jsonify({
+        "days": days,
+        "total_earned": sum(d['earned'] for d in days),
+        "completions": sum(d['count'] for d in days),
+        "best_day": best_day['day'] if best_day else None,
+    })
+
+# Delta sync for offline clients.
+#   GET /api/sync?since=<cursor>&limit=N returns the rows changed after the
+#   cursor (and tombstones for deleted ones) plus the next cursor; repeat
+#   while has_more. Start from since=0.
+#   POST /api/sync with {"operations": [{"key": ..., "op": ..., ...}]}
+#   applies a batch of offline writes, once per key.
+@bp.route('/api/sync', methods=['GET', 'POST'])
+def sync():
+    conn = get_db_connection()
+    if request.method == 'GET':
+        since = request.args.get('since', 0, type=int)
+        limit = request.args.get('limit', current_app.config['SYNC_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['SYNC_PAGE_SIZE']))
+        changes, cursor, has_more, balance = get_changes(conn, max(since, 0), limit)
+        return jsonify({"changes": changes, "cursor": cursor, "has_more": has_more, "balance": balance})
+    
+    body = request.get_json(silent=True)
+    operations = body.get('operations') if isinstance(body, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({"status": "error", "error": 'Send JSON like {"operations": [...]}'}), 400
+    if len(operations) > current_app.config['SYNC_MAX_BATCH']:
+        return jsonify({"status": "error",
+                        "error": f"At most {current_app.config['SYNC_MAX_BATCH']} operations per batch"}), 413
+    
+    results, applied = apply_sync_batch(conn, operations)
+    if applied:
+        publish_events(conn, refresh=True)
+    return jsonify({"status": "success", "results": results})
+
+# Full-text search over habits, bounties and bounty payouts, e.g.
+# /api/search?q=clean+gar&type=bounty&limit=20
+# Pass the returned next_cursor as `after` to get the following page.
+@bp.route('/api/search')
+def search_api():
+    entities = [entity for entity in request.args.get('type', '').split(',') if entity]
+    unknown = [entity for entity in entities if entity not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({"status": "error",
+                        "error": f"type must be one of {', '.join(SEARCH_SOURCES)}, not {unknown[0]}"}), 400
+    limit = request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_PAGE_SIZE']))
+    try:
+        results, next_cursor = search(get_db_connection(), request.args.get('q'), entities,
+                                      parse_search_cursor(request.args.get('after')), limit)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    return jsonify({"results": results, "next_cursor": next_cursor})
+
+# Bulk import of completions, e.g. backfills from wearables or other trackers.
+# Accepts a JSON array, NDJSON or CSV (with habit_id, quantity, amount and
+# date columns; all but habit_id are optional) and reports per-row errors.
+@bp.route('/api/transactions/bulk', methods=['POST'])
+def bulk_add_transactions():
+    fmt = request.args.get('format') or detect_bulk_format(request.content_type)
+    if fmt not in BULK_FORMATS:
+        return jsonify({"status": "error",
+                        "error": "Send JSON, NDJSON or CSV (or pass ?format=json|ndjson|csv)"}), 415
+    
+    conn = get_db_connection()
+    inserted, failed, errors = ingest_transactions(conn, iter_bulk_records(request.stream, fmt))
+    if inserted:
+        publish_events(conn, refresh=True)
+    
+    return jsonify({"status": "success" if not failed else "partial",
+                    "inserted": inserted, "failed": failed, "errors": errors})
+
+# Streamed export of the full history, optionally limited with
+# ?start=YYYY-MM-DD&end=YYYY-MM-DD, ?habit_id=N or ?bounties=1. Memory use stays flat however big the
+# ledger is, since rows are fetched and written out a batch at a time.
+@bp.route('/export/transactions.<fmt>')
+def export_transactions(fmt):
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "error": "Export format must be csv or ndjson"}), 404
+    
+    try:
+        clauses, params = parse_history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    
+    writer, mimetype = EXPORT_FORMATS[fmt]
+    batches = iter_transaction_history(get_db_connection(), clauses, params,
+                                       include_archive=wants_archive(request.args))
+    
+    return Response(stream_with_context(writer(batches)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=transactions.{fmt}',
+    })
+
+@bp.route('/add_bounty', methods=['POST'])
+def add_bounty():
+    values = request_values()
+    description = values.get('description')
+    
+    try:
+        amount = parse_amount(values.get('amount'))
+    except (TypeError, ValueError):
+        return write_response('Please enter a valid amount', 'error', 400)
+    
+    conn = get_db_connection()
+    date_created = local_today().isoformat()
+    cursor = conn.execute('''
+        INSERT INTO bounties (description, amount, date_created, created_at, completed)
+        VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER), 0)
+    ''', (description, amount, date_created))
+    commit_changes(conn)
+    
+    bounty = {"id": cursor.lastrowid, "description": description, "amount": amount,
+              "date_created": date_created, "completed": 0}
+    publish_events(conn, bounty=bounty)
+    return write_response('Bounty added successfully!', bounty=bounty)
+
+# Pays out at most once. A repeat (a double click, or a retry after a lost
+# response) gets a 409, unless it carries the same Idempotency-Key header
+# (or `key` field) as the first, in which case it gets the first's response.
+@bp.route('/complete_bounty/<int:bounty_id>', methods=['POST'])
+def complete_bounty(bounty_id):
+    key = request.headers.get('Idempotency-Key') or request_values().get('key')
+    if key is not None and not valid_idempotency_key(key):
+        return write_response('Idempotency keys are strings of 1-200 characters', 'error', 400)
+    today = local_today().isoformat()
+    
+    # Returns (result, whether it's a stored one), or (None, False) if nothing was paid
+    def complete(conn):
+        if key is not None:
+            result = find_idempotency_key(conn, key)
+            if result is not None:
+                return result, True
+        paid = pay_bounty(conn, bounty_id, today)
+        if paid is None:
+            return None, False
+        bounty, transaction_id = paid
+        result = {"op": "complete_bounty", "id": bounty['id'], "amount": bounty['amount'],
+                  "transaction_id": transaction_id}
+        if key is not None:
+            record_idempotency_key(conn, key, result)
+            prune_idempotency_keys(conn)
+        return result, False
+    
+    # Repeats are answered from a plain read where possible, leaving the
+    # write lock to requests that might still pay out
+    conn = get_db_connection()
+    result = find_idempotency_key(conn, key) if key is not None else None
+    if result is not None:
+        replayed = True
+    elif conn.execute('SELECT 1 FROM bounties WHERE id = ? AND completed = 0', (bounty_id,)).fetchone():
+        result, replayed = run_write_transaction(conn, complete)
+    if result is None:
+        if bounty_exists(conn, bounty_id):
+            return write_response('Bounty was already completed', 'error', 409)
+        return write_response('Bounty not found', 'error', 404)
+    if replayed and (result.get('op') != 'complete_bounty' or result.get('id') != bounty_id):
+        return write_response('That idempotency key was already used for another request', 'error', 422)
+    
+    if not replayed:
+        publish_events(conn, transaction_ids=[result['transaction_id']], bounty={"id": bounty_id, "completed": 1})
+    return write_response(f"Bounty completed: ${result['amount']:.2f} added to balance!",
+                          transaction_id=result['transaction_id'], replayed=replayed)
+
+# Sign in, for multi-tenant mode. The signed session cookie records the
+# account's shard, which is all later requests need.
+def sign_in(username, shard):
+    session.clear()  # Start a fresh session rather than carry over one from before sign-in
+    session['user'] = username
+    session['shard'] = shard
+
+# Like write_response(), except a failed form sign-in stays on the sign-in page
+def account_response(message, category='success', status=200):
+    if category == 'success' or wants_json():
+        return write_response(message, category, status, user=session.get('user'))
+    flash(message, category)
+    return render_template('login.html'), status
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if not current_app.config['MULTI_TENANT']:
+        return redirect(url_for('.index'))
+    if request.method == 'GET':
+        return render_template('login.html')
+    
+    values = request_values()
+    conn = open_accounts_db()
+    try:
+        shard = authenticate(conn, values.get('username'), values.get('password'))
+    finally:
+        conn.close()
+    if shard is None:
+        return account_response('Wrong username or password', 'error', 401)
+    sign_in(values.get('username'), shard)
+    return account_response(f"Signed in as {values.get('username')}")
+
+@bp.route('/register', methods=['POST'])
+def register():
+    if not current_app.config['MULTI_TENANT']:
+        return redirect(url_for('.index'))
+    values = request_values()
+    conn = open_accounts_db()
+    try:
+        shard = create_account(conn, values.get('username'), values.get('password'))
+    except ValueError as e:
+        return account_response(str(e), 'error', 400)
+    finally:
+        conn.close()
+    sign_in(values.get('username'), shard)
+    return account_response(f"Welcome, {values.get('username')}!")
+
+@bp.route('/logout', methods=['POST'])
+def logout():
+    session.pop('user', None)
+    session.pop('shard', None)
+    if wants_json():
+        return jsonify({"status": "success"})
+    return redirect(url_for('.login' if current_app.config['MULTI_TENANT'] else '.index'))
+
+@bp.route('/toggle_theme', methods=['POST'])
+def toggle_theme():
+    # This endpoint is called by AJAX to store the theme preference
+    # It doesn't actually do anything server-side, just responds
+    return jsonify({"status": "success"})
+
+# Server-Sent Events stream of live updates: 'balance', 'transaction',
+# 'habit' and 'bounty' events as writes happen, and 'refresh' when another
+# worker process wrote. Each open stream holds a server thread.
+@bp.route('/events')
+def events():
+    broadcaster = get_event_broadcaster()
+    subscription = broadcaster.subscribe()
+    balance = get_balance(get_db_connection())
+    release_db_connection()  # Don't hold a pooled connection for the whole stream
+    keepalive = current_app.config['EVENTS_KEEPALIVE']
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n' + format_event('balance', {"balance": balance})
+            while not subscription.dropped:
+                try:
+                    yield subscription.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            broadcaster.unsubscribe(subscription)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',  # Stop nginx buffering the stream
+    })
+
+# Readiness probe for load balancers and process managers: the database is
+# reachable and fully migrated, and the page template has been built
+@bp.route('/readyz')
+def readyz():
+    problems = []
+    try:
+        if current_app.config['MULTI_TENANT']:
+            # Shards are migrated as they're opened; the accounts are what every request needs
+            conn = open_accounts_db()
+            conn.close()
+        else:
+            version = get_schema_version(get_db_connection())
+            if version < len(MIGRATIONS):
+                problems.append(f'schema is at version {version} of {len(MIGRATIONS)}')
+    except sqlite3.Error as e:
+        problems.append(f'database unavailable: {e}')
+    
+    if not os.path.exists(os.path.join(current_app.root_path, current_app.template_folder, 'index.html')):
+        problems.append('templates have not been built')
+    
+    if problems:
+        return jsonify({"status": "unavailable", "problems": problems}), 503
+    return jsonify({"status": "ready", "pid": os.getpid()})
+
+# Prometheus text-format metrics for this process
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# The maintenance jobs' schedules and how their last runs went, shared by
+# every worker process
+@bp.route('/api/jobs')
+def jobs_api():
+    if current_app.config['MULTI_TENANT']:
+        conn = open_accounts_db()
+        try:
+            rows = conn.execute('SELECT * FROM scheduled_jobs ORDER BY name').fetchall()
+        finally:
+            conn.close()
+    else:
+        rows = get_db_connection().execute('SELECT * FROM scheduled_jobs ORDER BY name').fetchall()
+    now = time.time()
+    return jsonify({"scheduler": current_app.config['SCHEDULER'],
+                    "jobs": [describe_job(row, now) for row in rows]})
+
+# Production server settings, overridable through the environment
+DEFAULT_CONFIG.update(
+    SERVER_BIND=os.environ.get('HABIT_TRACKER_BIND', '127.0.0.1:8000'),
+    SERVER_WORKERS=int(os.environ.get('HABIT_TRACKER_WORKERS', (os.cpu_count() or 1) * 2 + 1)),
+    SERVER_THREADS=int(os.environ.get('HABIT_TRACKER_THREADS', 4)),
+    SERVER_TIMEOUT=int(os.environ.get('HABIT_TRACKER_TIMEOUT', 30)),
+)
+
+
+# A fresh copy of this module, read from disk, with an app created from it
+# the way `flask --app` does. Each `serve` worker runs one, so after a
+# SIGHUP the new workers run the code as it is on disk now.
+def load_app_from_disk():
+    spec = importlib.util.spec_from_file_location(__name__, __file__)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[__name__] = module  # Flask finds the app's root path through it
+    spec.loader.exec_module(module)
+    return module, module.create_app()
+
+# Write the templates and bring the schema up to date with the code on disk
+def prepare_app_from_disk():
+    module, app = load_app_from_disk()
+    with app.app_context():
+        if not app.config['MULTI_TENANT']:
+            module.ensure_db_initialized(app.config['DATABASE'])
+        module.build()
+
+# Run the app under gunicorn's prefork server, e.g.
+#   flask --app habit-app serve --workers 4 --threads 8 --bind 0.0.0.0:8000
+# Send the master process SIGHUP to gracefully replace the workers with ones
+# running the code now on disk.
+@bp.cli.command('serve', help='Run under gunicorn with multiple worker processes.')
+@click.option('--bind', default=None, help='Address to listen on (host:port).')
+@click.option('--workers', type=int, default=None, help='Number of worker processes.')
+@click.option('--threads', type=int, default=None, help='Threads per worker process.')
+@click.option('--timeout', type=int, default=None, help='Seconds before a stuck worker is restarted.')
+@click.option('--pid', 'pidfile', default=None, help='Write the master process id to this file.')
+def serve_command(bind, workers, threads, timeout, pidfile):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise click.ClickException('The production server needs gunicorn: pip install gunicorn')
+    
+    # The app isn't preloaded: the master only writes the templates and
+    # migrates, at start-up and again on each SIGHUP, and every worker loads
+    # the code itself after the fork. So a reload picks up code changes, and
+    # no SQLite handle or thread is ever shared across a fork.
+    options = {
+        'bind': bind or current_app.config['SERVER_BIND'],
+        'workers': workers or current_app.config['SERVER_WORKERS'],
+        'threads': threads or current_app.config['SERVER_THREADS'],
+        'worker_class': 'gthread',
+        'timeout': timeout or current_app.config['SERVER_TIMEOUT'],
+        'graceful_timeout': timeout or current_app.config['SERVER_TIMEOUT'],
+        'preload_app': False,
+        'on_starting': lambda server: prepare_app_from_disk(),
+        'on_reload': lambda server: prepare_app_from_disk(),
+        'pidfile': pidfile,
+    }
+    
+    class HabitTrackerServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+        
+        def load(self):
+            module, app = load_app_from_disk()
+            return app
+    
+    HabitTrackerServer().run()
+
+# The maintenance commands below work on DATABASE, or in multi-tenant mode
+# on every shard in turn, or just the shards of the accounts named with --user
+user_option = click.option('--user', 'usernames', multiple=True,
+                           help='In multi-tenant mode, only this account\'s shard (repeatable).')
+
+# (label, path) of each database a maintenance command should work on; the
+# label is None in single-user mode
+def command_databases(usernames=()):
+    if not current_app.config['MULTI_TENANT']:
+        if usernames:
+            raise click.UsageError('--user only applies with HABIT_TRACKER_MULTI_TENANT=1.')
+        return [(None, current_app.config['DATABASE'])]
+    
+    accounts = list_accounts(usernames)
+    unknown = {username.lower() for username in usernames} - {row['username'].lower() for row in accounts}
+    if unknown:
+        raise click.ClickException(f"No such account: {', '.join(sorted(unknown))}.")
+    databases = [(f"{row['username']} ({row['shard']})", shard_path(row['shard']))
+                 for row in accounts if row['shard']]
+    databases = [(label, path) for label, path in databases if os.path.exists(path)]
+    if not databases:
+        raise click.ClickException('There are no shards to work on.')
+    return databases
+
+# Yield (label, connection) for each of command_databases(), with a fresh app
+# context pointed at that database around each
+def each_database(usernames=()):
+    app = current_app._get_current_object()
+    for label, path in command_databases(usernames):
+        with app.app_context():
+            use_database(path)
+            ensure_db_initialized(path)
+            conn = open_connection(path)
+            try:
+                yield label, conn
+            finally:
+                conn.close()
+
+def echo_for(label, message, err=False):
+    click.echo(f'{label}: {message}' if label else message, err=err)
+
+# Check the ledger summary against the raw transactions, e.g.
+#   flask --app habit-app ledger-check --rebuild
+#   flask --app habit-app ledger-check --user alice
+@bp.cli.command('ledger-check', help='Check the ledger summary against the raw transactions.')
+@click.option('--rebuild', is_flag=True, help='Recompute the summary from scratch after checking.')
+@user_option
+def ledger_check_command(rebuild, usernames):
+    drifted = False
+    for label, conn in each_database(usernames):
+        drift = check_ledger_summary(conn)
+        
+        if drift:
+            drifted = True
+            for scope, key, stored, expected in drift:
+                echo_for(label, f'{scope} {key}: stored {stored:.2f}, ledger {expected:.2f} '
+                                f'(drift {stored - expected:+.2f})')
+            echo_for(label, f'{len(drift)} ledger summary entries drifted.')
+        else:
+            echo_for(label, 'Ledger summary is consistent.')
+        
+        if rebuild:
+            rebuild_ledger_summary(conn)
+            commit_changes(conn)
+            echo_for(label, 'Ledger summary rebuilt.')
+    
+    if drifted and not rebuild:
+        raise SystemExit(1)
+
+# Recompute the daily rollups (and the streaks derived from them) from the
+# raw transactions, e.g.
+#   flask --app habit-app rollups-backfill
+@bp.cli.command('rollups-backfill', help='Rebuild the daily rollups and streaks from the raw transactions.')
+@user_option
+def rollups_backfill_command(usernames):
+    for label, conn in each_database(usernames):
+        rebuild_daily_rollups(conn)
+        rebuild_streaks(conn)
+        commit_changes(conn)
+        days = conn.execute('SELECT COUNT(*) FROM daily_rollups').fetchone()[0]
+        echo_for(label, f'Rebuilt {days} daily rollup rows and the habit streaks.')
+
+# Fold old transactions into monthly totals, e.g.
+#   flask --app habit-app compact-ledger --horizon-days 365 --archive archive.db
+@bp.cli.command('compact-ledger', help='Fold transactions older than the horizon into monthly totals.')
+@click.option('--horizon-days', type=int, default=None,
+              help='Keep raw transactions from the month this many days ago onwards.')
+@click.option('--archive', 'archive_path', default=None,
+              help='Database to move the raw rows to (default HABIT_TRACKER_ARCHIVE_DB).')
+@user_option
+def compact_ledger_command(horizon_days, archive_path, usernames):
+    for label, conn in each_database(usernames):
+        database = current_database()
+        archive = archive_database(archive_path)
+        size_before = os.path.getsize(database)
+        compacted, horizon = compact_ledger(conn, horizon_days, archive)
+        size_after = os.path.getsize(database)
+        
+        destination = f'moved to {archive}' if archive else 'discarded'
+        echo_for(label, f'Compacted {compacted} transactions before {horizon} (raw rows {destination}).')
+        echo_for(label, f'Database file: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB.')
+
+# Import completions from a file, e.g.
+#   flask --app habit-app import-transactions history.csv
+#   flask --app habit-app import-transactions --user alice history.csv
+@bp.cli.command('import-transactions', help='Import completions from a JSON, NDJSON or CSV file.')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(BULK_FORMATS),
+              help='File format; guessed from the extension by default.')
+@click.option('--chunk-size', type=int, default=None, help='Rows per committed transaction.')
+@click.option('--user', 'username', default=None,
+              help='In multi-tenant mode, the account to import into (required).')
+def import_transactions_command(path, fmt, chunk_size, username):
+    fmt = fmt or detect_bulk_format(filename=path)
+    if fmt is None:
+        raise click.UsageError('Could not guess the file format, pass --format.')
+    if current_app.config['MULTI_TENANT'] and username is None:
+        raise click.UsageError('Pass --user to say whose shard to import into.')
+    
+    for label, conn in each_database((username,) if username else ()):
+        with open(path, 'rb') as f:
+            inserted, failed, errors = ingest_transactions(conn, iter_bulk_records(f, fmt), chunk_size)
+        
+        for error in errors:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+        echo_for(label, f'Imported {inserted} transactions, {failed} rows failed.')
+
+# Shard administration for multi-tenant mode. Each command works on many
+# shards at once over a thread pool (SQLite releases the GIL while it works),
+# e.g.
+#   flask --app habit-app shards create alice bob
+#   flask --app habit-app shards migrate --workers 16
+#   flask --app habit-app shards list
+@bp.cli.group('shards', help='Create, migrate and list the per-account database shards.')
+def shards_group():
+    pass
+
+workers_option = click.option('--workers', type=int, default=os.cpu_count() or 4,
+                              help='Shards to work on at once.')
+
+# fn(item) for every item across `workers` threads, each in an app context of
+# its own. Yields (item, result) in the items' order; result is the exception
+# if fn raised one.
+def run_in_parallel(items, fn, workers):
+    app = current_app._get_current_object()
+    
+    def run(item):
+        with app.app_context():
+            try:
+                return fn(item)
+            except Exception as e:
+                return e
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        yield from zip(items, executor.map(run, items))
+
+# Accounts as (username, shard) rows, all of them or just `usernames`
+def list_accounts(usernames=()):
+    conn = open_accounts_db()
+    try:
+        rows = conn.execute('SELECT username, shard FROM users ORDER BY id').fetchall()
+    finally:
+        conn.close()
+    wanted = {username.lower() for username in usernames}
+    return [row for row in rows if not wanted or row['username'].lower() in wanted]
+
+@shards_group.command('create', help='Create accounts, each with a new shard, and print their passwords.')
+@click.argument('usernames', nargs=-1, required=True)
+@workers_option
+def create_shards_command(usernames, workers):
+    def create(username):
+        password = secrets.token_urlsafe(12)
+        conn = open_accounts_db()
+        try:
+            return create_account(conn, username, password), password
+        finally:
+            conn.close()
+    
+    failed = 0
+    for username, result in run_in_parallel(list(usernames), create, workers):
+        if isinstance(result, Exception):
+            failed += 1
+            click.echo(f'{username}: {result}', err=True)
+        else:
+            shard, password = result
+            click.echo(f'{username}\t{shard}\t{password}')
+    if failed:
+        raise click.ClickException(f'{failed} of {len(usernames)} accounts could not be created.')
+
+@shards_group.command('migrate', help='Bring every shard (or the named accounts\' shards) up to the latest schema.')
+@click.argument('usernames', nargs=-1)
+@workers_option
+def migrate_shards_command(usernames, workers):
+    def migrate(row):
+        path = shard_path(row['shard'])
+        conn = open_connection(path)
+        try:
+            version = get_schema_version(conn)
+        finally:
+            conn.close()
+        init_db(path)
+        return version
+    
+    accounts = list_accounts(usernames)
+    failed = 0
+    for row, result in run_in_parallel(accounts, migrate, workers):
+        if isinstance(result, Exception):
+            failed += 1
+            click.echo(f"{row['username']} ({row['shard']}): {result}", err=True)
+        elif result < len(MIGRATIONS):
+            click.echo(f"{row['username']} ({row['shard']}): migrated from version {result} to {len(MIGRATIONS)}")
+    click.echo(f'{len(accounts) - failed} of {len(accounts)} shards are at version {len(MIGRATIONS)}.')
+    if failed:
+        raise click.ClickException(f'{failed} shards failed to migrate.')
+
+@shards_group.command('list', help='List the accounts with their shard\'s schema version, size and balance.')
+@click.argument('usernames', nargs=-1)
+@workers_option
+def list_shards_command(usernames, workers):
+    def describe(row):
+        path = shard_path(row['shard'])
+        if not os.path.exists(path):
+            return None
+        conn = open_connection(path)
+        try:
+            version = get_schema_version(conn)
+            balance = get_balance(conn) if version >= len(MIGRATIONS) else None
+        finally:
+            conn.close()
+        return version, os.path.getsize(path), balance
+    
+    click.echo(f"{'user':<24} {'shard':<16} {'schema':>6} {'size':>10} {'balance':>12}")
+    for row, result in run_in_parallel(list_accounts(usernames), describe, workers):
+        if isinstance(result, Exception):
+            click.echo(f"{row['username']:<24} {row['shard']:<16} {result}")
+        elif result is None:
+            click.echo(f"{row['username']:<24} {row['shard']:<16} {'missing':>6}")
+        else:
+            version, size, balance = result
+            balance = '-' if balance is None else f'{balance:.2f}'
+            click.echo(f"{row['username']:<24} {row['shard']:<16} {version:>6} {size / 1e6:>8.1f}MB {balance:>12}")
+
+# Maintenance jobs from the command line, e.g.
+#   flask --app habit-app jobs list
+#   flask --app habit-app jobs run analyze
+# A job run here takes the same lease as the scheduler's, so it never runs
+# alongside a scheduled run of the same job.
+@bp.cli.group('jobs', help='List the maintenance jobs or run one now.')
+def jobs_group():
+    pass
+
+@jobs_group.command('list', help='Show each job\'s schedule and how its last run went.')
+def list_jobs_command():
+    schedules = job_schedules(current_app.config['JOB_SCHEDULES'])
+    conn = open_jobs_db()
+    try:
+        register_jobs(conn, schedules, time.time())
+        rows = conn.execute('SELECT * FROM scheduled_jobs ORDER BY name').fetchall()
+    finally:
+        conn.close()
+    
+    now = time.time()
+    click.echo(f"{'job':<20} {'schedule':<14} {'next run (UTC)':<26} {'last status':<12} {'duration':>10}  result")
+    for row in rows:
+        job = describe_job(row, now)
+        status = 'running' if job['running'] else job['last_status'] or '-'
+        duration = '-' if job['last_duration_ms'] is None else f"{job['last_duration_ms']:.0f}ms"
+        click.echo(f"{job['name']:<20} {job['schedule']:<14} {job['next_run'] or '-':<26} {status:<12} "
+                   f"{duration:>10}  {job['last_result'] or ''}")
+
+@jobs_group.command('run', help='Run a maintenance job now, whatever its schedule.')
+@click.argument('name', type=click.Choice(list(MAINTENANCE_JOBS)))
+def run_job_command(name):
+    schedules = job_schedules(current_app.config['JOB_SCHEDULES'])
+    conn = open_jobs_db()
+    try:
+        register_jobs(conn, schedules, time.time())
+        runs = run_due_jobs(conn, f'cli:{os.getpid()}', schedules, name)
+    finally:
+        conn.close()
+    if not runs:
+        raise click.ClickException(f'{name} is already running in another process.')
+    name, status, result = runs[0]
+    click.echo(f'{name}: {status}: {result}')
+    if status != 'ok':
+        raise SystemExit(1)
+
+# Static assets, built into content-hashed files by build_assets()
+APP_CSS = ''':root {
+    --bg-color: #ffffff;
+    --text-color: #333333;
+    --card-bg: #f9f9f9;
+    --border-color: #dddddd;
+    --accent-color: #4CAF50;
+    --accent-hover: #3e8e41;
+    --success-bg: #dff0d8;
+    --success-color: #3c763d;
+    --error-bg: #f2dede;
+    --error-color: #a94442;
+    --button-text: white;
+    --header-color: #4CAF50;
+    --hint-color: #888888;
+}
+
+[data-theme="dark"] {
+    --bg-color: #1a1a1a;
+    --text-color: #f0f0f0;
+    --card-bg: #2d2d2d;
+    --border-color: #444444;
+    --accent-color: #5cb85c;
+    --accent-hover: #4cae4c;
+    --success-bg: #2d4116;
+    --success-color: #5cb85c;
+    --error-bg: #4a1919;
+    --error-color: #d9534f;
+    --button-text: #f0f0f0;
+    --header-color: #5cb85c;
+    --hint-color: #aaaaaa;
+}
+
+body {
+    font-family: Arial, sans-serif;
+    max-width: 1000px;
+    margin: 0 auto;
+    padding: 20px;
+    line-height: 1.6;
+    background-color: var(--bg-color);
+    color: var(--text-color);
+    transition: all 0.3s ease;
+}
+
+.theme-toggle {
+    position: absolute;
+    top: 20px;
+    right: 20px;
+    display: flex;
+    align-items: center;
+}
+
+.toggle-switch {
+    position: relative;
+    display: inline-block;
+    width: 60px;
+    height: 30px;
+    margin-left: 10px;
+}
+
+.toggle-switch input {
+    opacity: 0;
+    width: 0;
+    height: 0;
+}
+
+.toggle-slider {
+    position: absolute;
+    cursor: pointer;
+    top: 0;
+    left: 0;
+    right: 0;
+    bottom: 0;
+    background-color: #ccc;
+    transition: .4s;
+    border-radius: 30px;
+}
+
+.toggle-slider:before {
+    position: absolute;
+    content: "";
+    height: 22px;
+    width: 22px;
+    left: 4px;
+    bottom: 4px;
+    background-color: white;
+    transition: .4s;
+    border-radius: 50%;
+}
+
+input:checked + .toggle-slider {
+    background-color: var(--accent-color);
+}
+
+input:checked + .toggle-slider:before {
+    transform: translateX(30px);
+}
+
+.container {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 20px;
+}
+
+.section {
+    flex: 1;
+    min-width: 300px;
+    border: 1px solid var(--border-color);
+    padding: 20px;
+    border-radius: 5px;
+    margin-bottom: 20px;
+    background-color: var(--card-bg);
+    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+}
+
+h1, h2 {
+    color: var(--header-color);
+}
+
+.balance {
+    font-size: 1.5em;
+    font-weight: bold;
+    margin: 20px 0;
+    color: var(--accent-color);
+}
+
+.hint-text {
+    color: var(--hint-color);
+    font-size: 0.9em;
+    margin-top: 5px;
+}
+
+.habit-list, .transaction-list, .bounty-list {
+    list-style-type: none;
+    padding: 0;
+}
+
+.habit-item, .transaction-item, .bounty-item {
+    padding: 10px;
+    margin-bottom: 10px;
+    background-color: var(--card-bg);
+    border: 1px solid var(--border-color);
+    border-radius: 3px;
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+}
+
+.habit-info {
+    flex: 1;
+}
+
+.habit-actions {
+    display: flex;
+    align-items: center;
+    gap: 10px;
+}
+
+form {
+    margin-top: 10px;
+}
+
+label {
+    display: block;
+    margin: 5px 0;
+}
+
+input, select, button {
+    padding: 8px;
+    margin: 5px 0;
+    width: 100%;
+    box-sizing: border-box;
+    border-radius: 3px;
+    border: 1px solid var(--border-color);
+    background-color: var(--card-bg);
+    color: var(--text-color);
+}
+
+button {
+    background-color: var(--accent-color);
+    color: var(--button-text);
+    border: none;
+    cursor: pointer;
+    transition: background-color 0.3s;
+}
+
+button:hover {
+    background-color: var(--accent-hover);
+}
+
+.quantity-input {
+    width: 60px;
+    margin: 0 5px;
+}
+
+.quick-log {
+    width: auto;
+    padding: 5px 10px;
+    white-space: nowrap;
+}
 
-# Initialize database on startup
-init_db()
+.messages {
+    padding: 10px;
+    margin-bottom: 15px;
+    border-radius: 3px;
+}
 
-@app.route('/')
-def index():
-    conn = get_db_connection()
-    habits = conn.execute('SELECT id, description, amount FROM habits').fetchall()
-    
-    # Calculate total balance
-    balance_row = conn.execute('SELECT SUM(amount * quantity) as total FROM transactions').fetchone()
-    balance = balance_row['total'] if balance_row['total'] else 0
-    
-    # Get recent transactions with proper bounty descriptions
-    transactions = conn.execute('''
-        SELECT 
-            t.id, 
-            t.date, 
-            t.amount, 
-            t.quantity, 
-            (t.amount * t.quantity) as total_amount, 
-            CASE 
-                WHEN t.habit_id = -1 THEN t.bounty_description
-                ELSE h.description 
-            END as description,
-            t.habit_id
-        FROM transactions t
-        LEFT JOIN habits h ON t.habit_id = h.id
-        ORDER BY t.id DESC LIMIT 10
-    ''').fetchall()
-    
-    # Get active bounties
-    bounties = conn.execute('''
-        SELECT id, description, amount, date_created
-        FROM bounties
-        WHERE completed = 0
-        ORDER BY id DESC
-    ''').fetchall()
-    
-    conn.close()
-    return render_template('index.html', habits=habits, balance=balance, 
-                           transactions=transactions, bounties=bounties)
+.success {
+    background-color: var(--success-bg);
+    color: var(--success-color);
+}
 
-@app.route('/add_habit', methods=['POST'])
-def add_habit():
-    description = request.form.get('description')
-    
-    try:
-        amount = float(request.form.get('amount'))
-    except ValueError:
-        flash('Please enter a valid amount', 'error')
-        return redirect(url_for('index'))
-    
-    conn = get_db_connection()
-    conn.execute('INSERT INTO habits (description, amount) VALUES (?, ?)', 
-                (description, amount))
-    conn.commit()
-    conn.close()
-    
-    flash('Habit added successfully!', 'success')
-    return redirect(url_for('index'))
+.error {
+    background-color: var(--error-bg);
+    color: var(--error-color);
+}
 
-@app.route('/add_transaction', methods=['POST'])
-def add_transaction():
-    habit_id = request.form.get('habit_id')
-    
-    try:
-        amount = float(request.form.get('amount'))
-        quantity = int(request.form.get('quantity', 1))
-        if quantity < 1:
-            quantity = 1
-    except ValueError:
-        flash('Please enter valid values', 'error')
-        return redirect(url_for('index'))
-    
-    conn = get_db_connection()
-    conn.execute('INSERT INTO transactions (habit_id, amount, quantity, date) VALUES (?, ?, ?, ?)', 
-                (habit_id, amount, quantity, datetime.now().strftime('%Y-%m-%d')))
-    conn.commit()
-    conn.close()
-    
-    flash(f'Transaction added successfully! ({quantity}x)', 'success')
-    return redirect(url_for('index'))
+.pending {
+    background-color: var(--card-bg);
+    border: 1px solid var(--border-color);
+}
 
-@app.route('/add_bounty', methods=['POST'])
-def add_bounty():
-    description = request.form.get('description')
-    
-    try:
-        amount = float(request.form.get('amount'))
-    except ValueError:
-        flash('Please enter a valid amount', 'error')
-        return redirect(url_for('index'))
-    
-    conn = get_db_connection()
-    conn.execute('INSERT INTO bounties (description, amount, date_created, completed) VALUES (?, ?, ?, 0)', 
-                (description, amount, datetime.now().strftime('%Y-%m-%d')))
-    conn.commit()
-    conn.close()
-    
-    flash('Bounty added successfully!', 'success')
-    return redirect(url_for('index'))
+.complete-button {
+    background-color: #5bc0de;
+}
 
-@app.route('/complete_bounty/<int:bounty_id>', methods=['POST'])
-def complete_bounty(bounty_id):
-    conn = get_db_connection()
-    
-    # Get the bounty details
-    bounty = conn.execute('SELECT id, description, amount FROM bounties WHERE id = ?', 
-                         (bounty_id,)).fetchone()
-    
-    if not bounty:
-        flash('Bounty not found', 'error')
-        return redirect(url_for('index'))
-    
-    # Mark the bounty as completed
-    conn.execute('UPDATE bounties SET completed = 1 WHERE id = ?', (bounty_id,))
-    
-    # Add the bounty amount to transactions with the bounty description
-    conn.execute('''
-        INSERT INTO transactions 
-        (habit_id, amount, quantity, date, bounty_description) 
-        VALUES (-1, ?, 1, ?, ?)
-    ''', (bounty['amount'], datetime.now().strftime('%Y-%m-%d'), bounty['description']))
-    
-    conn.commit()
-    conn.close()
-    
-    flash(f'Bounty completed: ${bounty["amount"]:.2f} added to balance!', 'success')
-    return redirect(url_for('index'))
+.complete-button:hover {
+    background-color: #46b8da;
+}
 
-@app.route('/toggle_theme', methods=['POST'])
-def toggle_theme():
-    # This endpoint is called by AJAX to store the theme preference
-    # It doesn't actually do anything server-side, just responds
-    return jsonify({"status": "success"})
+@media (max-width: 768px) {
+    .section {
+        min-width: 100%;
+    }
+}
+'''
 
-# Create templates directory and templates
-@app.route('/create_templates')
-def create_templates():
-    import os
-    
-    # Create templates directory if it doesn't exist
-    if not os.path.exists('templates'):
-        os.makedirs('templates')
-    
-    # Write the index.html template
-    with open('templates/index.html', 'w') as f:
-        f.write('''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Habit Tracker</title>
-    <style>
-        :root {
-            --bg-color: #ffffff;
-            --text-color: #333333;
-            --card-bg: #f9f9f9;
-            --border-color: #dddddd;
-            --accent-color: #4CAF50;
-            --accent-hover: #3e8e41;
-            --success-bg: #dff0d8;
-            --success-color: #3c763d;
-            --error-bg: #f2dede;
-            --error-color: #a94442;
-            --button-text: white;
-            --header-color: #4CAF50;
-            --hint-color: #888888;
-        }
+APP_JS = '''// Dark mode toggle functionality
+document.addEventListener('DOMContentLoaded', function() {
+    const toggleSwitch = document.getElementById('theme-toggle');
+    const themeLabel = document.getElementById('theme-label');
 
-        [data-theme="dark"] {
-            --bg-color: #1a1a1a;
-            --text-color: #f0f0f0;
-            --card-bg: #2d2d2d;
-            --border-color: #444444;
-            --accent-color: #5cb85c;
-            --accent-hover: #4cae4c;
-            --success-bg: #2d4116;
-            --success-color: #5cb85c;
-            --error-bg: #4a1919;
-            --error-color: #d9534f;
-            --button-text: #f0f0f0;
-            --header-color: #5cb85c;
-            --hint-color: #aaaaaa;
+    // Function to set the theme
+    function setTheme(isDark) {
+        if (isDark) {
+            document.documentElement.setAttribute('data-theme', 'dark');
+            themeLabel.textContent = 'Dark';
+            toggleSwitch.checked = true;
+        } else {
+            document.documentElement.setAttribute('data-theme', 'light');
+            themeLabel.textContent = 'Light';
+            toggleSwitch.checked = false;
         }
+        // Save preference to localStorage
+        localStorage.setItem('dark-mode', isDark ? 'dark' : 'light');
+    }
 
-        body {
-            font-family: Arial, sans-serif;
-            max-width: 1000px;
-            margin: 0 auto;
-            padding: 20px;
-            line-height: 1.6;
-            background-color: var(--bg-color);
-            color: var(--text-color);
-            transition: all 0.3s ease;
-        }
+    // Check for saved preference or OS preference
+    const savedTheme = localStorage.getItem('dark-mode');
+    if (savedTheme) {
+        setTheme(savedTheme === 'dark');
+    } else {
+        // Check OS preference
+        const prefersDarkMode = window.matchMedia('(prefers-color-scheme: dark)').matches;
+        setTheme(prefersDarkMode);
+    }
 
-        .theme-toggle {
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            display: flex;
-            align-items: center;
-        }
+    // Toggle event
+    toggleSwitch.addEventListener('change', function(e) {
+        setTheme(e.target.checked);
 
-        .toggle-switch {
-            position: relative;
-            display: inline-block;
-            width: 60px;
-            height: 30px;
-            margin-left: 10px;
-        }
+        // Optional: Send preference to server
+        fetch('/toggle_theme', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ theme: e.target.checked ? 'dark' : 'light' }),
+        });
+    });
 
-        .toggle-switch input {
-            opacity: 0;
-            width: 0;
-            height: 0;
-        }
+    // Load older transactions a page at a time using the id cursor
+    const loadMore = document.getElementById('load-more');
+    if (loadMore) {
+        loadMore.addEventListener('click', function() {
+            fetch('/api/transactions?before=' + loadMore.dataset.cursor)
+                .then(response => response.json())
+                .then(data => {
+                    const list = document.querySelector('.transaction-list');
+                    data.transactions.forEach(t => list.appendChild(transactionItem(t)));
+                    if (data.next_cursor) {
+                        loadMore.dataset.cursor = data.next_cursor;
+                    } else {
+                        loadMore.remove();
+                    }
+                });
+        });
+    }
 
-        .toggle-slider {
-            position: absolute;
-            cursor: pointer;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background-color: #ccc;
-            transition: .4s;
-            border-radius: 30px;
-        }
+    // Build a list item matching the server-rendered transactions
+    function transactionItem(t) {
+        const item = document.createElement('li');
+        item.className = 'transaction-item';
+        item.dataset.transactionId = t.id;
 
-        .toggle-slider:before {
-            position: absolute;
-            content: "";
-            height: 22px;
-            width: 22px;
-            left: 4px;
-            bottom: 4px;
-            background-color: white;
-            transition: .4s;
-            border-radius: 50%;
-        }
+        const description = document.createElement('strong');
+        description.textContent = t.description;
+        item.appendChild(description);
+        item.appendChild(document.createTextNode(': '));
 
-        input:checked + .toggle-slider {
-            background-color: var(--accent-color);
+        const detail = document.createElement('span');
+        if (t.habit_id === -1) {
+            detail.textContent = 'Bounty Completed: $' + t.amount.toFixed(2);
+        } else {
+            detail.textContent = '$' + t.amount.toFixed(2) + ' × ' + t.quantity +
+                ' = $' + t.total_amount.toFixed(2);
         }
+        item.appendChild(detail);
 
-        input:checked + .toggle-slider:before {
-            transform: translateX(30px);
-        }
+        const date = document.createElement('div');
+        const small = document.createElement('small');
+        small.textContent = t.date;
+        date.appendChild(small);
+        item.appendChild(date);
+        return item;
+    }
 
-        .container {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 20px;
-        }
+    // Submit forms with fetch; the page itself is updated by the live events
+    // below. Without EventSource the forms post and redirect as usual.
+    if (window.EventSource) {
+        document.querySelectorAll('form[data-live]').forEach(liveForm);
+        listenForEvents();
+    }
 
-        .section {
-            flex: 1;
-            min-width: 300px;
-            border: 1px solid var(--border-color);
-            padding: 20px;
-            border-radius: 5px;
-            margin-bottom: 20px;
-            background-color: var(--card-bg);
-            box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        }
+    function liveForm(form) {
+        form.addEventListener('submit', function(e) {
+            e.preventDefault();
+            fetch(form.action, {
+                method: 'POST',
+                headers: { 'Accept': 'application/json' },
+                body: new FormData(form),
+            })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.status === 'success') {
+                        showMessage(data.message, 'success');
+                        if (form.dataset.live === 'reset') {
+                            form.reset();
+                        }
+                    } else if (data.status === 'pending') {
+                        showMessage(data.message, 'pending');
+                    } else {
+                        showMessage(data.error, 'error');
+                    }
+                })
+                .catch(() => form.submit());
+        });
+    }
 
-        h1, h2 {
-            color: var(--header-color);
-        }
+    function showMessage(text, category) {
+        const message = document.createElement('div');
+        message.className = 'messages ' + category;
+        message.textContent = text;
+        document.getElementById('messages').replaceChildren(message);
+    }
 
-        .balance {
-            font-size: 1.5em;
-            font-weight: bold;
-            margin: 20px 0;
-            color: var(--accent-color);
-        }
+    function listenForEvents() {
+        const events = new EventSource('/events');
 
-        .hint-text {
-            color: var(--hint-color);
-            font-size: 0.9em;
-            margin-top: 5px;
-        }
+        events.addEventListener('balance', e => setBalance(JSON.parse(e.data).balance));
 
-        .habit-list, .transaction-list, .bounty-list {
-            list-style-type: none;
-            padding: 0;
-        }
+        events.addEventListener('transaction', e => {
+            const t = JSON.parse(e.data);
+            addTransaction(t);
+            if (t.current_streak !== undefined) {
+                setStreak(t.habit_id, t.current_streak, t.longest_streak);
+            }
+        });
 
-        .habit-item, .transaction-item, .bounty-item {
-            padding: 10px;
-            margin-bottom: 10px;
-            background-color: var(--card-bg);
-            border: 1px solid var(--border-color);
-            border-radius: 3px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
+        events.addEventListener('habit', e => {
+            const h = JSON.parse(e.data);
+            if (!document.querySelector('[data-habit-id="' + h.id + '"]')) {
+                listIn('habits', 'habit-list').appendChild(habitItem(h));
+            }
+        });
 
-        .habit-info {
-            flex: 1;
-        }
+        events.addEventListener('bounty', e => {
+            const b = JSON.parse(e.data);
+            const existing = document.querySelector('[data-bounty-id="' + b.id + '"]');
+            if (b.completed) {
+                if (existing) {
+                    existing.remove();
+                }
+            } else if (!existing) {
+                listIn('bounties', 'bounty-list').prepend(bountyItem(b));
+            }
+        });
 
-        .habit-actions {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
+        // Another server process wrote: pick up the newest transactions
+        events.addEventListener('refresh', e => {
+            setBalance(JSON.parse(e.data).balance);
+            fetch('/api/transactions?limit=20')
+                .then(response => response.json())
+                .then(data => data.transactions.reverse().forEach(addTransaction));
+        });
+    }
 
-        form {
-            margin-top: 10px;
-        }
+    function setBalance(balance) {
+        document.getElementById('balance').textContent = balance.toFixed(2);
+    }
 
-        label {
-            display: block;
-            margin: 5px 0;
+    function addTransaction(t) {
+        if (!document.querySelector('[data-transaction-id="' + t.id + '"]')) {
+            listIn('transactions', 'transaction-list').prepend(transactionItem(t));
         }
+    }
 
-        input, select, button {
-            padding: 8px;
-            margin: 5px 0;
-            width: 100%;
-            box-sizing: border-box;
-            border-radius: 3px;
-            border: 1px solid var(--border-color);
-            background-color: var(--card-bg);
-            color: var(--text-color);
+    function setStreak(habitId, current, longest) {
+        const habit = document.querySelector('[data-habit-id="' + habitId + '"] .habit-info');
+        if (!habit) {
+            return;
         }
-
-        button {
-            background-color: var(--accent-color);
-            color: var(--button-text);
-            border: none;
-            cursor: pointer;
-            transition: background-color 0.3s;
+        let streak = habit.querySelector('.streak');
+        if (!streak) {
+            streak = document.createElement('div');
+            streak.className = 'hint-text streak';
+            habit.appendChild(streak);
         }
+        streak.textContent = 'Streak: ' + current + ' day' + (current === 1 ? '' : 's') +
+            ' (best ' + longest + ')';
+    }
 
-        button:hover {
-            background-color: var(--accent-hover);
+    // The list in a section, replacing its "nothing here yet" message
+    function listIn(sectionId, className) {
+        const section = document.getElementById(sectionId);
+        let list = section.querySelector('.' + className);
+        if (!list) {
+            list = document.createElement('ul');
+            list.className = className;
+            const empty = section.querySelector('.empty');
+            if (empty) {
+                empty.replaceWith(list);
+            } else {
+                section.appendChild(list);
+            }
         }
+        return list;
+    }
 
-        .quantity-input {
-            width: 60px;
-            margin: 0 5px;
-        }
+    // Build list items matching the server-rendered habits and bounties
+    function habitItem(h) {
+        const item = document.createElement('li');
+        item.className = 'habit-item';
+        item.dataset.habitId = h.id;
 
-        .quick-log {
-            width: auto;
-            padding: 5px 10px;
-            white-space: nowrap;
-        }
+        const info = document.createElement('div');
+        info.className = 'habit-info';
+        const description = document.createElement('strong');
+        description.textContent = h.description;
+        const amount = document.createElement('div');
+        amount.textContent = '$' + h.amount.toFixed(2) + ' per completion';
+        info.append(description, amount);
 
-        .messages {
-            padding: 10px;
-            margin-bottom: 15px;
-            border-radius: 3px;
-        }
+        const actions = document.createElement('div');
+        actions.className = 'habit-actions';
+        const form = document.createElement('form');
+        form.action = '/add_transaction';
+        form.method = 'post';
+        form.style.cssText = 'margin: 0; display: flex; align-items: center;';
+        form.innerHTML = '<input type="hidden" name="habit_id">' +
+            '<input type="hidden" name="amount">' +
+            '<input type="number" name="quantity" class="quantity-input" value="1" min="1" max="100">' +
+            '<span>×</span>' +
+            '<button type="submit" class="quick-log">Complete</button>';
+        form.elements.habit_id.value = h.id;
+        form.elements.amount.value = h.amount;
+        liveForm(form);
+        actions.appendChild(form);
 
-        .success {
-            background-color: var(--success-bg);
-            color: var(--success-color);
-        }
+        item.append(info, actions);
+        return item;
+    }
 
-        .error {
-            background-color: var(--error-bg);
-            color: var(--error-color);
-        }
+    function bountyItem(b) {
+        const item = document.createElement('li');
+        item.className = 'bounty-item';
+        item.dataset.bountyId = b.id;
 
-        .complete-button {
-            background-color: #5bc0de;
-        }
+        const info = document.createElement('div');
+        info.className = 'habit-info';
+        const description = document.createElement('strong');
+        description.textContent = b.description;
+        const reward = document.createElement('div');
+        reward.textContent = 'Reward: $' + b.amount.toFixed(2);
+        const created = document.createElement('div');
+        const small = document.createElement('small');
+        small.textContent = 'Created: ' + b.date_created;
+        created.appendChild(small);
+        info.append(description, reward, created);
 
-        .complete-button:hover {
-            background-color: #46b8da;
-        }
+        const form = document.createElement('form');
+        form.action = '/complete_bounty/' + b.id;
+        form.method = 'post';
+        // One key per bounty, so a double click gets the first click's answer
+        form.innerHTML = '<input type="hidden" name="key" value="complete-bounty-' + b.id + '">' +
+            '<button type="submit" class="complete-button">Complete</button>';
+        liveForm(form);
 
-        @media (max-width: 768px) {
-            .section {
-                min-width: 100%;
-            }
+        item.append(info, form);
+        return item;
+    }
+
+    // Listen for OS theme changes
+    window.matchMedia('(prefers-color-scheme: dark)').addEventListener('change', e => {
+        // Only change if user hasn't set a preference
+        if (!localStorage.getItem('dark-mode')) {
+            setTheme(e.matches);
         }
-    </style>
+    });
+});
+'''
+
+STATIC_ASSETS = {
+    'app.css': APP_CSS,
+    'app.js': APP_JS,
+}
+
+ASSET_MANIFEST = 'manifest.json'
+
+# Write each asset as name.<content hash>.ext, plus gzip and (if the brotli
+# package is installed) brotli copies, and record the hashed names in the
+# manifest. Old builds are left in place for pages that still reference them.
+def build_assets(static_folder=None):
+    static_folder = static_folder or current_app.static_folder
+    os.makedirs(static_folder, exist_ok=True)
+    
+    manifest = {}
+    for name, content in STATIC_ASSETS.items():
+        data = content.encode('utf-8')
+        stem, extension = os.path.splitext(name)
+        hashed_name = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+        path = os.path.join(static_folder, hashed_name)
+        
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        manifest[name] = hashed_name
+    
+    with open(os.path.join(static_folder, ASSET_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    current_app.extensions['habit_asset_manifest'] = manifest
+    return manifest
+
+# The built asset names, read from the manifest once per app
+def get_asset_manifest():
+    manifest = current_app.extensions.get('habit_asset_manifest')
+    if manifest is None:
+        try:
+            with open(os.path.join(current_app.static_folder, ASSET_MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            # Not built yet; look again on the next request
+            return {}
+        current_app.extensions['habit_asset_manifest'] = manifest
+    return manifest
+
+@bp.app_context_processor
+def asset_helpers():
+    def asset_url(name):
+        return url_for('habit_tracker.asset', filename=get_asset_manifest().get(name, name))
+    return {'asset_url': asset_url}
+
+# Serves built assets, preferring a precompressed copy the browser accepts.
+# Hashed names never change content, so they can be cached forever.
+@bp.route('/assets/<filename>')
+def asset(filename):
+    mimetype = mimetypes.guess_type(filename)[0]
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        path = safe_join(current_app.static_folder, filename + suffix)
+        if request.accept_encodings[encoding] and path and os.path.isfile(path):
+            response = send_from_directory(current_app.static_folder, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(current_app.static_folder, filename, mimetype=mimetype)
+    
+    response.vary.add('Accept-Encoding')
+    if filename in get_asset_manifest().values():
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+DEFAULT_CONFIG.update(
+    COMPRESS_MIN_SIZE=int(os.environ.get('HABIT_TRACKER_COMPRESS_MIN_SIZE', 500)),
+    COMPRESS_LEVEL=int(os.environ.get('HABIT_TRACKER_COMPRESS_LEVEL', 6)),
+)
+
+COMPRESSED_MIMETYPES = ('text/html', 'application/json')
+
+# gzip dynamic HTML and JSON responses for clients that accept it
+@bp.after_app_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSED_MIMETYPES
+            or not request.accept_encodings['gzip']):
+        return response
+    
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    
+    # A strong ETag must differ between encodings of the same page
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}{GZIP_ETAG_SUFFIX}')
+    return response
+
+# gzip a streamed response chunk by chunk. Each chunk is flushed whole, so
+# compression never holds back what the stream has already produced.
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+# Create templates directory and templates
+def create_templates():
+    # Write them where Flask looks for them, whatever the working directory
+    template_folder = os.path.join(current_app.root_path, current_app.template_folder)
+    
+    # Create templates directory if it doesn't exist
+    os.makedirs(template_folder, exist_ok=True)
+    
+    # Write the index.html template
+    with open(os.path.join(template_folder, 'index.html'), 'w') as f:
+        f.write('''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Habit Tracker</title>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
 </head>
 <body>
     <h1>Habit Tracker</h1>
+    <p><a href="{{ url_for('.analytics_page') }}">Earnings analytics</a></p>
+    {% if session['user'] %}
+    <form class="account" action="{{ url_for('.logout') }}" method="post">
+        Signed in as {{ session['user'] }} <button type="submit">Sign out</button>
+    </form>
+    {% endif %}
 
     <div class="theme-toggle">
         <span id="theme-label">Light</span>
@@ -452,22 +4338,19 @@ def create_templates():
         </label>
     </div>
 
-    {% if get_flashed_messages() %}
-        {% for category, message in get_flashed_messages(with_categories=true) %}
-        <div class="messages {{ category }}">
-            {{ message }}
-        </div>
-        {% endfor %}
-    {% endif %}
+    <div id="messages">
+    {{ flash_messages }}
+    </div>
 
     <div class="balance">
-        Balance: ${{ "%.2f"|format(balance) }}
+        Balance: $<span id="balance">{{ "%.2f"|format(balance) }}</span>
     </div>
+    {{ stream_flush }}
 
     <div class="container">
         <div class="section">
             <h2>Add New Habit</h2>
-            <form action="{{ url_for('add_habit') }}" method="post">
+            <form action="{{ url_for('.add_habit') }}" method="post" data-live="reset">
                 <div>
                     <label for="description">Habit Description:</label>
                     <input type="text" id="description" name="description" required placeholder="e.g., Exercise 30 minutes">
@@ -482,18 +4365,20 @@ def create_templates():
             </form>
         </div>
 
-        <div class="section">
+        <div class="section" id="habits">
             <h2>Your Habits</h2>
-            {% if habits %}
-                <ul class="habit-list">
-                {% for habit in habits %}
-                    <li class="habit-item">
+            {% for habit in habits %}
+                {% if loop.first %}<ul class="habit-list">{% endif %}
+                    <li class="habit-item" data-habit-id="{{ habit['id'] }}">
                         <div class="habit-info">
                             <strong>{{ habit['description'] }}</strong>
                             <div>${{ "%.2f"|format(habit['amount']) }} per completion</div>
+                            {% if habit['longest_streak'] %}
+                                <div class="hint-text streak">Streak: {{ habit['current_streak'] }} day{{ '' if habit['current_streak'] == 1 else 's' }} (best {{ habit['longest_streak'] }})</div>
+                            {% endif %}
                         </div>
                         <div class="habit-actions">
-                            <form action="{{ url_for('add_transaction') }}" method="post" style="margin: 0; display: flex; align-items: center;">
+                            <form action="{{ url_for('.add_transaction') }}" method="post" data-live style="margin: 0; display: flex; align-items: center;">
                                 <input type="hidden" name="habit_id" value="{{ habit['id'] }}">
                                 <input type="hidden" name="amount" value="{{ habit['amount'] }}">
                                 <input type="number" name="quantity" class="quantity-input" value="1" min="1" max="100">
@@ -502,18 +4387,17 @@ def create_templates():
                             </form>
                         </div>
                     </li>
-                {% endfor %}
-                </ul>
+                {% if loop.last %}</ul>{% endif %}
             {% else %}
-                <p>No habits added yet. Add your first habit!</p>
-            {% endif %}
+                <p class="empty">No habits added yet. Add your first habit!</p>
+            {% endfor %}
         </div>
     </div>
 
     <div class="container">
         <div class="section">
             <h2>Add Bounty</h2>
-            <form action="{{ url_for('add_bounty') }}" method="post">
+            <form action="{{ url_for('.add_bounty') }}" method="post" data-live="reset">
                 <div>
                     <label for="bounty_description">Bounty Description:</label>
                     <input type="text" id="bounty_description" name="description" required placeholder="e.g., Deep clean my room">
@@ -528,35 +4412,34 @@ def create_templates():
             </form>
         </div>
 
-        <div class="section">
+        <div class="section" id="bounties">
             <h2>Bounty Board</h2>
-            {% if bounties %}
-                <ul class="bounty-list">
-                {% for bounty in bounties %}
-                    <li class="bounty-item">
+            {% for bounty in bounties %}
+                {% if loop.first %}<ul class="bounty-list">{% endif %}
+                    <li class="bounty-item" data-bounty-id="{{ bounty['id'] }}">
                         <div class="habit-info">
                             <strong>{{ bounty['description'] }}</strong>
                             <div>Reward: ${{ "%.2f"|format(bounty['amount']) }}</div>
                             <div><small>Created: {{ bounty['date_created'] }}</small></div>
                         </div>
-                        <form action="{{ url_for('complete_bounty', bounty_id=bounty['id']) }}" method="post">
+                        <form action="{{ url_for('.complete_bounty', bounty_id=bounty['id']) }}" method="post" data-live>
+                            <input type="hidden" name="key" value="complete-bounty-{{ bounty['id'] }}">
                             <button type="submit" class="complete-button">Complete</button>
                         </form>
                     </li>
-                {% endfor %}
-                </ul>
+                {% if loop.last %}</ul>{% endif %}
             {% else %}
-                <p>No active bounties. Add a bounty to motivate yourself!</p>
-            {% endif %}
+                <p class="empty">No active bounties. Add a bounty to motivate yourself!</p>
+            {% endfor %}
         </div>
     </div>
 
-    <div class="section">
+    <div class="section" id="transactions">
         <h2>Recent Transactions</h2>
         {% if transactions %}
             <ul class="transaction-list">
             {% for transaction in transactions %}
-                <li class="transaction-item">
+                <li class="transaction-item" data-transaction-id="{{ transaction['id'] }}">
                     <strong>{{ transaction['description'] }}</strong>: 
                     {% if transaction['habit_id'] == -1 %}
                         <span>Bounty Completed: ${{ "%.2f"|format(transaction['amount']) }}</span>
@@ -567,76 +4450,217 @@ def create_templates():
                 </li>
             {% endfor %}
             </ul>
+            {% if next_cursor %}
+                <button type="button" id="load-more" data-cursor="{{ next_cursor }}">Load more</button>
+            {% endif %}
         {% else %}
-            <p>No transactions yet. Complete habits or bounties!</p>
+            <p class="empty">No transactions yet. Complete habits or bounties!</p>
         {% endif %}
     </div>
 
-    <script>
-        // Dark mode toggle functionality
-        document.addEventListener('DOMContentLoaded', function() {
-            const toggleSwitch = document.getElementById('theme-toggle');
-            const themeLabel = document.getElementById('theme-label');
-            
-            // Function to set the theme
-            function setTheme(isDark) {
-                if (isDark) {
-                    document.documentElement.setAttribute('data-theme', 'dark');
-                    themeLabel.textContent = 'Dark';
-                    toggleSwitch.checked = true;
-                } else {
-                    document.documentElement.setAttribute('data-theme', 'light');
-                    themeLabel.textContent = 'Light';
-                    toggleSwitch.checked = false;
-                }
-                // Save preference to localStorage
-                localStorage.setItem('dark-mode', isDark ? 'dark' : 'light');
-            }
-            
-            // Check for saved preference or OS preference
-            const savedTheme = localStorage.getItem('dark-mode');
-            if (savedTheme) {
-                setTheme(savedTheme === 'dark');
-            } else {
-                // Check OS preference
-                const prefersDarkMode = window.matchMedia('(prefers-color-scheme: dark)').matches;
-                setTheme(prefersDarkMode);
-            }
-            
-            // Toggle event
-            toggleSwitch.addEventListener('change', function(e) {
-                setTheme(e.target.checked);
-                
-                // Optional: Send preference to server
-                fetch('/toggle_theme', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ theme: e.target.checked ? 'dark' : 'light' }),
-                });
-            });
-            
-            // Listen for OS theme changes
-            window.matchMedia('(prefers-color-scheme: dark)').addEventListener('change', e => {
-                // Only change if user hasn't set a preference
-                if (!localStorage.getItem('dark-mode')) {
-                    setTheme(e.matches);
-                }
-            });
-        });
-    </script>
+    <script src="{{ asset_url('app.js') }}"></script>
+</body>
+</html>''')
+    
+    # Write the login.html template, for multi-tenant mode
+    with open(os.path.join(template_folder, 'login.html'), 'w') as f:
+        f.write('''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Habit Tracker - Sign In</title>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body>
+    <h1>Habit Tracker</h1>
+
+    <div class="theme-toggle">
+        <span id="theme-label">Light</span>
+        <label class="toggle-switch">
+            <input type="checkbox" id="theme-toggle">
+            <span class="toggle-slider"></span>
+        </label>
+    </div>
+
+    <div id="messages">
+    {% for category, message in get_flashed_messages(with_categories=true) %}
+        <div class="messages {{ category }}">
+            {{ message }}
+        </div>
+    {% endfor %}
+    </div>
+
+    <div class="container">
+        <div class="section">
+            <h2>Sign In</h2>
+            <form action="{{ url_for('.login') }}" method="post">
+                <div>
+                    <label for="login-username">Username:</label>
+                    <input type="text" id="login-username" name="username" required autocomplete="username">
+                </div>
+                <div>
+                    <label for="login-password">Password:</label>
+                    <input type="password" id="login-password" name="password" required autocomplete="current-password">
+                </div>
+                <button type="submit">Sign In</button>
+            </form>
+        </div>
+
+        <div class="section">
+            <h2>Create an Account</h2>
+            <form action="{{ url_for('.register') }}" method="post">
+                <div>
+                    <label for="register-username">Username:</label>
+                    <input type="text" id="register-username" name="username" required autocomplete="username">
+                    <div class="hint-text">Letters, digits, dots, dashes or underscores</div>
+                </div>
+                <div>
+                    <label for="register-password">Password:</label>
+                    <input type="password" id="register-password" name="password" required minlength="8" autocomplete="new-password">
+                    <div class="hint-text">At least 8 characters</div>
+                </div>
+                <button type="submit">Create Account</button>
+            </form>
+        </div>
+    </div>
+
+    <script src="{{ asset_url('app.js') }}"></script>
+</body>
+</html>''')
+    
+    # Write the analytics.html template
+    with open(os.path.join(template_folder, 'analytics.html'), 'w') as f:
+        f.write('''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Habit Tracker - Analytics</title>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body>
+    <h1>Earnings Analytics</h1>
+    <p><a href="{{ url_for('.index') }}">Back to habits</a></p>
+
+    <div class="theme-toggle">
+        <span id="theme-label">Light</span>
+        <label class="toggle-switch">
+            <input type="checkbox" id="theme-toggle">
+            <span class="toggle-slider"></span>
+        </label>
+    </div>
+
+    {% if analytics %}
+        <div class="balance">
+            Earned: ${{ "%.2f"|format(analytics['total_earned']) }} from {{ analytics['completions'] }} completions
+        </div>
+
+        <div class="container">
+            <div class="section">
+                <h2>Projection</h2>
+                <ul class="habit-list">
+                    <li class="habit-item">Daily pace (last 30 days): ${{ "%.2f"|format(analytics['projection']['daily_pace']) }}</li>
+                    <li class="habit-item">Trend: {{ "%+.2f"|format(analytics['projection']['trend_per_day']) }} per day</li>
+                    <li class="habit-item">Next 30 days: ${{ "%.2f"|format(analytics['projection']['next_30_days']) }}</li>
+                    <li class="habit-item">This month so far: ${{ "%.2f"|format(analytics['projection']['month_to_date']) }}</li>
+                    <li class="habit-item">Projected month end: ${{ "%.2f"|format(analytics['projection']['month_end']) }}</li>
+                </ul>
+            </div>
+
+            <div class="section">
+                <h2>Contribution by Habit</h2>
+                <ul class="habit-list">
+                {% for habit in analytics['habits'] %}
+                    <li class="habit-item">
+                        <strong>{{ habit['description'] }}</strong>
+                        <span>${{ "%.2f"|format(habit['earned']) }} ({{ "%.1f"|format(habit['share'] * 100) }}%)</span>
+                    </li>
+                {% endfor %}
+                </ul>
+            </div>
+        </div>
+
+        <div class="container">
+            <div class="section">
+                <h2>Monthly</h2>
+                <ul class="transaction-list">
+                {% for month in analytics['monthly']|reverse %}
+                    <li class="transaction-item"><strong>{{ month['month'] }}</strong> <span>${{ "%.2f"|format(month['earned']) }}</span></li>
+                {% endfor %}
+                </ul>
+            </div>
+
+            <div class="section">
+                <h2>Weekly</h2>
+                <ul class="transaction-list">
+                {% for week in (analytics['weekly']|reverse|list)[:12] %}
+                    <li class="transaction-item"><strong>Week of {{ week['week_start'] }}</strong> <span>${{ "%.2f"|format(week['earned']) }}</span></li>
+                {% endfor %}
+                </ul>
+            </div>
+        </div>
+
+        <div class="section">
+            <h2>Daily (with 7 and 30 day averages)</h2>
+            <ul class="transaction-list">
+            {% for day in (analytics['daily']|reverse|list)[:30] %}
+                <li class="transaction-item">
+                    <strong>{{ day['day'] }}</strong>
+                    <span>${{ "%.2f"|format(day['earned']) }} &middot; 7d avg ${{ "%.2f"|format(day['rolling_7']) }} &middot; 30d avg ${{ "%.2f"|format(day['rolling_30']) }}</span>
+                </li>
+            {% endfor %}
+            </ul>
+        </div>
+    {% else %}
+        <p>No completions yet. Complete habits or bounties to see trends!</p>
+    {% endif %}
+
+    <script src="{{ asset_url('app.js') }}"></script>
 </body>
 </html>''')
     
-    return "Templates created. You can now run the app."
+
+
+# The build step: write the page template and the static assets
+def build():
+    create_templates()
+    build_assets()
+
+@bp.cli.command('build', help='Write the page template and the static assets.')
+def build_command():
+    build()
+    click.echo('Built templates and static assets.')
+
+# Create and configure an app. Nothing touches the disk or database here;
+# the schema is brought up to date on first use, once per process.
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+    if app.config['TIMEZONE']:
+        zoneinfo.ZoneInfo(app.config['TIMEZONE'])  # Fail at startup on an unknown zone
+    job_schedules(app.config['JOB_SCHEDULES'])  # And on a bad job schedule
+    if app.config['MULTI_TENANT'] and app.config['SECRET_KEY'] == DEFAULT_SECRET_KEY:
+        # The session says whose shard a request uses, so it must not be forgeable
+        raise RuntimeError('Set HABIT_TRACKER_SECRET_KEY to a secret value to run in multi-tenant mode')
+    
+    app.extensions['habit_index_cache'] = [None, None]
+    app.extensions['habit_analytics_cache'] = [None, None]
+    app.register_blueprint(bp)
+    # Teardowns run last first, so the connection goes back to its shard's
+    # pool before the shard is released
+    app.teardown_appcontext(release_shard)
+    app.teardown_appcontext(release_db_connection)
+    return app
 
 if __name__ == '__main__':
-    import os
+    app = create_app()
     
-    # Check if templates directory exists, if not create it and templates
-    if not os.path.exists('templates'):
-        create_templates()
-        print("Created templates directory and index.html")
+    # (Re)write the templates so they always match this version of the app
+    with app.app_context():
+        build()
+    print("Created templates directory and index.html")
     
     app.run(debug=True)
\ No newline at end of file
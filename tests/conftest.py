@@ -0,0 +1,37 @@
+# Shared fixtures. habit-app.py has a dash in its name, so it is loaded from
+# its path rather than imported.
+import importlib.util
+import os
+import sys
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'habit-app.py')
+
+@pytest.fixture(scope='session')
+def habit_app():
+    spec = importlib.util.spec_from_file_location('habit_app', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# An app on a fresh database in tmp_path, with its templates built and no
+# background scheduler
+@pytest.fixture
+def make_app(habit_app, tmp_path):
+    def make(**config):
+        config = {'DATABASE': str(tmp_path / 'habits.db'), 'SCHEDULER': False, 'TESTING': True, **config}
+        app = habit_app.create_app(config)
+        with app.app_context():
+            habit_app.build()
+        return app
+    return make
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
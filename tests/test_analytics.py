@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+TODAY = date(2024, 6, 15)
+
+def analytics_for(habit_app, app, completions):
+    with app.app_context():
+        habit_app.ensure_db_initialized(app.config['DATABASE'])
+        conn = habit_app.open_connection(app.config['DATABASE'])
+        conn.execute("INSERT INTO habits (description, amount) VALUES ('Run', 1)")
+        habit_app.record_transactions(conn, [(1, amount, 1, day.isoformat(), None, None) for day, amount in completions])
+        conn.commit()
+        try:
+            return habit_app.compute_analytics(conn, today=TODAY)
+        finally:
+            conn.close()
+
+# One completion yesterday is 1/30 of the last 30 days, not a full day's pace
+def test_pace_is_over_the_last_30_days(habit_app, app):
+    projection = analytics_for(habit_app, app, [(TODAY - timedelta(days=1), 30.0)])['projection']
+    assert projection['daily_pace'] == 1.0
+    assert projection['next_30_days'] == 30.0
+
+def test_future_completions_are_left_out_of_pace_and_month_to_date(habit_app, app):
+    analytics = analytics_for(habit_app, app, [(TODAY + timedelta(days=3), 10.0), (TODAY + timedelta(days=40), 5.0)])
+    assert analytics['total_earned'] == 15.0
+    assert analytics['projection']['daily_pace'] == 0.0
+    assert analytics['projection']['month_to_date'] == 0.0
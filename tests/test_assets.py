@@ -0,0 +1,29 @@
+# Content-hashed static assets with precompressed copies
+import gzip
+import re
+
+import pytest
+
+@pytest.fixture
+def assets(client):
+    page = client.get('/').get_data(as_text=True)
+    return {extension: re.search(rf'/assets/(app\.[0-9a-f]{{12}}\.{extension})"', page).group(1)
+            for extension in ('css', 'js')}
+
+def test_page_links_hashed_assets_that_never_expire(client, assets):
+    for name in assets.values():
+        response = client.get(f'/assets/{name}')
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert 'Accept-Encoding' in response.headers['Vary']
+
+def test_precompressed_copy_is_served_when_accepted(client, assets):
+    plain = client.get(f"/assets/{assets['css']}").data
+    response = client.get(f"/assets/{assets['css']}", headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.data) == plain
+
+def test_unknown_assets_are_not_found(client):
+    assert client.get('/assets/app.000000000000.css').status_code == 404
+    assert client.get('/assets/..%2Fhabit-app.py').status_code == 404
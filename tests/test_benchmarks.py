@@ -0,0 +1,23 @@
+# The load test, run small: every route it drives must answer without errors
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import APP_PATH
+
+RUN_PY = os.path.join(os.path.dirname(APP_PATH), 'benchmarks', 'run.py')
+
+@pytest.mark.parametrize('mode', ['client', 'server'])
+def test_every_route_runs_without_errors(tmp_path, mode):
+    output = tmp_path / 'results.json'
+    subprocess.run([sys.executable, RUN_PY, '--habits', '5', '--bounties', '40', '--transactions', '500',
+                    '--days', '30', '--requests', '10', '--concurrency', '2', '--mode', mode,
+                    '--output', str(output)],
+                   cwd=tmp_path, check=True, capture_output=True, timeout=300)
+    
+    routes = json.loads(output.read_text())['routes']
+    assert len(routes) > 20
+    assert {name: result['errors'] for name, result in routes.items() if result['errors']} == {}
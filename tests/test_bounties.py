@@ -0,0 +1,56 @@
+# Completing one bounty from many requests at once pays it exactly once
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+REQUESTS = 32
+
+# Post to /complete_bounty/1 from REQUESTS threads at once, each with its own
+# client. Returns the (status, body) of each.
+def complete_at_once(app, headers):
+    barrier = threading.Barrier(REQUESTS)
+    
+    def complete(_):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/complete_bounty/1', headers=headers)
+        return response.status_code, response.get_json()
+    
+    with ThreadPoolExecutor(max_workers=REQUESTS) as executor:
+        return list(executor.map(complete, range(REQUESTS)))
+
+@pytest.fixture
+def bounty_app(make_app):
+    app = make_app()
+    response = app.test_client().post('/add_bounty', headers=JSON, data={'description': 'Fix the bike', 'amount': '25'})
+    assert response.get_json()['bounty']['id'] == 1
+    return app
+
+# (payout rows for the bounty, balance)
+def payouts(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    try:
+        rows = conn.execute('SELECT COUNT(*) FROM transactions WHERE bounty_id = 1').fetchone()[0]
+    finally:
+        conn.close()
+    return rows, app.test_client().get('/api/sync').get_json()['balance']
+
+def test_parallel_completions_pay_once(bounty_app):
+    results = complete_at_once(bounty_app, JSON)
+    statuses = sorted(status for status, body in results)
+    assert statuses == [200] + [409] * (REQUESTS - 1)
+    
+    rows, balance = payouts(bounty_app)
+    assert rows == 1 and balance == 25.0
+
+def test_parallel_completions_with_one_key_are_replayed(bounty_app):
+    results = complete_at_once(bounty_app, {**JSON, 'Idempotency-Key': 'bike-1'})
+    assert all(status == 200 for status, body in results)
+    assert sorted(body['replayed'] for status, body in results) == [False] + [True] * (REQUESTS - 1)
+    assert len({body['transaction_id'] for status, body in results}) == 1
+    
+    rows, balance = payouts(bounty_app)
+    assert rows == 1 and balance == 25.0
@@ -0,0 +1,50 @@
+# Bulk import over HTTP and from the command line
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+BODIES = {
+    'json': ('application/json', '[{"habit_id": 1}, {"habit_id": 1, "quantity": 3, "amount": 1.5, "date": "2024-01-02"}]'),
+    'ndjson': ('application/x-ndjson', '{"habit_id": 1}\n\n{"habit_id": 1, "quantity": 3, "amount": 1.5, "date": "2024-01-02"}\n'),
+    'csv': ('text/csv', 'habit_id,quantity,amount,date\n1,,,\n1,3,1.5,2024-01-02\n'),
+}
+
+@pytest.fixture
+def client(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    return client
+
+def history(client):
+    return client.get('/api/transactions').get_json()['transactions']
+
+@pytest.mark.parametrize('fmt', BODIES)
+def test_each_format_imports_with_defaults(habit_app, app, client, fmt):
+    content_type, body = BODIES[fmt]
+    result = client.post('/api/transactions/bulk', data=body, content_type=content_type).get_json()
+    assert result == {'status': 'success', 'inserted': 2, 'failed': 0, 'errors': []}
+    
+    with app.app_context():
+        today = habit_app.local_today().isoformat()
+    rows = sorted((row['date'], row['quantity'], row['amount']) for row in history(client))
+    assert rows == [('2024-01-02', 3, 1.5), (today, 1, 2.0)]
+    assert client.get('/api/sync').get_json()['balance'] == 6.5
+
+def test_bad_rows_are_skipped_across_chunks(make_app):
+    client = make_app(BULK_CHUNK_SIZE=2).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    body = 'habit_id,quantity\n1,1\n1,1\n7,1\n1,x\n1,1\n'
+    result = client.post('/api/transactions/bulk?format=csv', data=body).get_json()
+    assert (result['status'], result['inserted'], result['failed']) == ('partial', 3, 2)
+    assert [error['row'] for error in result['errors']] == [3, 4]
+    assert len(history(client)) == 3
+
+def test_unknown_format_is_refused(client):
+    assert client.post('/api/transactions/bulk', data='habit_id\n1\n', content_type='text/plain').status_code == 415
+
+def test_import_from_the_command_line(app, client, tmp_path):
+    path = tmp_path / 'history.jsonl'
+    path.write_text(BODIES['ndjson'][1] + '{"habit_id": 9}\n')
+    result = app.test_cli_runner().invoke(args=['import-transactions', str(path)])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 2 transactions, 1 rows failed.' in result.output
+    assert len(history(client)) == 2
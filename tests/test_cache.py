@@ -0,0 +1,57 @@
+import sqlite3
+
+# Writes from another process: a raw connection stands in for a second
+# server or a `flask` command
+def test_write_from_another_connection_invalidates_cached_page(habit_app, app, client):
+    client.post('/add_habit', data={'description': 'Run', 'amount': '2'})
+    client.get('/')  # Shows the flash message, which isn't cached
+    etag = client.get('/').headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute("INSERT INTO transactions (habit_id, amount, quantity, date) VALUES (1, 5.0, 1, '2024-01-01')")
+    conn.commit()
+    conn.close()
+    
+    second = client.get('/', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+    assert b'5.00' in second.data
+
+def test_ledger_rebuild_invalidates_cached_page(habit_app, app, client):
+    client.get('/')
+    etag = client.get('/').headers['ETag']
+    
+    with app.app_context():
+        conn = habit_app.open_connection(app.config['DATABASE'])
+        habit_app.rebuild_ledger_summary(conn)
+        conn.commit()
+        conn.close()
+    
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+
+def test_write_through_the_app_invalidates_cached_page(client):
+    etag = client.get('/').headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    
+    client.post('/add_habit', headers={'Accept': 'application/json'}, data={'description': 'Run', 'amount': '2'})
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and b'Run' in response.data
+
+def test_page_with_a_flash_message_is_not_kept(client):
+    client.post('/add_habit', data={'description': 'Run', 'amount': '2'})
+    response = client.get('/')
+    assert b'Habit added' in response.data
+    assert response.headers['Cache-Control'] == 'no-store' and 'ETag' not in response.headers
+    
+    response = client.get('/')
+    assert b'Habit added' not in response.data and 'ETag' in response.headers
+
+def test_gzipped_page_has_an_etag_of_its_own(make_app):
+    client = make_app(COMPRESS_MIN_SIZE=0).test_client()
+    plain = client.get('/').headers['ETag']
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    gzipped = response.headers['ETag']
+    assert gzipped != plain
+    assert client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped}).status_code == 304
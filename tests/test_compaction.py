@@ -0,0 +1,62 @@
+# Ledger compaction: old transactions fold into monthly totals without
+# changing what the app reports
+import sqlite3
+from datetime import date
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+TODAY = date(2024, 6, 15)
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    app = make_app(ARCHIVE_DB=str(tmp_path / 'archive.db'))
+    client = app.test_client()
+    for description, amount in (('Run', '2'), ('Swim', '3')):
+        client.post('/add_habit', headers=JSON, data={'description': description, 'amount': amount})
+    client.post('/api/transactions/bulk', json=[
+        {'habit_id': 1, 'date': '2023-01-10'}, {'habit_id': 1, 'date': '2023-01-11', 'quantity': 2},
+        {'habit_id': 2, 'date': '2023-02-01'}, {'habit_id': 1, 'date': '2024-06-01'},
+        {'habit_id': 2, 'date': '2024-06-14'},
+    ])
+    return app
+
+def compact(habit_app, app, horizon_days):
+    with app.app_context():
+        conn = habit_app.open_connection(app.config['DATABASE'])
+        try:
+            return habit_app.compact_ledger(conn, horizon_days, app.config['ARCHIVE_DB'], today=TODAY)
+        finally:
+            conn.close()
+
+def report(client):
+    return (client.get('/api/sync').get_json()['balance'],
+            client.get('/api/stats/daily').get_json(),
+            client.get('/api/streaks').get_json())
+
+def test_compaction_leaves_the_totals_alone(habit_app, app):
+    client = app.test_client()
+    before = report(client)
+    assert compact(habit_app, app, 365) == (3, '2023-06-01')
+    assert report(client) == before
+    
+    runner = app.test_cli_runner()
+    assert 'Ledger summary is consistent.' in runner.invoke(args=['ledger-check']).output
+    runner.invoke(args=['rollups-backfill'])
+    assert report(client) == before
+
+def test_compacted_rows_move_to_the_archive(habit_app, app):
+    compact(habit_app, app, 365)
+    client = app.test_client()
+    live = client.get('/api/transactions').get_json()['transactions']
+    both = client.get('/api/transactions?include_archive=1').get_json()['transactions']
+    assert [row['date'] for row in live] == ['2024-06-14', '2024-06-01']
+    assert len(both) == 5
+    
+    conn = sqlite3.connect(app.config['ARCHIVE_DB'])
+    assert conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == 3
+    conn.close()
+
+def test_horizon_never_moves_back(habit_app, app):
+    compact(habit_app, app, 365)
+    assert compact(habit_app, app, 1000) == (0, '2023-06-01')
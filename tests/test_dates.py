@@ -0,0 +1,43 @@
+# Date range queries must stay index range scans: transactions filter on the
+# integer day, the rollups on their zero-padded 'YYYY-MM-DD' text day
+import pytest
+
+def query_plans(conn, run):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        run()
+    finally:
+        conn.set_trace_callback(None)
+    return [' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}'))
+            for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+@pytest.fixture
+def conn(habit_app, app):
+    with app.app_context():
+        habit_app.ensure_db_initialized(app.config['DATABASE'])
+        conn = habit_app.open_connection(app.config['DATABASE'])
+        conn.executemany('INSERT INTO habits (description, amount) VALUES (?, 1)', [('Run',), ('Swim',)])
+        habit_app.record_transactions(conn, [(habit_id, 1.0, 1, f'2024-{month:02d}-{day:02d}', None, None)
+                                             for habit_id in (1, 2) for month in range(1, 13) for day in range(1, 29)])
+        conn.commit()
+        conn.execute('ANALYZE')
+        yield conn
+        conn.close()
+
+@pytest.mark.parametrize('habit_id, search', [
+    (None, 'USING INDEX idx_daily_rollups_day (day>? AND day<?)'),
+    (1, 'USING INDEX sqlite_autoindex_daily_rollups_1 (habit_id=? AND day>? AND day<?)'),
+])
+def test_rollup_range_uses_an_index(habit_app, conn, habit_id, search):
+    rows = []
+    plans = query_plans(conn, lambda: rows.extend(
+        habit_app.get_daily_stats(conn, habit_id, '2024-03-01', '2024-03-07')))
+    assert len(rows) == 7
+    assert search in plans[0], plans
+
+def test_transaction_range_uses_the_day_index(habit_app, app, conn):
+    with app.test_request_context('/api/transactions?start=2024-03-01&end=2024-03-07'):
+        clauses, params = habit_app.parse_history_filters(habit_app.request.args)
+        plans = query_plans(conn, lambda: habit_app.get_transaction_page(conn, clauses, params, limit=50))
+    assert any('USING INDEX idx_transactions_day (day>? AND day<?)' in plan for plan in plans), plans
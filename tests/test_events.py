@@ -0,0 +1,71 @@
+import json
+import re
+import sqlite3
+
+JSON = {'Accept': 'application/json'}
+
+def test_watcher_keeps_going_after_a_failed_poll(habit_app, app, monkeypatch):
+    with app.app_context():
+        broadcaster = habit_app.EventBroadcaster(app, 10, 0.01)
+    
+    # The first poll fails, as with a locked database
+    version = habit_app.EventBroadcaster._version
+    failures = [sqlite3.OperationalError('database is locked')]
+    def flaky_version(self):
+        if failures:
+            raise failures.pop()
+        return version(self)
+    monkeypatch.setattr(habit_app.EventBroadcaster, '_version', flaky_version)
+    
+    subscription = broadcaster.subscribe()
+    try:
+        conn = sqlite3.connect(app.config['DATABASE'])
+        conn.execute("INSERT INTO habits (description, amount) VALUES ('Run', 2)")
+        conn.commit()
+        conn.close()
+        assert subscription.queue.get(timeout=5).startswith('event: refresh')
+        assert not failures
+    finally:
+        broadcaster.close()
+
+# The next `count` events on an /events stream, as (event, data) pairs
+def read_events(chunks, count):
+    events = []
+    for chunk in chunks:
+        chunk = chunk.decode()
+        if 'event: ' in chunk:
+            event, data = re.search(r'event: (\w+)\ndata: (.*)\n', chunk).groups()
+            events.append((event, json.loads(data)))
+            if len(events) == count:
+                return events
+    return events
+
+def test_writes_are_pushed_to_open_streams(make_app):
+    app = make_app(EVENTS_KEEPALIVE=0.05, EVENTS_WATCH_INTERVAL=60)
+    client = app.test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    
+    response = app.test_client().get('/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    try:
+        assert read_events(chunks, 1) == [('balance', {'balance': 0})]
+        
+        client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '2', 'quantity': '3'})
+        (transaction_event, transaction), balance = read_events(chunks, 2)
+        assert transaction_event == 'transaction'
+        assert (transaction['habit_id'], transaction['total_amount'], transaction['current_streak']) == (1, 6.0, 1)
+        assert balance == ('balance', {'balance': 6.0})
+    finally:
+        response.close()
+
+def test_a_client_that_falls_behind_is_dropped(habit_app, app):
+    with app.app_context():
+        broadcaster = habit_app.EventBroadcaster(app, 2, 60)
+    subscription = broadcaster.subscribe()
+    try:
+        for n in range(3):
+            broadcaster.publish('balance', {'balance': n})
+        assert subscription.dropped and not broadcaster.has_subscribers()
+    finally:
+        broadcaster.close()
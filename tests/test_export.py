@@ -0,0 +1,42 @@
+# Streamed export of the transaction history
+import csv
+import io
+import json
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.fixture
+def client(make_app):
+    client = make_app(EXPORT_BATCH_SIZE=2).test_client()
+    for description in ('Run', 'Swim'):
+        client.post('/add_habit', headers=JSON, data={'description': description, 'amount': '2'})
+    records = [{'habit_id': 1 + day % 2, 'date': f'2024-01-{day:02d}'} for day in range(1, 6)]
+    client.post('/api/transactions/bulk', json=records)
+    client.post('/add_bounty', headers=JSON, data={'description': 'Fix the bike', 'amount': '10'})
+    client.post('/complete_bounty/1', headers=JSON)
+    return client
+
+def test_csv_export_streams_every_row_in_order(client):
+    response = client.get('/export/transactions.csv')
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename=transactions.csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [int(row['id']) for row in rows] == [1, 2, 3, 4, 5, 6]
+    assert rows[0]['date'] == '2024-01-01' and rows[0]['total_amount'] == '2.0'
+
+@pytest.mark.parametrize('query, ids', [
+    ('start=2024-01-02&end=2024-01-04', [2, 3, 4]),
+    ('habit_id=1', [2, 4]),
+    ('bounties=1', [6]),
+])
+def test_ndjson_export_applies_the_filters(client, query, ids):
+    response = client.get(f'/export/transactions.ndjson?{query}')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['id'] for row in rows] == ids
+
+def test_bad_export_requests(client):
+    assert client.get('/export/transactions.xml').status_code == 404
+    assert client.get('/export/transactions.csv?start=yesterday').status_code == 400
@@ -0,0 +1,37 @@
+# Keyset-paginated transaction history
+JSON = {'Accept': 'application/json'}
+
+def test_pages_walk_the_history_newest_first(make_app):
+    client = make_app(HISTORY_MAX_PAGE_SIZE=3).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    client.post('/api/transactions/bulk', json=[{'habit_id': 1}] * 7)
+    
+    pages, before = [], None
+    while True:
+        url = '/api/transactions?limit=50' + (f'&before={before}' if before else '')
+        page = client.get(url).get_json()
+        pages.append([row['id'] for row in page['transactions']])
+        before = page['next_cursor']
+        if before is None:
+            break
+    # limit is capped at HISTORY_MAX_PAGE_SIZE
+    assert pages == [[7, 6, 5], [4, 3, 2], [1]]
+
+def test_a_page_that_ends_exactly_at_the_start_has_no_cursor(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    client.post('/api/transactions/bulk', json=[{'habit_id': 1}] * 2)
+    page = client.get('/api/transactions?limit=2').get_json()
+    assert len(page['transactions']) == 2 and page['next_cursor'] is None
+
+def test_new_rows_dont_shift_later_pages(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    client.post('/api/transactions/bulk', json=[{'habit_id': 1}] * 4)
+    first = client.get('/api/transactions?limit=2').get_json()
+    client.post('/api/transactions/bulk', json=[{'habit_id': 1}] * 3)
+    second = client.get(f"/api/transactions?limit=2&before={first['next_cursor']}").get_json()
+    assert [row['id'] for row in second['transactions']] == [2, 1]
+
+def test_bad_cursor_is_refused(client):
+    assert client.get('/api/transactions?before=abc').status_code == 400
+    assert client.get(f'/api/transactions?before={2 ** 64}').status_code == 400
+    assert client.get('/api/transactions?limit=ten').status_code == 400
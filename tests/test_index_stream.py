@@ -0,0 +1,43 @@
+# The home page streamed from cursors once the lists get long
+import gzip
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.fixture
+def populate():
+    def populate(client, habits=30, bounties=20):
+        for n in range(habits):
+            client.post('/add_habit', headers=JSON, data={'description': f'Habit {n}', 'amount': '1'})
+        for n in range(bounties):
+            client.post('/add_bounty', headers=JSON, data={'description': f'Bounty {n}', 'amount': '5'})
+        client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '1'})
+    return populate
+
+def test_streamed_page_matches_the_rendered_one(make_app, populate):
+    # Both apps use the same database file
+    whole = make_app()
+    streamed = make_app(INDEX_STREAM_ROWS=10, INDEX_STREAM_CHUNK_KB=1)
+    populate(whole.test_client())
+    
+    expected = whole.test_client().get('/')
+    response = streamed.test_client().get('/', buffered=False)
+    assert 'Content-Length' in expected.headers and 'Content-Length' not in response.headers
+    chunks = list(response.response)
+    response.close()
+    assert len(chunks) > 2
+    assert b''.join(chunks) == expected.data
+    assert b'Habit 29' in expected.data and b'Bounty 19' in expected.data
+
+def test_streamed_page_is_gzipped_and_keeps_its_etag(make_app, populate):
+    app = make_app(INDEX_STREAM_ROWS=10)
+    client = app.test_client()
+    populate(client)
+    plain = client.get('/').data
+    
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain
+    etag = response.headers['ETag']
+    assert client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
@@ -0,0 +1,43 @@
+# The running balance kept in ledger_summary, and ledger-check
+import sqlite3
+
+JSON = {'Accept': 'application/json'}
+
+def balance(client):
+    return client.get('/api/sync').get_json()['balance']
+
+def test_balance_follows_every_kind_of_write(habit_app, app, client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '2', 'quantity': '3'})
+    assert balance(client) == 6.0
+    
+    client.post('/add_bounty', headers=JSON, data={'description': 'Fix the bike', 'amount': '10'})
+    client.post('/complete_bounty/1', headers=JSON)
+    assert balance(client) == 16.0
+    
+    client.post('/api/transactions/bulk', json=[{'habit_id': 1}, {'habit_id': 1, 'amount': 1.5, 'quantity': 2}])
+    client.post('/api/sync', json={'operations': [{'key': 'k1', 'op': 'add_transaction', 'habit_id': 1}]})
+    assert balance(client) == 23.0
+    
+    with app.app_context():
+        conn = habit_app.open_connection(app.config['DATABASE'])
+        assert habit_app.check_ledger_summary(conn) == []
+        conn.close()
+
+def test_ledger_check_reports_and_rebuilds_drift(app, client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '2'})
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute("UPDATE ledger_summary SET total = 5 WHERE scope = 'total'")
+    conn.commit()
+    conn.close()
+    runner = app.test_cli_runner()
+    
+    result = runner.invoke(args=['ledger-check'])
+    assert result.exit_code == 1
+    assert 'total 0: stored 5.00, ledger 2.00 (drift +3.00)' in result.output
+    
+    assert runner.invoke(args=['ledger-check', '--rebuild']).exit_code == 0
+    result = runner.invoke(args=['ledger-check'])
+    assert result.exit_code == 0 and 'Ledger summary is consistent.' in result.output
+    assert balance(client) == 2.0
@@ -0,0 +1,36 @@
+# Request and query instrumentation behind /metrics. The counters are kept per
+# process, so the tests compare before and after.
+import logging
+import re
+
+def sample(client, name, labels):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(rf'^{name}{{{re.escape(labels)}}} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+def test_requests_are_counted_by_route_and_status(client):
+    ok = 'route="habit_tracker.streaks",method="GET",status="200"'
+    bad = 'route="habit_tracker.transaction_history",method="GET",status="400"'
+    before = [sample(client, 'habit_tracker_request_duration_seconds_count', labels) for labels in (ok, bad)]
+    
+    client.get('/api/streaks')
+    client.get('/api/streaks')
+    client.get('/api/transactions?before=x')
+    
+    after = [sample(client, 'habit_tracker_request_duration_seconds_count', labels) for labels in (ok, bad)]
+    assert [a - b for a, b in zip(after, before)] == [2, 1]
+
+def test_statements_are_timed_unless_instrumentation_is_off(make_app):
+    labels = 'statement="SELECT 1 FROM bounties WHERE id = ? AND completed = 0"'
+    for instrumentation, expected in ((True, 1), (False, 0)):
+        client = make_app(INSTRUMENTATION=instrumentation).test_client()
+        before = sample(client, 'habit_tracker_sql_duration_seconds_count', labels)
+        client.post('/complete_bounty/1', headers={'Accept': 'application/json'})
+        assert sample(client, 'habit_tracker_sql_duration_seconds_count', labels) - before == expected
+
+def test_slow_queries_are_logged_with_their_plan(make_app, caplog):
+    client = make_app(SLOW_QUERY_MS=1e-9).test_client()
+    with caplog.at_level(logging.WARNING):
+        client.get('/api/transactions?habit_id=1')
+    messages = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Slow query')]
+    assert any('FROM transactions' in message and 'SEARCH' in message for message in messages), messages
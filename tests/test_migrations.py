@@ -0,0 +1,80 @@
+import sqlite3
+
+# The schema as it was before PRAGMA user_version tracked migrations
+BASELINE_SCHEMA = '''
+    CREATE TABLE habits (id INTEGER PRIMARY KEY, description TEXT, amount REAL);
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY,
+        habit_id INTEGER,
+        amount REAL,
+        quantity INTEGER DEFAULT 1,
+        date TEXT,
+        bounty_description TEXT DEFAULT NULL,
+        FOREIGN KEY (habit_id) REFERENCES habits (id)
+    );
+    CREATE TABLE bounties (
+        id INTEGER PRIMARY KEY,
+        description TEXT,
+        amount REAL,
+        date_created TEXT,
+        completed INTEGER DEFAULT 0
+    );
+'''
+
+def make_baseline_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO habits (description, amount) VALUES ('Run', 2.0)")
+    conn.executemany('INSERT INTO transactions (habit_id, amount, quantity, date) VALUES (?, ?, ?, ?)',
+                     [(1, 2.0, 1, '2024-01-01'), (None, 3.0, 1, '2024-01-02'), (1, 2.0, 2, None)])
+    conn.commit()
+    conn.close()
+
+def test_baseline_database_with_orphan_transactions_migrates(habit_app, make_app, tmp_path):
+    path = str(tmp_path / 'habits.db')
+    make_baseline_db(path)
+    app = make_app(DATABASE=path)
+    
+    with app.app_context():
+        habit_app.init_db(path)
+        conn = habit_app.open_connection(path)
+        assert habit_app.get_schema_version(conn) == len(habit_app.MIGRATIONS)
+        assert habit_app.get_balance(conn) == 9.0
+        assert habit_app.check_ledger_summary(conn) == []
+        conn.close()
+    
+    assert app.test_client().get('/').status_code == 200
+
+def schema(path):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+    finally:
+        conn.close()
+
+def test_migrating_in_steps_matches_a_fresh_database(habit_app, app, tmp_path):
+    fresh, stepped = str(tmp_path / 'fresh.db'), str(tmp_path / 'stepped.db')
+    with app.app_context():
+        habit_app.init_db(fresh)
+        
+        # A database left at version 3 by an older release
+        conn = habit_app.open_connection(stepped)
+        for number, migration in enumerate(habit_app.MIGRATIONS[:3], start=1):
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number:d}')
+        conn.commit()
+        conn.close()
+        habit_app.init_db(stepped)
+        habit_app.init_db(stepped)  # Already current, so a no-op
+        
+        conn = habit_app.open_connection(stepped)
+        assert habit_app.get_schema_version(conn) == len(habit_app.MIGRATIONS)
+        conn.close()
+    assert schema(stepped) == schema(fresh)
+
+def test_hot_indexes_exist(habit_app, app):
+    with app.app_context():
+        conn = habit_app.get_db_connection()
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_bounties_completed_id', 'idx_transactions_habit_id', 'idx_transactions_habit_day',
+            'idx_transactions_day', 'idx_daily_rollups_day'} <= indexes
@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+def test_changing_database_closes_the_old_pool(habit_app, app, tmp_path):
+    with app.app_context():
+        old_pool = habit_app.get_pool()
+        checked_out = old_pool.acquire()
+        idle = old_pool.acquire()
+        old_pool.release(idle)
+        
+        app.config['DATABASE'] = str(tmp_path / 'other.db')
+        assert habit_app.get_pool() is not old_pool
+        assert old_pool.closed
+        with pytest.raises(sqlite3.ProgrammingError):
+            idle.execute('SELECT 1')
+        
+        # A connection that was checked out is closed once it's handed back
+        checked_out.execute('SELECT 1')
+        old_pool.release(checked_out)
+        with pytest.raises(sqlite3.ProgrammingError):
+            checked_out.execute('SELECT 1')
+
+def test_connections_are_reused_between_app_contexts(habit_app, app):
+    with app.app_context():
+        first = habit_app.get_db_connection()
+    with app.app_context():
+        assert habit_app.get_db_connection() is first
+
+def test_connections_open_in_wal_mode_with_the_configured_pragmas(habit_app, make_app):
+    app = make_app(DB_BUSY_TIMEOUT_MS=1234, DB_CACHE_SIZE_KB=4096)
+    with app.app_context():
+        conn = habit_app.get_db_connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 1234
+        assert conn.execute('PRAGMA cache_size').fetchone()[0] == -4096
+
+def test_a_connection_is_returned_without_an_open_transaction(habit_app, app):
+    with app.app_context():
+        conn = habit_app.get_db_connection()
+        conn.execute("INSERT INTO habits (description, amount) VALUES ('Run', 2)")
+        assert conn.in_transaction
+    with app.app_context():
+        conn = habit_app.get_db_connection()
+        assert not conn.in_transaction
+        assert conn.execute('SELECT COUNT(*) FROM habits').fetchone()[0] == 0
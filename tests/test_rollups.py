@@ -0,0 +1,47 @@
+# The daily rollups behind /api/stats/daily, and rollups-backfill
+import sqlite3
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.fixture
+def client(client):
+    for description, amount in (('Run', '2'), ('Swim', '3')):
+        client.post('/add_habit', headers=JSON, data={'description': description, 'amount': amount})
+    client.post('/api/transactions/bulk', json=[
+        {'habit_id': 1, 'date': '2024-01-01'},
+        {'habit_id': 1, 'date': '2024-01-01', 'quantity': 2},
+        {'habit_id': 2, 'date': '2024-01-01'},
+        {'habit_id': 2, 'date': '2024-01-03'},
+    ])
+    return client
+
+def stats(client, query=''):
+    return client.get(f'/api/stats/daily?start=2024-01-01&end=2024-01-31{query}').get_json()
+
+def test_days_are_summed_across_habits(client):
+    result = stats(client)
+    assert [(day['day'], day['count'], day['quantity'], day['earned']) for day in result['days']] == [
+        ('2024-01-01', 3, 4, 9.0),
+        ('2024-01-03', 1, 1, 3.0),
+    ]
+    assert (result['total_earned'], result['completions'], result['best_day']) == (12.0, 4, '2024-01-01')
+
+def test_one_habit(client):
+    result = stats(client, '&habit_id=1')
+    assert [(day['day'], day['earned']) for day in result['days']] == [('2024-01-01', 6.0)]
+    assert client.get('/api/stats/daily?habit_id=one').status_code == 400
+
+def test_backfill_rebuilds_lost_rollups(app, client):
+    before = stats(client)
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute('DELETE FROM daily_rollups')
+    conn.commit()
+    conn.close()
+    assert stats(client)['days'] == []
+    
+    result = app.test_cli_runner().invoke(args=['rollups-backfill'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt 3 daily rollup rows' in result.output
+    assert stats(client) == before
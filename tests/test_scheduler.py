@@ -0,0 +1,77 @@
+# The maintenance scheduler: cron schedules, job leases and the jobs commands
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+def at(text):
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc)
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    ('*/15 * * * *', '2024-03-05 10:07:30', '2024-03-05 10:15'),
+    ('*/15 * * * *', '2024-03-05 10:15:00', '2024-03-05 10:30'),
+    ('30 3 * * *', '2024-03-05 03:30:00', '2024-03-06 03:30'),
+    ('45 4 1 * *', '2024-12-15 00:00:00', '2025-01-01 04:45'),
+    ('15 4 * * 0', '2024-03-05 00:00:00', '2024-03-10 04:15'),  # Sunday
+    ('0 0 29 2 *', '2024-03-01 00:00:00', '2028-02-29 00:00'),
+    ('0 0 13 * 5', '2024-03-05 00:00:00', '2024-03-08 00:00'),  # The 13th or a Friday
+])
+def test_next_run(habit_app, expression, moment, expected):
+    assert habit_app.CronSchedule(expression).next_after(at(moment)) == at(expected)
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* * 0 * *', '*/0 * * * *', 'a * * * *', '0 0 31 2 *'])
+def test_bad_schedules_are_refused(habit_app, expression):
+    with pytest.raises(ValueError):
+        habit_app.CronSchedule(expression).next_after(at('2024-01-01 00:00:00'))
+
+def test_a_leased_job_is_not_claimed_twice(habit_app, app):
+    with app.app_context():
+        conn = habit_app.open_jobs_db()
+        schedules = habit_app.job_schedules('')
+        habit_app.register_jobs(conn, schedules, 0)
+        now = time.time()
+        
+        assert habit_app.claim_job(conn, 'a', 60, now, 'analyze') == 'analyze'
+        assert habit_app.claim_job(conn, 'b', 60, now, 'analyze') is None
+        # A worker that died leaves its lease to expire
+        assert habit_app.claim_job(conn, 'b', 60, now + 61, 'analyze') == 'analyze'
+        conn.close()
+
+def test_scheduler_runs_due_jobs_off_the_request_path(habit_app, make_app):
+    app = make_app(SCHEDULER=True, SCHEDULER_TICK=0.05, JOB_SCHEDULES='wal_checkpoint=off')
+    with app.app_context():
+        conn = habit_app.open_jobs_db()
+        habit_app.register_jobs(conn, habit_app.job_schedules(app.config['JOB_SCHEDULES']), time.time())
+        conn.execute("UPDATE scheduled_jobs SET next_run = 0 WHERE name = 'analyze'")
+        conn.commit()
+        conn.close()
+    
+    client = app.test_client()
+    client.get('/readyz')  # Starts the scheduler
+    try:
+        for _ in range(100):
+            jobs = {job['name']: job for job in client.get('/api/jobs').get_json()['jobs']}
+            if jobs['analyze']['runs']:
+                break
+            time.sleep(0.05)
+        assert (jobs['analyze']['runs'], jobs['analyze']['last_status']) == (1, 'ok')
+        assert jobs['analyze']['next_run'] > datetime.now(timezone.utc).isoformat()
+        assert not jobs['wal_checkpoint']['enabled'] and jobs['wal_checkpoint']['runs'] == 0
+    finally:
+        app.extensions['habit_scheduler'].close()
+
+def test_jobs_run_repairs_a_drifted_ledger(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    runner = app.test_cli_runner()
+    runner.invoke(args=['jobs', 'list'])  # Creates the database and registers the jobs
+    conn.execute("UPDATE ledger_summary SET total = 5 WHERE scope = 'total'")
+    conn.commit()
+    
+    result = runner.invoke(args=['jobs', 'run', 'ledger_check'])
+    assert result.exit_code == 0, result.output
+    assert conn.execute("SELECT total FROM ledger_summary WHERE scope = 'total'").fetchone()[0] == 0
+    conn.close()
+    
+    listing = runner.invoke(args=['jobs', 'list']).output
+    assert ' ok ' in next(line for line in listing.splitlines() if line.startswith('ledger_check'))
@@ -0,0 +1,46 @@
+# Full-text search over habits, bounties and bounty payouts
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.fixture
+def client(client):
+    for description in ('Morning meditation', 'Evening run', 'Meditate before bed'):
+        client.post('/add_habit', headers=JSON, data={'description': description, 'amount': '1'})
+    for description in ('Clean the garage', 'Garden weeding'):
+        client.post('/add_bounty', headers=JSON, data={'description': description, 'amount': '5'})
+    client.post('/complete_bounty/1', headers=JSON)
+    return client
+
+def search(client, query):
+    response = client.get(f'/api/search?{query}')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def found(client, query):
+    return sorted((row['entity'], row['id']) for row in search(client, query)['results'])
+
+def test_every_word_matches_as_a_prefix(client):
+    assert found(client, 'q=med+mor') == [('habit', 1)]
+    assert found(client, 'q=medit') == [('habit', 1), ('habit', 3)]
+    assert found(client, 'q=gar') == [('bounty', 1), ('bounty', 2), ('transaction', 1)]
+
+def test_type_limits_the_entities(client):
+    assert found(client, 'q=gar&type=transaction') == [('transaction', 1)]
+    assert found(client, 'q=gar&type=habit,bounty') == [('bounty', 1), ('bounty', 2)]
+    assert client.get('/api/search?q=gar&type=user').status_code == 400
+
+def test_pages_follow_the_cursor(client):
+    first = search(client, 'q=gar&limit=2')
+    second = search(client, f"q=gar&limit=2&after={first['next_cursor']}")
+    assert len(first['results']) == 2 and second['next_cursor'] is None
+    assert len({(row['entity'], row['id']) for row in first['results'] + second['results']}) == 3
+
+def test_search_syntax_in_the_query_is_taken_literally(client):
+    assert found(client, 'q=%22run%22+OR+NEAR(') == []
+    assert found(client, 'q=run%22*') == [('habit', 2)]
+    assert client.get('/api/search?q=%2B%2B').status_code == 400
+
+def test_deleted_bounties_leave_the_index(client):
+    client.post('/api/sync', json={'operations': [{'key': 'd', 'op': 'delete_bounty', 'bounty_id': 2}]})
+    assert found(client, 'q=garden') == []
@@ -0,0 +1,62 @@
+# The gunicorn entry point, run for real in a subprocess
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from conftest import APP_PATH
+
+pytest.importorskip('gunicorn')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def server(tmp_path):
+    port = free_port()
+    env = dict(os.environ, HABIT_TRACKER_DB=str(tmp_path / 'habits.db'), HABIT_TRACKER_SCHEDULER='0')
+    process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', APP_PATH, 'serve',
+                                '--bind', f'127.0.0.1:{port}', '--workers', '2', '--threads', '2',
+                                '--pid', str(tmp_path / 'server.pid')],
+                               cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        for _ in range(100):
+            try:
+                with urllib.request.urlopen(f'{base}/readyz') as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            pytest.fail('The server never became ready')
+        yield base, process
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+def test_serve_runs_workers_that_share_the_database(server, tmp_path):
+    base, process = server
+    assert int((tmp_path / 'server.pid').read_text()) == process.pid
+    
+    request = urllib.request.Request(f'{base}/add_habit', data=b'description=Run&amount=2',
+                                     headers={'Accept': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        assert json.load(response)['status'] == 'success'
+    # Whichever worker answers reads the same database
+    for _ in range(4):
+        with urllib.request.urlopen(f'{base}/api/streaks') as response:
+            assert [habit['description'] for habit in json.load(response)['streaks']] == ['Run']
+
+def test_serve_stops_cleanly_on_sigterm(server):
+    base, process = server
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=30) == 0
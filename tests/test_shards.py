@@ -0,0 +1,114 @@
+# Multi-tenant mode's shard cache and session cookie
+import pytest
+
+def test_referenced_shard_is_never_evicted(habit_app, tmp_path):
+    cache = habit_app.ShardCache(1, 300, 1)
+    first = cache.get(str(tmp_path / 'user-1.db'))
+    second = cache.get(str(tmp_path / 'user-2.db'))
+    assert len(cache) == 2
+    assert not first.extensions['habit_db_pool'].closed
+    
+    cache.release(first)
+    cache.release(second)
+    cache.get(str(tmp_path / 'user-3.db'))
+    assert len(cache) == 1
+    assert first.extensions['habit_db_pool'].closed and second.extensions['habit_db_pool'].closed
+
+def test_evicted_shard_is_forgotten(habit_app, make_app, tmp_path):
+    path = str(tmp_path / 'user-1.db')
+    with make_app().app_context():
+        habit_app.ensure_db_initialized(path)
+    with habit_app._write_locks[path]:
+        pass
+    assert path in habit_app._initialized_databases and path in habit_app._write_locks
+    
+    cache = habit_app.ShardCache(1, 300, 1)
+    cache.release(cache.get(path))
+    cache.get(str(tmp_path / 'user-2.db'))
+    assert path not in habit_app._initialized_databases and path not in habit_app._write_locks
+
+def test_session_cookie_is_http_only_and_same_site(client):
+    response = client.post('/add_habit', data={'description': 'Run', 'amount': '2'})
+    cookie = response.headers['Set-Cookie']
+    assert 'HttpOnly' in cookie and 'SameSite=Lax' in cookie and 'Secure' not in cookie
+
+# A multi-tenant app with two accounts, alice and bob, each with one habit
+@pytest.fixture
+def tenants(make_app, tmp_path):
+    app = make_app(MULTI_TENANT=True, SECRET_KEY='test-secret', ACCOUNTS_DB=str(tmp_path / 'accounts.db'),
+                   SHARD_DIR=str(tmp_path / 'shards'), ARCHIVE_DB=str(tmp_path / 'archive.db'))
+    for username in ('alice', 'bob'):
+        client = app.test_client()
+        assert client.post('/register', data={'username': username, 'password': 'correct horse'},
+                           headers={'Accept': 'application/json'}).status_code == 200
+        client.post('/add_habit', data={'description': 'Run', 'amount': '2'})
+    return app
+
+def test_import_needs_a_user_in_multi_tenant_mode(tenants, tmp_path):
+    path = tmp_path / 'history.csv'
+    path.write_text('habit_id,quantity,date\n1,1,2020-01-05\n1,2,2020-01-06\n')
+    runner = tenants.test_cli_runner()
+    
+    result = runner.invoke(args=['import-transactions', str(path)])
+    assert result.exit_code == 2 and '--user' in result.output
+    
+    result = runner.invoke(args=['import-transactions', '--user', 'alice', str(path)])
+    assert result.exit_code == 0, result.output
+    assert 'alice (user-1.db): Imported 2 transactions, 0 rows failed.' in result.output
+    
+    result = runner.invoke(args=['import-transactions', '--user', 'nobody', str(path)])
+    assert result.exit_code == 1 and 'No such account: nobody' in result.output
+
+def test_maintenance_commands_work_on_every_shard(tenants, tmp_path):
+    path = tmp_path / 'history.csv'
+    path.write_text('habit_id,quantity,date\n1,1,2020-01-05\n1,1,2020-01-06\n')
+    runner = tenants.test_cli_runner()
+    for username in ('alice', 'bob'):
+        assert runner.invoke(args=['import-transactions', '--user', username, str(path)]).exit_code == 0
+    
+    result = runner.invoke(args=['ledger-check'])
+    assert result.exit_code == 0, result.output
+    assert result.output.count('Ledger summary is consistent.') == 2
+    
+    result = runner.invoke(args=['rollups-backfill', '--user', 'bob'])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith('bob (user-2.db): Rebuilt') and 'alice' not in result.output
+    
+    result = runner.invoke(args=['compact-ledger', '--horizon-days', '30'])
+    assert result.exit_code == 0, result.output
+    # The newest row always stays
+    assert result.output.count('Compacted 1 transactions') == 2
+    # Each shard archives to a file of its own
+    assert (tmp_path / 'archive-user-1.db').exists() and (tmp_path / 'archive-user-2.db').exists()
+    assert not (tmp_path / 'archive.db').exists()
+
+@pytest.mark.parametrize('path', ['/metrics', '/api/jobs'])
+def test_operator_endpoints_need_the_token(tenants, path):
+    client = tenants.test_client()
+    assert client.get(path).status_code == 403
+    
+    tenants.config['OPERATOR_TOKEN'] = 'operator-secret'
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get(path, headers={'Authorization': 'Bearer operator-secret'}).status_code == 200
+    
+    # A signed-in account isn't enough either
+    client.post('/login', data={'username': 'alice', 'password': 'correct horse'})
+    assert client.get(path).status_code == 403
+
+def test_each_account_sees_only_its_own_shard(tenants):
+    alice, bob = tenants.test_client(), tenants.test_client()
+    for client, username in ((alice, 'alice'), (bob, 'bob')):
+        client.post('/login', data={'username': username, 'password': 'correct horse'})
+    alice.post('/add_transaction', headers={'Accept': 'application/json'}, data={'habit_id': '1', 'amount': '2'})
+    
+    assert alice.get('/api/sync').get_json()['balance'] == 2.0
+    assert bob.get('/api/sync').get_json()['balance'] == 0
+    assert len(bob.get('/api/transactions').get_json()['transactions']) == 0
+
+def test_signed_out_requests_are_turned_away(tenants):
+    client = tenants.test_client()
+    assert client.get('/api/sync').status_code == 401
+    assert client.get('/').status_code == 302
+    assert client.post('/login', data={'username': 'alice', 'password': 'wrong password'},
+                       headers={'Accept': 'application/json'}).status_code == 401
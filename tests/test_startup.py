@@ -0,0 +1,35 @@
+# The app factory: importing the module and creating an app touch neither
+# the disk nor the database, and bad settings fail at startup
+import os
+import subprocess
+import sys
+import zoneinfo
+
+import pytest
+
+from conftest import APP_PATH
+
+def test_import_and_create_app_write_nothing(tmp_path):
+    code = ('import importlib.util; '
+            f'spec = importlib.util.spec_from_file_location("habit_app", {APP_PATH!r}); '
+            'module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module); '
+            'app = module.create_app(); app.url_map')
+    env = dict(os.environ, HABIT_TRACKER_DB=str(tmp_path / 'habits.db'))
+    subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env, check=True, timeout=60)
+    assert os.listdir(tmp_path) == []
+
+def test_database_is_created_on_first_request(habit_app, tmp_path):
+    app = habit_app.create_app({'DATABASE': str(tmp_path / 'habits.db'), 'SCHEDULER': False})
+    assert not (tmp_path / 'habits.db').exists()
+    assert app.test_client().get('/readyz').status_code == 200
+    assert (tmp_path / 'habits.db').exists()
+
+@pytest.mark.parametrize('config, error', [
+    ({'TIMEZONE': 'Mars/Olympus_Mons'}, zoneinfo.ZoneInfoNotFoundError),
+    ({'JOB_SCHEDULES': 'analyze=every day'}, ValueError),
+    ({'JOB_SCHEDULES': 'no_such_job=off'}, ValueError),
+    ({'MULTI_TENANT': True}, RuntimeError),  # with the built-in secret key
+])
+def test_bad_settings_fail_at_startup(habit_app, config, error):
+    with pytest.raises(error):
+        habit_app.create_app(config)
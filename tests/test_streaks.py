@@ -0,0 +1,55 @@
+# Streaks, kept up to date as completions come in
+from datetime import timedelta
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.fixture
+def days_ago(habit_app, app):
+    with app.app_context():
+        today = habit_app.local_today()
+    return lambda n: (today - timedelta(days=n)).isoformat()
+
+def complete(client, habit_id, day):
+    client.post('/api/transactions/bulk', json=[{'habit_id': habit_id, 'date': day}])
+
+def streaks(client):
+    return {row['id']: (row['current_streak'], row['longest_streak'])
+            for row in client.get('/api/streaks').get_json()['streaks']}
+
+def test_consecutive_days_extend_the_streak(client, days_ago):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    for n in (2, 1, 1, 0):
+        complete(client, 1, days_ago(n))
+    assert streaks(client) == {1: (3, 3)}
+
+def test_backdated_completion_joins_two_runs(client, days_ago):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    for n in (4, 3, 1, 0):
+        complete(client, 1, days_ago(n))
+    assert streaks(client) == {1: (2, 2)}
+    complete(client, 1, days_ago(2))
+    assert streaks(client) == {1: (5, 5)}
+
+def test_a_lapsed_streak_keeps_its_longest(client, days_ago):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    for n in (5, 4, 3):
+        complete(client, 1, days_ago(n))
+    assert streaks(client) == {1: (0, 3)}
+    complete(client, 1, days_ago(0))
+    assert streaks(client) == {1: (1, 3)}
+
+def test_incremental_streaks_match_a_rebuild(habit_app, app, client, days_ago):
+    for description in ('Run', 'Swim'):
+        client.post('/add_habit', headers=JSON, data={'description': description, 'amount': '2'})
+    for habit_id, n in ((1, 9), (2, 3), (1, 8), (1, 6), (2, 0), (1, 7), (2, 1), (1, 1), (2, 2)):
+        complete(client, habit_id, days_ago(n))
+    incremental = streaks(client)
+    
+    with app.app_context():
+        conn = habit_app.open_connection(app.config['DATABASE'])
+        habit_app.rebuild_streaks(conn)
+        habit_app.commit_changes(conn)
+        conn.close()
+    assert streaks(client) == incremental == {1: (1, 4), 2: (4, 4)}
@@ -0,0 +1,76 @@
+import pytest
+
+def sync(client, *operations):
+    response = client.post('/api/sync', json={'operations': list(operations)})
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+@pytest.mark.parametrize('operation', [
+    {'op': ['add_habit']},
+    {'op': {'name': 'add_habit'}},
+    {'op': 'add_habit', 'description': ['Run'], 'amount': 2},
+    {'op': 'add_habit', 'description': 'Run', 'amount': [2]},
+    {'op': 'add_transaction', 'habit_id': [1]},
+    {'op': 'add_transaction', 'habit_id': 1, 'date': {'day': 1}},
+    {'op': 'add_transaction', 'habit_id': 1, 'date': ['2024-01-01']},
+    {'op': 'add_transaction', 'habit_id': 1, 'quantity': [1]},
+    {'op': 'add_transaction', 'habit_key': {'key': 'h'}},
+    {'op': 'complete_bounty', 'bounty_id': [1]},
+    {'op': 'complete_bounty', 'bounty_key': ['b']},
+    {'op': 'delete_bounty', 'bounty_id': {'id': 1}},
+    {'op': 'complete_bounty', 'bounty_id': 10 ** 30},
+    {'op': 'add_transaction', 'habit_id': str(10 ** 30)},
+    {'op': 'add_transaction', 'habit_id': 1, 'quantity': 10 ** 30},
+    {'op': 'add_bounty', 'description': 'Clean', 'amount': 'nan'},
+])
+def test_wrongly_typed_fields_are_rejected_per_operation(client, operation):
+    results = sync(client,
+                   {'key': 'habit', 'op': 'add_habit', 'description': 'Run', 'amount': 2},
+                   {'key': 'bounty', 'op': 'add_bounty', 'description': 'Clean', 'amount': 5},
+                   {'key': 'bad', **operation},
+                   {'key': 'done', 'op': 'add_transaction', 'habit_key': 'habit', 'date': '2024-01-01'})
+    assert [result['status'] for result in results] == ['applied', 'applied', 'error', 'applied']
+    
+    # The rejected key wasn't recorded, so a corrected operation can reuse it
+    fixed = sync(client, {'key': 'bad', 'op': 'complete_bounty', 'bounty_key': 'bounty'})
+    assert fixed[0]['status'] == 'applied'
+    assert client.get('/api/sync').get_json()['balance'] == 7.0
+
+# Every change after `since`, fetched `limit` at a time, as
+# ([(table, row id)], final cursor, pages)
+def pull(client, since=0, limit=2):
+    changes, pages = [], 0
+    while True:
+        page = client.get(f'/api/sync?since={since}&limit={limit}').get_json()
+        pages += 1
+        for table in ('habits', 'transactions', 'bounties', 'deleted'):
+            changes += [(table, row['id']) for row in page['changes'][table]]
+        since = page['cursor']
+        if not page['has_more']:
+            return changes, since, pages
+
+def test_pull_pages_through_changes_and_tombstones(client):
+    sync(client,
+         {'key': 'habit', 'op': 'add_habit', 'description': 'Run', 'amount': 2},
+         {'key': 't1', 'op': 'add_transaction', 'habit_key': 'habit', 'date': '2024-01-01'},
+         {'key': 'b1', 'op': 'add_bounty', 'description': 'Clean', 'amount': 5},
+         {'key': 'b2', 'op': 'add_bounty', 'description': 'Cook', 'amount': 4})
+    changes, cursor, pages = pull(client)
+    assert sorted(changes) == [('bounties', 1), ('bounties', 2), ('habits', 1), ('transactions', 1)]
+    assert pages == 2
+    
+    # Only what changed since the cursor comes back, deletions as tombstones
+    sync(client, {'key': 'c1', 'op': 'complete_bounty', 'bounty_key': 'b1'},
+         {'key': 'd2', 'op': 'delete_bounty', 'bounty_key': 'b2'})
+    changes, cursor, pages = pull(client, cursor)
+    assert sorted(changes) == [('bounties', 1), ('deleted', 2), ('transactions', 2)]
+    assert pull(client, cursor)[0] == []
+
+def test_a_resent_batch_is_answered_from_its_keys(client):
+    operations = [{'key': 'habit', 'op': 'add_habit', 'description': 'Run', 'amount': 2},
+                  {'key': 't1', 'op': 'add_transaction', 'habit_key': 'habit'}]
+    first = sync(client, *operations)
+    second = sync(client, *operations)
+    assert [result['status'] for result in second] == ['duplicate', 'duplicate']
+    assert [result['id'] for result in second] == [result['id'] for result in first]
+    assert client.get('/api/sync').get_json()['balance'] == 2.0
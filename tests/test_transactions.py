@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.mark.parametrize('write_behind', [False, True])
+def test_repeat_with_idempotency_key_is_replayed(make_app, write_behind):
+    client = make_app(WRITE_BEHIND=write_behind).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    headers = {**JSON, 'Idempotency-Key': 'phone-1'}
+    first = client.post('/add_transaction', headers=headers, data={'habit_id': '1', 'amount': '2'}).get_json()
+    second = client.post('/add_transaction', headers=headers, data={'habit_id': '1', 'amount': '2'}).get_json()
+    assert (first['replayed'], second['replayed']) == (False, True)
+    assert first['transaction_id'] == second['transaction_id']
+    assert client.get('/api/sync').get_json()['balance'] == 2.0
+
+def test_idempotency_key_of_another_request_is_refused(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    client.post('/api/sync', json={'operations': [{'key': 'k', 'op': 'add_habit', 'description': 'Swim', 'amount': 1}]})
+    response = client.post('/add_transaction', headers={**JSON, 'Idempotency-Key': 'k'}, data={'habit_id': '1', 'amount': '2'})
+    assert response.status_code == 422
+
+# The writer thread, held back from committing until the event is set
+@pytest.fixture
+def held_writer(habit_app, monkeypatch):
+    release = threading.Event()
+    commit = habit_app.GroupCommitWriter._commit
+    def held_commit(writer, conn, batch):
+        release.wait(5)
+        commit(writer, conn, batch)
+    monkeypatch.setattr(habit_app.GroupCommitWriter, '_commit', held_commit)
+    yield release
+    release.set()
+
+# A completion that isn't committed within the acknowledgement timeout gets
+# a 202 with a key. Retrying with it, even before the first commit lands,
+# never adds the completion twice.
+def test_ack_timeout_answers_202_with_a_key_to_retry_with(make_app, held_writer):
+    client = make_app(WRITE_BEHIND=True, WRITE_ACK_TIMEOUT=0.05).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    response = client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '2'})
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'pending'
+    key = response.get_json()['key']
+    
+    retry = {'headers': {**JSON, 'Idempotency-Key': key}, 'data': {'habit_id': '1', 'amount': '2'}}
+    still_pending = client.post('/add_transaction', **retry)
+    assert still_pending.status_code == 202 and still_pending.get_json()['key'] == key
+    
+    held_writer.set()
+    deadline = time.monotonic() + 5
+    while (response := client.post('/add_transaction', **retry)).status_code == 202 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert response.status_code == 200 and response.get_json()['replayed']
+    assert client.get('/api/sync').get_json()['balance'] == 2.0
+
+# One row that can't be written fails only its own request, not its group
+def test_bad_row_fails_only_its_own_request(habit_app, make_app, held_writer):
+    app = make_app(WRITE_BEHIND=True, WRITE_MAX_DELAY_MS=200)
+    app.test_client().post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    with app.app_context():
+        writer = habit_app.get_group_commit_writer()
+        futures = [writer.submit((habit_id, 2.0, 1, '2024-01-01', None, None), f'key-{n}')
+                   for n, habit_id in enumerate([1, 2 ** 64, 1])]
+        held_writer.set()
+        assert futures[0].result(5)[1] is False and futures[2].result(5)[1] is False
+        with pytest.raises(OverflowError):
+            futures[1].result(5)
+    assert app.test_client().get('/api/sync').get_json()['balance'] == 4.0
+
+def test_pooled_connection_is_released_while_waiting_for_the_writer(habit_app, make_app, monkeypatch):
+    client = make_app(WRITE_BEHIND=True).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    
+    # Note whether the request holds a connection when it starts waiting
+    holding = []
+    class WatchedFuture(Future):
+        def result(self, timeout=None):
+            holding.append('db' in habit_app.g)
+            return super().result(timeout)
+    
+    submit = habit_app.GroupCommitWriter.submit
+    def watched_submit(writer, row, key):
+        watched = WatchedFuture()
+        submit(writer, row, key).add_done_callback(lambda future: watched.set_result(future.result()))
+        return watched
+    monkeypatch.setattr(habit_app.GroupCommitWriter, 'submit', watched_submit)
+    
+    assert client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '2'}).status_code == 200
+    assert holding == [False]
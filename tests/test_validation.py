@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+JSON = {'Accept': 'application/json'}
+
+@pytest.mark.parametrize('amount', ['nan', 'inf', '-inf', 'NaN', 'Infinity'])
+@pytest.mark.parametrize('route', ['/add_habit', '/add_bounty', '/add_transaction'])
+def test_non_finite_amounts_are_rejected(client, route, amount):
+    response = client.post(route, headers=JSON, data={'description': 'Run', 'habit_id': '1', 'amount': amount})
+    assert response.status_code == 400
+
+def test_non_finite_amounts_are_rejected_in_write_behind_mode(make_app):
+    client = make_app(WRITE_BEHIND=True).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    assert client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': 'nan'}).status_code == 400
+    assert client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '2'}).status_code == 200
+    assert client.get('/api/sync').get_json()['balance'] == 2.0
+
+def test_bulk_import_reports_non_finite_amounts(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    records = [{'habit_id': 1, 'amount': 'nan'}, {'habit_id': 1, 'amount': 'inf'}, {'habit_id': 1, 'amount': 3}]
+    result = client.post('/api/transactions/bulk', data=json.dumps(records), content_type='application/json').get_json()
+    assert (result['inserted'], result['failed']) == (1, 2)
+    assert [error['row'] for error in result['errors']] == [1, 2]
+
+def test_bulk_import_reports_wrongly_typed_fields(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    records = [{'habit_id': 1, 'date': []}, {'habit_id': 1, 'date': ['2024-01-01']}, {'habit_id': 1, 'date': {}},
+               {'habit_id': 1, 'date': 20240101}, {'habit_id': [1]}, {'habit_id': 1, 'quantity': {}},
+               {'habit_id': 1, 'amount': [2]}, {'habit_id': 1, 'date': '2024-01-02'}]
+    response = client.post('/api/transactions/bulk', data=json.dumps(records), content_type='application/json')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['inserted'], result['failed']) == (1, 7)
+    assert [error['row'] for error in result['errors']] == [1, 2, 3, 4, 5, 6, 7]
+
+def test_bulk_import_reports_out_of_range_integers(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    records = [{'habit_id': 1, 'quantity': 10 ** 20}, {'habit_id': 2 ** 63}, {'habit_id': str(10 ** 30)},
+               {'habit_id': 1, 'quantity': 3}]
+    response = client.post('/api/transactions/bulk', data=json.dumps(records), content_type='application/json')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['inserted'], result['failed']) == (1, 3)
+    assert [error['error'] for error in result['errors']] == [
+        'quantity is out of range', 'habit_id is out of range', 'habit_id is out of range']
+
+@pytest.mark.parametrize('values', [
+    {'habit_id': str(2 ** 63)}, {'habit_id': '1', 'quantity': str(2 ** 63)},
+    {'habit_id': '1', 'quantity': '0'}, {'habit_id': '1', 'quantity': '-3'},
+])
+@pytest.mark.parametrize('write_behind', [False, True])
+def test_out_of_range_completions_are_rejected(make_app, values, write_behind):
+    client = make_app(WRITE_BEHIND=write_behind).test_client()
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '2'})
+    assert client.post('/add_transaction', headers=JSON, data={'amount': '2', **values}).status_code == 400
+    assert client.get('/api/sync').get_json()['balance'] == 0
+
+# amount and quantity can each be fine while their product overflows to inf
+def test_completion_totals_must_be_finite(client):
+    client.post('/add_habit', headers=JSON, data={'description': 'Run', 'amount': '1e308'})
+    response = client.post('/add_transaction', headers=JSON, data={'habit_id': '1', 'amount': '1e308', 'quantity': '100'})
+    assert response.status_code == 400
+    
+    records = [{'habit_id': 1, 'quantity': 100}, {'habit_id': 1, 'amount': '1e308', 'quantity': 10}]
+    result = client.post('/api/transactions/bulk', data=json.dumps(records), content_type='application/json').get_json()
+    assert (result['inserted'], result['failed']) == (0, 2)
+    
+    results = client.post('/api/sync', json={'operations': [
+        {'key': 'k', 'op': 'add_transaction', 'habit_id': 1, 'quantity': 100}]}).get_json()['results']
+    assert results[0]['error'] == 'amount times quantity is too large'
+    assert client.get('/api/sync').get_json()['balance'] == 0